@@ -0,0 +1 @@
+"""Standalone benchmarks. Run individual modules with `python -m benchmarks.<name>`."""
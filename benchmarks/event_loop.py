@@ -0,0 +1,31 @@
+"""
+Compares asyncio's default event loop with uvloop on the whole pipeline, by running the load harness on each.
+
+Each loop gets a fresh process, with the same tweets, fakes and rate (any extra arguments are passed on).
+uvloop has to be installed (`pip install uvloop`).
+
+    python -m benchmarks.event_loop [--tweets 500] [--rate 200] [...]
+"""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+import typing as t
+
+LOOPS: t.Final = ("default", "uvloop")
+DEFAULT_ARGUMENTS: t.Final = ["--tweets", "500", "--rate", "200", "--skinport-latency", "0.05"]
+
+
+def main() -> None:
+    arguments = sys.argv[1:] or DEFAULT_ARGUMENTS
+
+    for loop in LOOPS:
+        print(f"--- {loop} ---", flush=True)
+        command = [sys.executable, "-m", "benchmarks.loadtest", *arguments, "--loop", loop]
+        subprocess.run(command, check=True)  # noqa: S603
+        print(flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Compares inspect link extraction: the regex over every text (as `parse_tweet` used to do it)
+against `extract.item_keys`, which only runs a regex where the inspect link marker was found.
+
+The corpora are generated: realistic search results, texts without links, tweets crammed with links,
+and adversarial long texts full of near misses.
+
+    python -m benchmarks.extract [texts per corpus]
+"""
+
+from __future__ import annotations
+
+import random
+import sys
+import timeit
+import typing as t
+
+from csinspect import extract
+from csinspect.config import TWITTER_INSPECT_URL_REGEX
+from csinspect.typings import ItemKey
+
+TEXTS: t.Final = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+REPEAT: t.Final = 5
+PREFIXES: t.Final = (
+    "steam://rungame/730/76561202255233023/+csgo_econ_action_preview%20",
+    "steam://rungame/730/76561202255233023/+csgo_econ_action_preview ",
+    "steam://rungame/730/76561202255233023/ cs2_econ_action_preview%20",
+    "steam://rungame/730/76561202255233023/+cs_econ_action_preview%20",
+    "csgo_econ_action_preview%20",
+)
+FILLER: t.Final = (
+    "pc?",
+    "price check on this one",
+    "how much would you pay for this 🔥",
+    "#csgo #cs2 #skins",
+    "trading for knives, dm me",
+    "low float, nice pattern",
+    "https://t.co/AbCdEf123",
+    "@someone thoughts?",
+)
+
+rng = random.Random(0)  # noqa: S311
+
+
+def link() -> str:
+    owner = f"S7656119{rng.randrange(10**9):09d}" if rng.random() < 0.8 else f"M{rng.randrange(10**19)}"
+    return f"{rng.choice(PREFIXES)}{owner}A{rng.randrange(10**11)}D{rng.randrange(10**19)}"
+
+
+def filler() -> str:
+    return " ".join(rng.choices(FILLER, k=rng.randint(1, 4)))
+
+
+def realistic() -> str:
+    links = [link() for _ in range(rng.choice((1, 1, 1, 2, 3)))]
+    # the same item posted twice, in a different spelling
+    if rng.random() < 0.1:
+        links.append(links[0].replace("%20", " ", 1).replace("csgo_", "cs2_", 1))
+    return f"{filler()} {' '.join(links)}"
+
+
+def without_links() -> str:
+    return f"{filler()} steam://rungame/730/76561202255233023/+csgo_app_demo {filler()}"
+
+
+def dense() -> str:
+    return "\n".join(link() for _ in range(20))
+
+
+def adversarial() -> str:
+    near_misses = (
+        "csgo_econ_action_preview%20S",
+        "cs_econ_action_preview A1D1",
+        "xx_econ_action_preview%20S1A1D1",
+        "steam://rungame/730/" + "7" * 40,
+        "csgo_econ_action_preview%20S" + "1" * 30 + "A1D1",
+    )
+    return " ".join(rng.choice(near_misses) for _ in range(150))
+
+
+CORPORA: t.Final = {
+    "realistic": [realistic() for _ in range(TEXTS)],
+    "no links": [without_links() for _ in range(TEXTS)],
+    "dense": [dense() for _ in range(TEXTS)],
+    "adversarial": [adversarial() for _ in range(TEXTS)],
+}
+
+
+def regex_keys(text: str) -> tuple[ItemKey, ...]:
+    keys = []
+    for match in TWITTER_INSPECT_URL_REGEX.finditer(text):
+        groups = match.groupdict()
+        owner = groups["S"] or groups["M"]
+        keys.append(ItemKey(owner[1:], groups["A"][1:], groups["D"][1:], market=owner[0] == "M"))
+        # like parse_match, which also formatted the link
+        extract.inspect_link(keys[-1])
+    return tuple(dict.fromkeys(keys))[:8]
+
+
+def regex_keys_each(texts: list[str]) -> list[tuple[ItemKey, ...]]:
+    return [regex_keys(text) for text in texts]
+
+
+def item_keys_each(texts: list[str]) -> list[tuple[ItemKey, ...]]:
+    return [extract.item_keys(text) for text in texts]
+
+
+def measure(function: t.Callable[[list[str]], object], texts: list[str]) -> float:
+    runs = max(1, 20_000 // len(texts))
+    return min(timeit.repeat(lambda: function(texts), number=runs, repeat=REPEAT)) / runs / len(texts)
+
+
+def main() -> None:
+    print(f"{TEXTS} texts per corpus, best of {REPEAT}\n")
+    print(f"{'corpus':<12} {'avg chars':>9} {'regex us':>9} {'keys us':>9} {'speedup':>8}")
+
+    for name, texts in CORPORA.items():
+        if name != "adversarial":
+            # ids longer than 64 bits are rejected by design, so only the adversarial corpus may differ
+            expected = [regex_keys(text) for text in texts]
+            assert item_keys_each(texts) == expected, name  # noqa: S101
+
+        regex = measure(regex_keys_each, texts)
+        keys = measure(item_keys_each, texts)
+
+        chars = sum(map(len, texts)) / len(texts)
+        print(f"{name:<12} {chars:>9.0f} {regex * 1e6:>9.2f} {keys * 1e6:>9.2f} {regex / keys:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
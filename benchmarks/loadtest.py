@@ -0,0 +1,409 @@
+"""
+Replays tweets through the real CSInspect pipeline against local stand-ins for Twitter, Skinport and redis,
+then reports throughput, per-stage latency percentiles and peak memory.
+
+Twitter's v2 API (search and create_tweet), its v1 media upload, Skinport's screenshot endpoint and the CDN
+the screenshots are served from are faked by one aiohttp server running on its own thread (and event loop),
+so the fakes don't compete with the pipeline for the loop being measured.
+
+Tweets are read from a JSONL corpus of captured tweets (one v2 tweet object per line) or generated.
+Their ids are rewritten to fresh snowflakes, so no tweet is skipped as answered by an earlier run.
+
+    python -m benchmarks.loadtest [--corpus tweets.jsonl] [--tweets 500] [--rate 50] [--source live|search]
+                                  [--skinport-latency 0.2] [--skinport-error-rate 0.02] [--skinport-redirect-rate 0.5]
+                                  [--redis fake|local] [--loop default|uvloop]
+
+`--source live` hands every tweet to the live stream's callback as it arrives,
+`--source search` posts it to the fake search API, which the search loop pages through every `--search-interval`.
+`--redis fake` keeps everything in-process (requires `fakeredis`), `--redis local` uses the redis configured in `.env`.
+`--loop uvloop` runs the pipeline on uvloop (requires `uvloop`), see `benchmarks.event_loop` to compare both loops.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import pathlib
+import random
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+import typing as t
+import zlib
+
+import aiohttp
+import tweepy
+import yarl
+from aiohttp import web
+from loguru import logger
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+# given by benchmarks.startup to the bot processes it starts, so they talk to its fakes
+FAKE_URL: t.Final = os.getenv("LOADTEST_FAKE_URL") or f"http://127.0.0.1:{free_port()}"
+TWITTER_API_URL: t.Final = "https://api.twitter.com"
+TWITTER_EPOCH_MS: t.Final = 1288834974657
+
+# read when csinspect is imported, so they're set first
+os.environ |= {
+    "TWITTER_MEDIA_UPLOAD_URL": f"{FAKE_URL}/1.1/media/upload.json",
+    "ENABLE_TWITTER_LIVE": "false",
+    "DEV_MODE": "false",
+    "SILENT_MODE": "false",
+}
+for name in (
+    "TWITTER_BEARER_TOKEN",
+    "TWITTER_API_KEY",
+    "TWITTER_API_KEY_SECRET",
+    "TWITTER_ACCESS_TOKEN",
+    "TWITTER_ACCESS_TOKEN_SECRET",
+):
+    os.environ.setdefault(name, "loadtest")
+
+from csinspect import metrics, monitor, redis_
+from csinspect.csinspect import CSInspect
+from csinspect.providers import ScreenshotEngine, SkinportProvider
+
+STAGES: t.Final = (
+    "queue_wait",
+    "parse_tweet",
+    "tweet_state_lookup",
+    "screenshot",
+    "download",
+    "image_processing",
+    "media_upload",
+    "create_tweet",
+    "process_tweet",
+)
+
+
+def png(width: int, height: int, *, seed: int = 0) -> bytes:
+    """A noisy (so barely compressible, like a real render) RGB PNG of roughly screenshot size."""
+    rng = random.Random(seed)  # noqa: S311
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+class FakeServices:
+    """Twitter, Skinport and the screenshot CDN, answering from memory."""
+
+    def __init__(
+        self: FakeServices, *, skinport_latency: float, skinport_error_rate: float, skinport_redirect_rate: float
+    ) -> None:
+        self.skinport_latency = skinport_latency
+        self.skinport_error_rate = skinport_error_rate
+        self.skinport_redirect_rate = skinport_redirect_rate
+        self.rng = random.Random(0)  # noqa: S311
+        self.screenshot = png(800, 450)
+        self.ids = itertools.count(1)
+        # newest first, like the search API
+        self.posted: list[dict[str, t.Any]] = []
+        self.replies = 0
+        self.uploads = 0
+        self.screenshots = 0
+        self.skinport_errors = 0
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+        # Twitter accepts APPEND segments of up to 5 MiB (aiohttp's default limit is 1 MiB)
+        self.app = web.Application(client_max_size=5 * 1024 * 1024)
+        self.app.router.add_get("/2/tweets/search/recent", self.search)
+        self.app.router.add_post("/2/tweets", self.create_tweet)
+        self.app.router.add_route("*", "/1.1/media/upload.json", self.media_upload)
+        self.app.router.add_get("/direct", self.skinport)
+        self.app.router.add_get("/cdn/{name}", self.cdn)
+
+    @staticmethod
+    def rate_limit_headers() -> dict[str, str]:
+        return {
+            "x-rate-limit-limit": "100000",
+            "x-rate-limit-remaining": "99999",
+            "x-rate-limit-reset": str(int(time.time()) + 15 * 60),
+        }
+
+    def post(self: FakeServices, tweet: dict[str, t.Any]) -> None:
+        self.posted.insert(0, tweet)
+
+    async def search(self: FakeServices, request: web.Request) -> web.Response:
+        since_id = int(request.query.get("since_id", 0))
+        max_results = int(request.query.get("max_results", 100))
+        offset = int(request.query.get("next_token", 0))
+
+        matching = [tweet for tweet in self.posted if int(tweet["id"]) > since_id]
+        page = matching[offset : offset + max_results]
+
+        meta: dict[str, t.Any] = {"result_count": len(page)}
+        if matching:
+            meta["newest_id"] = matching[0]["id"]
+        if offset + max_results < len(matching):
+            meta["next_token"] = str(offset + max_results)
+
+        body = {"data": page, "meta": meta} if page else {"meta": meta}
+        return web.json_response(body, headers=self.rate_limit_headers())
+
+    async def create_tweet(self: FakeServices, request: web.Request) -> web.Response:
+        await request.read()
+        self.replies += 1
+        return web.json_response(
+            {"data": {"id": str(next(self.ids)), "text": ""}}, status=201, headers=self.rate_limit_headers()
+        )
+
+    async def media_upload(self: FakeServices, request: web.Request) -> web.Response:
+        await request.read()
+        command = request.query.get("command")
+        if command == "APPEND":
+            return web.Response(status=204, headers=self.rate_limit_headers())
+
+        if command in ("FINALIZE", "STATUS"):
+            media_id = request.query["media_id"]
+        else:
+            media_id = str(next(self.ids))
+            self.uploads += 1
+        return web.json_response({"media_id": int(media_id), "media_id_string": media_id})
+
+    async def skinport(self: FakeServices, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.rng.expovariate(1 / self.skinport_latency) if self.skinport_latency else 0)
+
+        if self.rng.random() < self.skinport_error_rate:
+            self.skinport_errors += 1
+            return web.Response(status=self.rng.choice((429, 500, 502)))
+
+        link = request.query["link"]
+        # Skinport first redirects to a reformatted inspect link, some of the time
+        if "formatted" not in request.query and self.rng.random() < self.skinport_redirect_rate:
+            location = request.url.with_query(link=link, formatted="1")
+            return web.Response(status=308, headers={"Location": str(location)})
+
+        self.screenshots += 1
+        return web.Response(status=302, headers={"Location": f"{FAKE_URL}/cdn/{zlib.crc32(link.encode())}.png"})
+
+    async def cdn(self: FakeServices, _: web.Request) -> web.Response:
+        return web.Response(body=self.screenshot, content_type="image/png")
+
+    def start(self: FakeServices) -> None:
+        started = threading.Event()
+
+        def serve() -> None:
+            self.loop = asyncio.new_event_loop()
+            runner = web.AppRunner(self.app, access_log=None)
+            self.loop.run_until_complete(runner.setup())
+            url = yarl.URL(FAKE_URL)
+            self.loop.run_until_complete(web.TCPSite(runner, url.host, url.port).start())
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=serve, name="loadtest-fakes", daemon=True).start()
+        started.wait()
+
+
+class FakeTwitterSession:
+    """Stands in for the aiohttp session tweepy sends v2 requests through, pointing them at the fake API."""
+
+    def __init__(self: FakeTwitterSession, session: aiohttp.ClientSession) -> None:
+        self.session = session
+
+    def request(self: FakeTwitterSession, method: str, url: str | yarl.URL, **kwargs: t.Any) -> t.Any:  # noqa: ANN401
+        url = yarl.URL(str(url).replace(TWITTER_API_URL, FAKE_URL, 1), encoded=True)
+        return self.session.request(method, url, **kwargs)
+
+
+def synthetic_tweets(count: int) -> t.Iterator[dict[str, t.Any]]:
+    rng = random.Random(1)  # noqa: S311
+    for _ in range(count):
+        links = [
+            "steam://rungame/730/76561202255233023/+csgo_econ_action_preview%20"
+            f"S7656119{rng.randrange(10**9):09d}A{rng.randrange(10**11)}D{rng.randrange(10**19)}"
+            for _ in range(rng.choice((1, 1, 1, 2, 3, 5)))
+        ]
+        yield {"text": f"price check? {' '.join(links)}", "author_id": str(rng.randrange(10**18))}
+
+
+def corpus_tweets(path: pathlib.Path, count: int | None) -> t.Iterator[dict[str, t.Any]]:
+    with path.open() as file:
+        lines = (line for line in file if line.strip())
+        for line in itertools.islice(lines, count):
+            data = json.loads(line)
+            # captured as a full response, or as the tweet alone
+            yield data.get("data", data)
+
+
+def with_fresh_ids(tweets: t.Iterable[dict[str, t.Any]]) -> t.Iterator[dict[str, t.Any]]:
+    rng = random.Random(2)  # noqa: S311
+    for sequence, tweet in enumerate(tweets):
+        timestamp = int(time.time() * 1000) - TWITTER_EPOCH_MS
+        snowflake = (
+            timestamp << redis_.TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT | (sequence & 0xFFF) << 10 | rng.getrandbits(10)
+        )
+        yield {
+            **tweet,
+            "id": str(snowflake),
+            "author_id": str(tweet.get("author_id") or rng.randrange(10**18)),
+            "conversation_id": str(snowflake),
+            "edit_history_tweet_ids": [str(snowflake)],
+        }
+
+
+async def replay(
+    cs: CSInspect, fakes: FakeServices, tweets: list[dict[str, t.Any]], *, rate: float, source: str
+) -> float:
+    """Delivers the tweets at `rate` per second, returning when they've all been delivered."""
+    started_at = time.perf_counter()
+    lag = 0.0
+
+    for index, tweet in enumerate(with_fresh_ids(tweets)):
+        delay = started_at + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+
+        if source == "live":
+            # tweepy awaits the callback before reading the next tweet, so a full queue slows delivery down
+            await cs.on_tweet(tweepy.Tweet(tweet))
+        else:
+            fakes.post(tweet)
+
+    return lag
+
+
+async def search(cs: CSInspect, interval: float, done: asyncio.Event) -> None:
+    while True:
+        finished = done.is_set()
+        tweets, checkpoint = await cs.find_tweets()
+        await cs.process_tweets(tweets, checkpoint=True)
+        await redis_.update_search_checkpoint(checkpoint)
+        if finished:
+            return
+        await asyncio.sleep(interval)
+
+
+def report(tweets: int, elapsed: float, lag: float, fakes: FakeServices, loop_stats: monitor.LoopStats) -> None:
+    print(f"\n{tweets} tweets in {elapsed:.2f}s: {tweets / elapsed:.1f} tweets/s (max delivery lag {lag:.2f}s)")
+
+    outcomes = ", ".join(f"{key[0]} {value:.0f}" for key, value in sorted(metrics.TWEETS.values.items()))
+    print(f"outcomes: {outcomes or 'none'}")
+    print(
+        f"fakes: {fakes.replies} replies, {fakes.uploads} uploads, {fakes.screenshots} screenshots, "
+        f"{fakes.skinport_errors} skinport errors"
+    )
+
+    def row(name: str, histogram: metrics.Histogram, **labels: str) -> None:
+        key = histogram.label_values(labels)
+        count = sum(histogram.counts.get(key, ()))
+        if not count:
+            return
+        mean = histogram.sums[key] / count
+        p50, p95, p99 = (histogram.quantile(quantile, **labels) or 0.0 for quantile in (0.5, 0.95, 0.99))
+        print(f"{name:<32} {count:>7} {mean * 1000:>9.1f} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {p99 * 1000:>9.1f}")
+
+    print(f"\n{'stage':<32} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage in STAGES:
+        row(stage, metrics.STAGE_SECONDS, stage=stage)
+    for provider, outcome in sorted(metrics.SCREENSHOT_PROVIDER_SECONDS.counts):
+        row(f"{provider} ({outcome})", metrics.SCREENSHOT_PROVIDER_SECONDS, provider=provider, outcome=outcome)
+    row("event loop lag", monitor.LOOP_LAG_SECONDS)
+    print(f"event loop: {loop_stats.max_lag * 1000:.1f}ms max lag, blocked {loop_stats.blocked} times")
+
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    print(f"\npeak rss: {peak / 1024 / 1024:.1f} MiB")
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.redis == "fake":
+        if importlib.util.find_spec("fakeredis") is None:
+            msg = "--redis fake requires the `fakeredis` package (or use --redis local)"
+            raise SystemExit(msg)
+
+        import fakeredis
+
+        fake_redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        redis_.get_redis = lambda: fake_redis  # type: ignore[assignment]
+
+    if args.corpus:
+        tweets = list(corpus_tweets(args.corpus, args.tweets))
+    else:
+        tweets = list(synthetic_tweets(args.tweets or 500))
+
+    fakes = FakeServices(
+        skinport_latency=args.skinport_latency,
+        skinport_error_rate=args.skinport_error_rate,
+        skinport_redirect_rate=args.skinport_redirect_rate,
+    )
+    fakes.start()
+
+    cs = CSInspect(role="all")
+    twitter_session = aiohttp.ClientSession()
+    cs.twitter.v2.session = FakeTwitterSession(twitter_session)  # type: ignore[assignment]
+    cs.screenshot.engine = ScreenshotEngine([SkinportProvider(cs.http, url=f"{FAKE_URL}/direct")])
+    cs.register_metrics()
+    loop_monitor = cs.loop_monitor or monitor.LoopMonitor()
+
+    loop = type(asyncio.get_running_loop())
+    print(
+        f"replaying {len(tweets)} tweets at {args.rate}/s from {args.source} "
+        f"({args.redis} redis, {loop.__module__}.{loop.__name__})"
+    )
+    loop_monitor.start()
+    cs.work_queue.start()
+    started_at = time.perf_counter()
+
+    try:
+        if args.source == "live":
+            lag = await replay(cs, fakes, tweets, rate=args.rate, source="live")
+        else:
+            delivered = asyncio.Event()
+            searching = asyncio.create_task(search(cs, args.search_interval, delivered))
+            lag = await replay(cs, fakes, tweets, rate=args.rate, source="search")
+            delivered.set()
+            await searching
+
+        await cs.work_queue.join()
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await loop_monitor.stop()
+        await cs.close()
+        await twitter_session.close()
+
+    report(len(tweets), elapsed, lag, fakes, loop_monitor.stats)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", type=pathlib.Path, help="JSONL of captured tweets (generated if not given)")
+    parser.add_argument("--tweets", type=int, help="tweets to replay (default: the whole corpus, or 500)")
+    parser.add_argument("--rate", type=float, default=50, help="tweets delivered per second")
+    parser.add_argument("--source", choices=("live", "search"), default="live")
+    parser.add_argument("--search-interval", type=float, default=1.0, help="seconds between searches")
+    parser.add_argument("--skinport-latency", type=float, default=0.2, help="mean seconds per screenshot")
+    parser.add_argument("--skinport-error-rate", type=float, default=0.02, help="fraction answered with 429/5xx")
+    parser.add_argument("--skinport-redirect-rate", type=float, default=0.5, help="fraction redirected with a 308")
+    parser.add_argument("--redis", choices=("fake", "local"), default="fake")
+    parser.add_argument("--loop", choices=("default", "uvloop"), default="default")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logger.remove()
+    # failed screenshots are expected with --skinport-error-rate, only unexpected errors are shown
+    logger.add(sys.stderr, level="ERROR")
+    args = parse_args()
+    with asyncio.Runner(loop_factory=monitor.loop_factory(use_uvloop=args.loop == "uvloop")) as runner:
+        runner.run(main(args))
@@ -0,0 +1,109 @@
+"""
+Compares the old JSON read-modify-write tweet state update with the atomic hash/Lua update.
+
+Resets the server's command stats, so it only runs against a redis given explicitly for benchmarking
+(never the one the bot uses), using a throwaway range of tweet ids.
+
+    BENCHMARK_REDIS_URL=redis://localhost:6379/15 python -m benchmarks.redis_tweet_state [updates]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import time
+import typing as t
+from datetime import datetime
+from types import SimpleNamespace
+
+from redis.asyncio import Redis
+
+from csinspect import redis_
+from csinspect.config import REDIS_EX
+
+if t.TYPE_CHECKING:
+    from csinspect.tweet import TweetWithInspectLink
+
+BENCHMARK_REDIS_URL: t.Final = os.getenv("BENCHMARK_REDIS_URL")
+UPDATES: t.Final = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+CONCURRENCY: t.Final = 50
+TWEET_ID_OFFSET: t.Final = 9_000_000_000_000_000_000
+
+
+async def legacy_update_tweet_state(redis: Redis[str], tweet_id: int, *, successful: bool) -> None:
+    """The update as it was implemented before: GET, decode, increment, SET."""
+    data: dict[str, t.Any] = {"successful": successful, "time": datetime.now().isoformat()}
+
+    if not successful:
+        value = await redis.get(f"tweet:{tweet_id}")
+        if value:
+            data["failed_attempts"] = json.loads(value).get("failed_attempts", 0) + 1
+
+    await redis.set(name=f"tweet:{tweet_id}", value=json.dumps(data), ex=REDIS_EX)
+
+
+async def server_stats(redis: Redis[str]) -> tuple[int, int]:
+    """Commands the server ran since the stats were reset, and the microseconds it spent on them."""
+    stats = await redis.info("commandstats")
+    return sum(int(command["calls"]) for command in stats.values()), sum(
+        int(command["usec"]) for command in stats.values()
+    )
+
+
+async def run(name: str, redis: Redis[str], update: t.Callable[[int], t.Awaitable[None]]) -> None:
+    tweet_ids = [TWEET_ID_OFFSET + index for index in range(UPDATES)]
+    await redis.delete(*(f"tweet:{tweet_id}" for tweet_id in tweet_ids))
+    await redis.config_resetstat()
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    for tweet_id in tweet_ids:
+        await update(tweet_id)
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    commands, server = await server_stats(redis)
+
+    # concurrent failures for one tweet: every increment should survive
+    race_id = TWEET_ID_OFFSET - 1
+    await redis.delete(f"tweet:{race_id}")
+    await update(race_id)
+    await asyncio.gather(*(update(race_id) for _ in range(CONCURRENCY)))
+    (state,) = await redis_.tweet_states([t.cast("TweetWithInspectLink", SimpleNamespace(id=race_id))])
+    failed_attempts = state.failed_attempts if state else 0
+
+    print(
+        f"{name:<8} {commands / UPDATES:4.1f} commands/update | "
+        f"{wall / UPDATES * 1e6:8.1f} us/update wall | "
+        f"{cpu / UPDATES * 1e6:8.1f} us/update client cpu | "
+        f"{server / UPDATES:6.1f} us/update server cpu | "
+        f"{failed_attempts}/{CONCURRENCY} concurrent increments kept"
+    )
+
+    await redis.delete(*(f"tweet:{tweet_id}" for tweet_id in (*tweet_ids, race_id)))
+
+
+async def main() -> None:
+    if not BENCHMARK_REDIS_URL:
+        msg = "BENCHMARK_REDIS_URL is required: a redis only used for benchmarks, since its stats are reset"
+        raise SystemExit(msg)
+
+    redis: Redis[str] = Redis.from_url(BENCHMARK_REDIS_URL, decode_responses=True)
+    # redis_.update_tweet_state and redis_.tweet_states use it too
+    redis_.get_redis = lambda: redis  # type: ignore[assignment]
+
+    async def legacy(tweet_id: int) -> None:
+        await legacy_update_tweet_state(redis, tweet_id, successful=False)
+
+    async def atomic(tweet_id: int) -> None:
+        tweet = t.cast("TweetWithInspectLink", SimpleNamespace(id=tweet_id, url=str(tweet_id)))
+        await redis_.update_tweet_state(tweet, successful=False)
+
+    print(f"{UPDATES} failed-attempt updates each")
+    await run("json", redis, legacy)
+    await run("atomic", redis, atomic)
+
+    await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
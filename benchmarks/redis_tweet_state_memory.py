@@ -0,0 +1,115 @@
+"""
+Compares how much redis memory each tweet state layout takes: legacy JSON strings, a hash per tweet and compact buckets.
+
+Runs against the redis configured in `.env` (REDIS_HOST etc.) using a throwaway range of tweet ids.
+Tweet ids are generated `interval` seconds apart, which decides how full the compact buckets get.
+
+    python -m benchmarks.redis_tweet_state_memory [tweets] [interval]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import sys
+import time
+import typing as t
+from datetime import datetime
+
+from csinspect import redis_
+from csinspect.config import REDIS_EX, TWEET_STATE_BUCKET_SECONDS
+from csinspect.typings import TweetResponseState
+
+if t.TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
+TWEETS: t.Final = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+INTERVAL: t.Final = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+BATCH_SIZE: t.Final = 1000
+TWITTER_EPOCH_MS: t.Final = 1288834974657
+# a year ago, well away from any real tweet state
+START_MS: t.Final = int(time.time() * 1000) - TWITTER_EPOCH_MS - 1000 * 60 * 60 * 24 * 365
+
+
+def tweet_ids() -> list[int]:
+    rng = random.Random(0)  # noqa: S311
+    return [
+        (START_MS + int(index * INTERVAL * 1000)) << redis_.TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT | rng.getrandbits(22)
+        for index in range(TWEETS)
+    ]
+
+
+def write_json(pipeline: Pipeline[str], tweet_id: int, now: datetime) -> list[str]:
+    data = {"successful": True, "time": now.isoformat(), "failed_attempts": 1}
+    pipeline.set(f"tweet:{tweet_id}", json.dumps(data), ex=REDIS_EX)
+    return [f"tweet:{tweet_id}"]
+
+
+def write_hash(pipeline: Pipeline[str], tweet_id: int, now: datetime) -> list[str]:
+    pipeline.hset(f"tweet:{tweet_id}", mapping={"successful": 1, "failed_attempts": 1, "time": now.isoformat()})
+    pipeline.expire(f"tweet:{tweet_id}", REDIS_EX)
+    return [f"tweet:{tweet_id}"]
+
+
+def write_compact(pipeline: Pipeline[str], tweet_id: int, now: datetime) -> list[str]:
+    key, field = redis_.tweet_state_bucket(tweet_id)
+    packed = redis_.pack_tweet_state(TweetResponseState(successful=True, failed_attempts=1), epoch=int(now.timestamp()))
+    pipeline.hset(key, str(field), packed)
+    pipeline.expire(key, REDIS_EX)
+    return [key]
+
+
+async def used_memory(redis: Redis[str]) -> int:
+    info = await redis.info("memory")
+    return int(info["used_memory"])
+
+
+async def run(name: str, redis: Redis[str], write: t.Callable[[Pipeline[str], int, datetime], list[str]]) -> None:
+    ids = tweet_ids()
+    now = datetime.now()
+    keys: set[str] = set()
+
+    before = await used_memory(redis)
+    for start in range(0, len(ids), BATCH_SIZE):
+        async with redis.pipeline(transaction=False) as pipeline:
+            for tweet_id in ids[start : start + BATCH_SIZE]:
+                keys.update(write(pipeline, tweet_id, now))
+            await pipeline.execute()
+    used = await used_memory(redis) - before
+
+    # O(1) reads: one lookup per tweet whatever the layout
+    sample = random.Random(1).sample(ids, min(len(ids), BATCH_SIZE))  # noqa: S311
+    start_read = time.perf_counter()
+    if name == "compact":
+        states = await redis_.compact_tweet_states_by_id(sample)
+    else:
+        states = await redis_.hash_tweet_states_by_id(sample)
+    read = time.perf_counter() - start_read
+    assert all(state == TweetResponseState(successful=True, failed_attempts=1) for state in states)  # noqa: S101
+
+    print(
+        f"{name:<8} {len(keys):>8} keys | "
+        f"{used / 1024 / 1024:8.2f} MiB | "
+        f"{used / TWEETS:6.1f} bytes/tweet | "
+        f"{read / len(sample) * 1e6:6.1f} us/read ({len(sample)} pipelined)"
+    )
+
+    for start in range(0, len(keys), BATCH_SIZE):
+        await redis.delete(*list(keys)[start : start + BATCH_SIZE])
+
+
+async def main() -> None:
+    redis = redis_.get_redis()
+
+    print(f"{TWEETS} tweet states, one every {INTERVAL}s ({TWEET_STATE_BUCKET_SECONDS}s buckets)")
+    await run("json", redis, write_json)
+    await run("hash", redis, write_hash)
+    await run("compact", redis, write_compact)
+
+    await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+"""
+Measures how fast a fresh bot process starts serving: how long importing it takes,
+and how long from starting the process until its first reply is posted.
+
+Import time is read from `python -X importtime -c "import csinspect.__main__"`, run `--runs` times.
+Time to first tweet starts the bot (role `all`, searching) in a fresh process against the load harness' fakes,
+with one tweet waiting in the fake search API, and waits for its reply (requires `fakeredis`).
+
+    python -m benchmarks.startup [--runs 5] [--skip-imports] [--skip-first-tweet]
+
+Only the standard library is imported here, the bot processes import everything they need themselves.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import importlib.util
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import typing as t
+
+if t.TYPE_CHECKING:
+    from benchmarks.loadtest import FakeServices
+
+IMPORT_COMMAND: t.Final = [sys.executable, "-X", "importtime", "-c", "import csinspect.__main__"]
+FIRST_TWEET_TIMEOUT: t.Final = 60.0
+# printed by the bot process, one line per milestone
+MILESTONE_PREFIX: t.Final = "STARTUP "
+PHASES: t.Final = (
+    ("interpreter", "spawned", "started"),
+    ("import csinspect", "started", "imported"),
+    # importing and setting up the fakes the harness points the bot at, not part of a real start
+    ("harness setup", "imported", "patched"),
+    ("build CSInspect", "patched", "ready"),
+    ("first tweet answered", "ready", "replied"),
+    ("total", "spawned", "replied"),
+)
+
+
+class ImportTimes(t.NamedTuple):
+    total: float
+    # seconds spent importing each top level package's own modules
+    packages: dict[str, float]
+
+
+def measure_imports() -> ImportTimes:
+    result = subprocess.run(IMPORT_COMMAND, capture_output=True, text=True, check=True)  # noqa: S603
+
+    total = 0.0
+    packages: collections.defaultdict[str, float] = collections.defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(own) / 1e6
+        if name.strip() == "csinspect.__main__":
+            total = int(cumulative) / 1e6
+
+    return ImportTimes(total, dict(packages))
+
+
+def report_imports(runs: int) -> None:
+    measured = sorted((measure_imports() for _ in range(runs)), key=lambda times: times.total)
+    median = measured[len(measured) // 2]
+
+    print(f"import csinspect.__main__: {median.total * 1000:.0f}ms median of {runs}", end=" ")
+    print(f"({measured[0].total * 1000:.0f}ms - {measured[-1].total * 1000:.0f}ms)\n")
+    print(f"{'package':<24} {'ms':>7}")
+    for package, seconds in sorted(median.packages.items(), key=lambda item: item[1], reverse=True)[:12]:
+        print(f"{package:<24} {seconds * 1000:>7.1f}")
+
+
+def milestone(name: str) -> None:
+    print(f"{MILESTONE_PREFIX}{json.dumps([name, time.time()])}", flush=True)
+
+
+def bot() -> None:
+    """The bot process: started like `python -m csinspect`, but pointed at the fakes before it runs."""
+    milestone("started")
+
+    from csinspect import monitor
+    from csinspect.csinspect import CSInspect
+
+    milestone("imported")
+
+    import aiohttp
+    import fakeredis
+    from loguru import logger
+
+    from benchmarks import loadtest
+    from csinspect import redis_
+    from csinspect.providers import ScreenshotEngine, SkinportProvider
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    fake_redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    redis_.get_redis = lambda: fake_redis  # type: ignore[assignment]
+
+    async def main() -> None:
+        twitter_session = aiohttp.ClientSession()
+        milestone("patched")
+
+        cs = CSInspect(role="all")
+        cs.twitter.v2.session = loadtest.FakeTwitterSession(twitter_session)  # type: ignore[assignment]
+        cs.screenshot.engine = ScreenshotEngine([SkinportProvider(cs.http, url=f"{loadtest.FAKE_URL}/direct")])
+        milestone("ready")
+
+        try:
+            await cs.run()
+        finally:
+            await twitter_session.close()
+
+    with asyncio.Runner(loop_factory=monitor.loop_factory()) as runner:
+        runner.run(main())
+
+
+def first_tweet(fakes: FakeServices, environment: dict[str, str]) -> dict[str, float]:
+    from benchmarks import loadtest
+
+    fakes.posted = list(loadtest.with_fresh_ids(loadtest.synthetic_tweets(1)))
+    fakes.replies = 0
+
+    spawned_at = time.time()
+    command = [sys.executable, "-m", "benchmarks.startup", "--bot"]
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.PIPE, text=True)  # noqa: S603
+
+    try:
+        while not fakes.replies:
+            if process.poll() is not None:
+                msg = f"The bot exited with {process.returncode} before replying"
+                raise RuntimeError(msg)
+            if time.time() - spawned_at > FIRST_TWEET_TIMEOUT:
+                msg = f"No reply within {FIRST_TWEET_TIMEOUT:.0f}s"
+                raise RuntimeError(msg)
+            time.sleep(0.005)
+        replied_at = time.time()
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=FIRST_TWEET_TIMEOUT)
+
+    milestones = {"spawned": spawned_at, "replied": replied_at}
+    for line in output.splitlines():
+        if line.startswith(MILESTONE_PREFIX):
+            name, at = json.loads(line.removeprefix(MILESTONE_PREFIX))
+            milestones[name] = at
+    return milestones
+
+
+def report_first_tweet(runs: int) -> None:
+    if importlib.util.find_spec("fakeredis") is None:
+        print("time to first tweet: skipped (requires the `fakeredis` package)")
+        return
+
+    from benchmarks import loadtest
+
+    fakes = loadtest.FakeServices(skinport_latency=0, skinport_error_rate=0, skinport_redirect_rate=0)
+    fakes.start()
+    # importing loadtest set the fakes' urls and placeholder credentials in os.environ
+    environment = os.environ | {
+        "LOADTEST_FAKE_URL": loadtest.FAKE_URL,
+        "CSINSPECT_ROLE": "all",
+        "ENABLE_TWITTER_SEARCH": "true",
+        "ENABLE_METRICS": "false",
+    }
+
+    measured = [first_tweet(fakes, environment) for _ in range(runs)]
+
+    print(f"time to first tweet: median of {runs}\n")
+    print(f"{'phase':<24} {'ms':>7}")
+    for phase, start, end in PHASES:
+        print(f"{phase:<24} {statistics.median(times[end] - times[start] for times in measured) * 1000:>7.0f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes measured, for each measurement")
+    parser.add_argument("--skip-imports", action="store_true", help="don't measure import time")
+    parser.add_argument("--skip-first-tweet", action="store_true", help="don't measure time to first tweet")
+    parser.add_argument("--bot", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.bot:
+        bot()
+        return
+
+    if not args.skip_imports:
+        report_imports(args.runs)
+    if not args.skip_imports and not args.skip_first_tweet:
+        print()
+    if not args.skip_first_tweet:
+        report_first_tweet(args.runs)
+
+
+if __name__ == "__main__":
+    main()
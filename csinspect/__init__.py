@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import sys
 
-import sentry_sdk
 from loguru import logger
 
 from csinspect.config import DEBUG_LOGGING, DEV_MODE, SENTRY_DSN, SENTRY_TRACES_SAMPLE_RATE
 
 if not DEV_MODE and SENTRY_DSN:
+    # imported only when it's used, it's the slowest import of them all
+    import sentry_sdk
+
     sentry_sdk.init(
         dsn=SENTRY_DSN,
         traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
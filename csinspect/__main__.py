@@ -4,6 +4,7 @@ import asyncio
 
 from loguru import logger
 
+from csinspect import monitor
 from csinspect.csinspect import CSInspect
 
 
@@ -15,5 +16,11 @@ async def main() -> None:
         logger.exception("Error Running CSInspect")
 
 
+def run() -> None:
+    # uvloop if USE_UVLOOP is set (and it's installed)
+    with asyncio.Runner(loop_factory=monitor.loop_factory()) as runner:
+        runner.run(main())
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
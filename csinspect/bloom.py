@@ -0,0 +1,108 @@
+"""A compact, time-windowed membership filter of tweet ids"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from csinspect.config import REDIS_EX, TWEET_FILTER_CAPACITY, TWEET_FILTER_ERROR_RATE
+
+
+class BloomFilter:
+    """
+    Answers "definitely not added" or "probably added" for integer ids.
+    Sized up front for `capacity` ids at a false positive rate of `error_rate`.
+    """
+
+    __slots__ = ("bits", "count", "hashes", "size")
+
+    def __init__(self: BloomFilter, capacity: int, error_rate: float) -> None:
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def positions(self: BloomFilter, value: int) -> list[int]:
+        # double hashing: k positions from two independent 64-bit halves of one digest
+        digest = hashlib.blake2b(value.to_bytes(8, "big", signed=True), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self: BloomFilter, value: int) -> None:
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self: BloomFilter, value: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+    @property
+    def nbytes(self: BloomFilter) -> int:
+        return len(self.bits)
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filters can't forget, so ids are added to the newest of a few generations
+    and the oldest generation is dropped every `window / (generations - 1)` seconds.
+    An id is remembered for at least `window` seconds (and at most one generation longer).
+    """
+
+    def __init__(
+        self: RotatingBloomFilter,
+        *,
+        capacity: int = TWEET_FILTER_CAPACITY,
+        error_rate: float = TWEET_FILTER_ERROR_RATE,
+        window: float = REDIS_EX,
+        generations: int = 2,
+    ) -> None:
+        if generations < 2:
+            msg = "At least two generations are required"
+            raise ValueError(msg)
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.span = window / (generations - 1)
+        self.generations: deque[BloomFilter] = deque(
+            (BloomFilter(capacity, error_rate) for _ in range(generations)), maxlen=generations
+        )
+        self.rotated_at = time.monotonic()
+
+    def rotate(self: RotatingBloomFilter) -> None:
+        now = time.monotonic()
+        while now - self.rotated_at >= self.span:
+            self.generations.append(BloomFilter(self.capacity, self.error_rate))
+            self.rotated_at += self.span
+
+    def add(self: RotatingBloomFilter, value: int) -> None:
+        self.rotate()
+        self.generations[-1].add(value)
+
+    def __contains__(self: RotatingBloomFilter, value: int) -> bool:
+        self.rotate()
+        return any(value in generation for generation in self.generations)
+
+    def __len__(self: RotatingBloomFilter) -> int:
+        return sum(generation.count for generation in self.generations)
+
+    @property
+    def nbytes(self: RotatingBloomFilter) -> int:
+        return sum(generation.nbytes for generation in self.generations)
+
+
+@dataclass(slots=True)
+class FilterStats:
+    # not in the filter, so redis wasn't asked
+    skipped: int = 0
+    # in the filter and confirmed as answered by redis
+    confirmed: int = 0
+    # in the filter but not answered according to redis
+    false_positives: int = 0
+
+    @property
+    def skip_rate(self: FilterStats) -> float:
+        total = self.skipped + self.confirmed + self.false_positives
+        return self.skipped / total if total else 0.0
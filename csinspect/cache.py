@@ -0,0 +1,132 @@
+"""An in-process LRU/TTL cache sitting in front of redis for screenshot results"""
+
+from __future__ import annotations
+
+import time
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from csinspect import redis_
+from csinspect.config import (
+    SCREENSHOT_CACHE_EVICTION,
+    SCREENSHOT_CACHE_MEMORY_TTL,
+    SCREENSHOT_CACHE_NEGATIVE_TTL,
+    SCREENSHOT_CACHE_REDIS_TTL,
+    SCREENSHOT_CACHE_SIZE,
+)
+from csinspect.typings import CachedScreenshot
+
+K = t.TypeVar("K")
+V = t.TypeVar("V")
+
+
+class TTLCache(t.Generic[K, V]):
+    """A bounded mapping whose entries expire. Evicts the least recently used (or oldest, for "fifo") entry when full."""
+
+    def __init__(self: TTLCache[K, V], maxsize: int, *, eviction: t.Literal["lru", "fifo"] = "lru") -> None:
+        self.maxsize = maxsize
+        self.eviction = eviction
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self: TTLCache[K, V]) -> int:
+        return len(self._data)
+
+    def get(self: TTLCache[K, V], key: K) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+
+        if self.eviction == "lru":
+            self._data.move_to_end(key)
+        return value
+
+    def set(self: TTLCache[K, V], key: K, value: V, *, ttl: float) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self: TTLCache[K, V], key: K) -> None:
+        self._data.pop(key, None)
+
+
+@dataclass(slots=True)
+class CacheStats:
+    memory_hits: int = 0
+    redis_hits: int = 0
+    negative_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self: CacheStats) -> float:
+        hits = self.memory_hits + self.redis_hits
+        total = hits + self.misses
+        return hits / total if total else 0.0
+
+
+class ScreenshotCache:
+    """Maps canonical inspect links to the image link Skinport rendered for them."""
+
+    def __init__(
+        self: ScreenshotCache,
+        *,
+        maxsize: int = SCREENSHOT_CACHE_SIZE,
+        eviction: str = SCREENSHOT_CACHE_EVICTION,
+        memory_ttl: int = SCREENSHOT_CACHE_MEMORY_TTL,
+        redis_ttl: int = SCREENSHOT_CACHE_REDIS_TTL,
+        negative_ttl: int = SCREENSHOT_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        self.memory: TTLCache[str, CachedScreenshot] = TTLCache(
+            maxsize, eviction="fifo" if eviction == "fifo" else "lru"
+        )
+        self.memory_ttl = memory_ttl
+        self.redis_ttl = redis_ttl
+        self.negative_ttl = negative_ttl
+        self.stats = CacheStats()
+
+    async def get(self: ScreenshotCache, inspect_link: str) -> CachedScreenshot | None:
+        cached = self.memory.get(inspect_link)
+
+        if cached is None:
+            try:
+                value = await redis_.cached_screenshot(inspect_link)
+            except RedisError:
+                logger.exception(f"SCREENSHOT CACHE LOOKUP FAILED: {inspect_link}")
+                value = None
+
+            if value is None:
+                self.stats.misses += 1
+                return None
+
+            cached = CachedScreenshot(image_link=value or None)
+            self.memory.set(inspect_link, cached, ttl=self.memory_ttl if value else self.negative_ttl)
+            self.stats.redis_hits += 1
+        else:
+            self.stats.memory_hits += 1
+
+        if cached.image_link is None:
+            self.stats.negative_hits += 1
+        return cached
+
+    async def set(self: ScreenshotCache, inspect_link: str, image_link: str | None) -> None:
+        memory_ttl = self.memory_ttl if image_link else self.negative_ttl
+        redis_ttl = self.redis_ttl if image_link else self.negative_ttl
+
+        self.memory.set(inspect_link, CachedScreenshot(image_link=image_link), ttl=memory_ttl)
+        try:
+            await redis_.cache_screenshot(inspect_link, image_link, ex=redis_ttl)
+        except RedisError:
+            logger.exception(f"SCREENSHOT CACHE STORE FAILED: {inspect_link}")
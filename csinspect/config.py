@@ -3,10 +3,10 @@ from __future__ import annotations
 import os
 import pathlib
 import re
+import socket
 import typing as t
 
 import dotenv
-import tweepy
 
 # --- paths ---
 PARENT_DIRECTORY: t.Final = pathlib.Path(__file__).parents[1]
@@ -20,6 +20,15 @@ ENABLE_TWITTER_SEARCH: t.Final = os.getenv("ENABLE_TWITTER_SEARCH", default="tru
 ENABLE_TWITTER_LIVE: t.Final = os.getenv("ENABLE_TWITTER_LIVE", default="true").lower() == "true"
 
 
+# --- roles ---
+# "all" runs everything in one process
+# "ingest" only finds tweets (live stream + search) and publishes them to the redis stream
+# "worker" only processes tweets claimed from the redis stream (scale out by adding workers)
+CSINSPECT_ROLE: t.Final = os.getenv("CSINSPECT_ROLE", default="all").lower()
+# identifies this replica as a stream consumer and as the ingest leader
+CSINSPECT_INSTANCE: t.Final = os.getenv("CSINSPECT_INSTANCE") or f"{socket.gethostname()}-{os.getpid()}"
+
+
 # --- other modes ---
 DEV_MODE: t.Final = os.getenv("DEV_MODE", default="false").lower() == "true"
 DEBUG_LOGGING: t.Final = os.getenv("DEBUG_LOGGING", default="false").lower() == "true"
@@ -28,13 +37,15 @@ DEV_ID: t.Final = int(os.environ["DEV_ID"]) if DEV_MODE else None
 SILENT_MODE: t.Final = os.getenv("SILENT_MODE", default="false").lower() == "true"
 
 # --- twitter ---
+# (value, tag), turned into `tweepy.StreamRule`s when the live stream starts
 TWITTER_LIVE_RULES: t.Final = [
-    tweepy.StreamRule('"+csgo_econ_action_preview"', tag="+csgo_econ_action_preview'"),
-    tweepy.StreamRule('"+cs2_econ_action_preview"', tag="+cs2_econ_action_preview'"),
-    tweepy.StreamRule('"+cs_econ_action_preview"', tag="+cs_econ_action_preview'"),
-    tweepy.StreamRule('"steam://rungame/730"', tag="steam://rungame/730"),
+    ('"+csgo_econ_action_preview"', "+csgo_econ_action_preview'"),
+    ('"+cs2_econ_action_preview"', "+cs2_econ_action_preview'"),
+    ('"+cs_econ_action_preview"', "+cs_econ_action_preview'"),
+    ('"steam://rungame/730"', "steam://rungame/730"),
 ]
 TWITTER_INSPECT_LINK_QUERY: t.Final = '"steam://rungame/730" OR "csgo_econ_action_preview"'
+# the links that are answered (csinspect/extract.py finds the same links without running this over every text)
 TWITTER_INSPECT_URL_REGEX: t.Final = re.compile(
     r"(steam://rungame/730/[0-9]+/(?:\+| ))?(?:csgo|cs2|cs)_econ_action_preview(?:%20| )(?:(?P<S>S[0-9]+)|(?P<M>M[0-9]+))(?P<A>A[0-9]+)(?P<D>D[0-9]+)"
 )
@@ -47,14 +58,144 @@ TWEET_USER_FIELDS: t.Final = ["id", "name", "username"]
 # 8 feels like a safe max (which will rarely be reached)
 # but will adjusted if needed
 TWEET_MAX_IMAGES: t.Final = 8
+# a reply can only carry 4 media, tweets with more items are replied to with grids of screenshots
+TWEET_MAX_MEDIA: t.Final = 4
 TWEET_MAX_FAILED_ATTEMPTS: t.Final = int(os.getenv("TWEET_MAX_FAILED_ATTEMPTS", default=25))
 TWEET_SEARCH_DELAY: t.Final = int(os.getenv("TWEET_SEARCH_DELAY", default=60 * 2))
+# each poll only requests tweets newer than the last one seen, paginating until caught up
+TWEET_SEARCH_PAGE_SIZE: t.Final = int(os.getenv("TWEET_SEARCH_PAGE_SIZE", default=100))
+TWEET_SEARCH_MAX_PAGES: t.Final = int(os.getenv("TWEET_SEARCH_MAX_PAGES", default=5))
+
+# https://developer.twitter.com/en/docs/twitter-api/v1/media/upload-media/api-reference/post-media-upload
+TWITTER_MEDIA_UPLOAD_URL: t.Final = os.getenv(
+    "TWITTER_MEDIA_UPLOAD_URL", default="https://upload.twitter.com/1.1/media/upload.json"
+)
+# images larger than this are uploaded in INIT/APPEND/FINALIZE segments of this size (Twitter allows up to 5 MB)
+TWITTER_MEDIA_CHUNK_SIZE: t.Final = int(os.getenv("TWITTER_MEDIA_CHUNK_SIZE", default=1024 * 1024))
+
+# calls that would have to wait longer than this for their rate limit window to reset are deferred instead
+TWITTER_RATE_LIMIT_MAX_WAIT: t.Final = float(os.getenv("TWITTER_RATE_LIMIT_MAX_WAIT", default=30))
+# uploaded media can be attached again for 24 hours, cached ids are dropped well before that
+TWITTER_MEDIA_ID_EX: t.Final = int(os.getenv("TWITTER_MEDIA_ID_EX", default=60 * 60 * 20))
+
+# only required by the clients that use them, which are checked when they're first built
+TWITTER_BEARER_TOKEN: t.Final = os.getenv("TWITTER_BEARER_TOKEN")
+TWITTER_API_KEY: t.Final = os.getenv("TWITTER_API_KEY")
+TWITTER_API_KEY_SECRET: t.Final = os.getenv("TWITTER_API_KEY_SECRET")
+TWITTER_ACCESS_TOKEN: t.Final = os.getenv("TWITTER_ACCESS_TOKEN")
+TWITTER_ACCESS_TOKEN_SECRET: t.Final = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
+
+# --- images ---
+# re-encode screenshots (and compose grids) before uploading them, at the cost of CPU in IMAGE_WORKERS processes.
+# screenshots are downloaded in full before they're uploaded either way.
+# when off, a reply only shows the screenshots of its first TWEET_MAX_MEDIA items, one per media
+IMAGE_PROCESSING: t.Final = os.getenv("IMAGE_PROCESSING", default="true").lower() == "true"
+# any format Pillow can write and Twitter accepts ("JPEG", "PNG" or "WEBP")
+IMAGE_FORMAT: t.Final = os.getenv("IMAGE_FORMAT", default="JPEG").upper()
+# the quality is lowered (down to IMAGE_MIN_QUALITY) until the image fits in IMAGE_MAX_BYTES
+IMAGE_QUALITY: t.Final = int(os.getenv("IMAGE_QUALITY", default=85))
+IMAGE_MIN_QUALITY: t.Final = int(os.getenv("IMAGE_MIN_QUALITY", default=55))
+IMAGE_MAX_BYTES: t.Final = int(os.getenv("IMAGE_MAX_BYTES", default=1024 * 1024))
+# longest side of an uploaded image (and of a whole grid)
+IMAGE_MAX_DIMENSION: t.Final = int(os.getenv("IMAGE_MAX_DIMENSION", default=1600))
+# processes encoding images
+IMAGE_WORKERS: t.Final = int(os.getenv("IMAGE_WORKERS", default=2))
+
+# --- event loop ---
+# run on uvloop instead of asyncio's own loop (requires the optional `uvloop` package)
+USE_UVLOOP: t.Final = os.getenv("USE_UVLOOP", default="false").lower() == "true"
+# measures how late the loop wakes up, and logs the stack of whatever blocks it
+LOOP_MONITOR: t.Final = os.getenv("LOOP_MONITOR", default="true").lower() == "true"
+LOOP_MONITOR_INTERVAL: t.Final = float(os.getenv("LOOP_MONITOR_INTERVAL", default=0.5))
+# lag worth a warning
+LOOP_LAG_THRESHOLD: t.Final = float(os.getenv("LOOP_LAG_THRESHOLD", default=0.1))
+# a single callback running this long gets its stack logged
+LOOP_BLOCKED_THRESHOLD: t.Final = float(os.getenv("LOOP_BLOCKED_THRESHOLD", default=1.0))
+
+# --- work queue ---
+WORK_QUEUE_WORKERS: t.Final = int(os.getenv("WORK_QUEUE_WORKERS", default=8))
+WORK_QUEUE_MAX_SIZE: t.Final = int(os.getenv("WORK_QUEUE_MAX_SIZE", default=200))
+# what to do with new tweets when the queue is full: "block", "drop_newest" or "drop_oldest"
+WORK_QUEUE_FULL_POLICY: t.Final = os.getenv("WORK_QUEUE_FULL_POLICY", default="block").lower()
+
+# --- shutdown ---
+# on SIGTERM running jobs get this long to finish, the rest are checkpointed to redis and resumed on startup
+# (keep it below the container's stop grace period)
+SHUTDOWN_DRAIN_TIMEOUT: t.Final = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", default=20))
 
-TWITTER_BEARER_TOKEN = os.environ["TWITTER_BEARER_TOKEN"]
-TWITTER_API_KEY: t.Final = os.environ["TWITTER_API_KEY"]
-TWITTER_API_KEY_SECRET: t.Final = os.environ["TWITTER_API_KEY_SECRET"]
-TWITTER_ACCESS_TOKEN: t.Final = os.environ["TWITTER_ACCESS_TOKEN"]
-TWITTER_ACCESS_TOKEN_SECRET: t.Final = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
+# --- retries ---
+# failed tweets are retried after RETRY_BASE_DELAY * 2^attempts seconds (with jitter), capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY: t.Final = float(os.getenv("RETRY_BASE_DELAY", default=60))
+RETRY_MAX_DELAY: t.Final = float(os.getenv("RETRY_MAX_DELAY", default=60 * 60 * 6))
+# how often due retries are pulled into the work queue (only while it's idle)
+RETRY_POLL_INTERVAL: t.Final = float(os.getenv("RETRY_POLL_INTERVAL", default=15))
+
+# --- tweet claims ---
+# a tweet is claimed for this long (seconds) while it is processed, so the live stream and search can't both handle it.
+# shorter than STREAM_CLAIM_IDLE, so a dead worker's claim has expired by the time its stream entry is reclaimed
+TWEET_CLAIM_TTL: t.Final = float(os.getenv("TWEET_CLAIM_TTL", default=60 * 8))
+
+# --- tweet filter ---
+# answered tweet ids kept in memory (per REDIS_EX window) so redis is only asked about tweets that might be answered
+TWEET_FILTER_CAPACITY: t.Final = int(os.getenv("TWEET_FILTER_CAPACITY", default=100_000))
+TWEET_FILTER_ERROR_RATE: t.Final = float(os.getenv("TWEET_FILTER_ERROR_RATE", default=0.01))
+
+# --- tweet stream ---
+# only entries newer than roughly this many are kept (acknowledged or not)
+STREAM_MAX_LENGTH: t.Final = int(os.getenv("STREAM_MAX_LENGTH", default=10_000))
+# how long a worker blocks waiting for new tweets (seconds)
+STREAM_BLOCK: t.Final = float(os.getenv("STREAM_BLOCK", default=5))
+# tweets a dead worker claimed are handed to another worker after this long without an acknowledgement
+STREAM_CLAIM_IDLE: t.Final = float(os.getenv("STREAM_CLAIM_IDLE", default=60 * 10))
+if TWEET_CLAIM_TTL >= STREAM_CLAIM_IDLE:
+    msg = f"TWEET_CLAIM_TTL ({TWEET_CLAIM_TTL:.0f}s) must be shorter than STREAM_CLAIM_IDLE ({STREAM_CLAIM_IDLE:.0f}s)"
+    raise ValueError(msg)
+# only the replica holding this lease runs the live stream and search (renewed every third of it)
+LEADER_LEASE_TTL: t.Final = float(os.getenv("LEADER_LEASE_TTL", default=30))
+
+# --- http ---
+# shared keep-alive pool used for Skinport and image downloads
+HTTP_MAX_CONNECTIONS: t.Final = int(os.getenv("HTTP_MAX_CONNECTIONS", default=100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS: t.Final = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", default=20))
+HTTP_MAX_CONNECTIONS_PER_HOST: t.Final = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", default=10))
+HTTP_KEEPALIVE_EXPIRY: t.Final = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", default=30.0))
+# requires the optional `h2` package
+HTTP_ENABLE_HTTP2: t.Final = os.getenv("HTTP_ENABLE_HTTP2", default="false").lower() == "true"
+
+# --- screenshot providers ---
+SCREENSHOT_TIMEOUT: t.Final = float(os.getenv("SCREENSHOT_TIMEOUT", default=300))
+# latency samples (and successes) remembered per provider
+SCREENSHOT_PROFILE_WINDOW: t.Final = int(os.getenv("SCREENSHOT_PROFILE_WINDOW", default=100))
+# providers succeeding less often than this are only used when every provider is unhealthy
+SCREENSHOT_MIN_SUCCESS_RATE: t.Final = float(os.getenv("SCREENSHOT_MIN_SUCCESS_RATE", default=0.5))
+# a second provider is asked once the first runs past this percentile of its own latency
+SCREENSHOT_HEDGE_PERCENTILE: t.Final = float(os.getenv("SCREENSHOT_HEDGE_PERCENTILE", default=0.95))
+# hedge deadline used until a provider has enough latency samples
+SCREENSHOT_HEDGE_DELAY: t.Final = float(os.getenv("SCREENSHOT_HEDGE_DELAY", default=15))
+
+# adaptive (AIMD) concurrency limit per provider
+SCREENSHOT_LIMIT_INITIAL: t.Final = int(os.getenv("SCREENSHOT_LIMIT_INITIAL", default=4))
+SCREENSHOT_LIMIT_MIN: t.Final = int(os.getenv("SCREENSHOT_LIMIT_MIN", default=1))
+# at most the connections allowed per host, past that requests queue on the pool and would be timed as provider latency
+SCREENSHOT_LIMIT_MAX: t.Final = min(
+    int(os.getenv("SCREENSHOT_LIMIT_MAX", default=HTTP_MAX_CONNECTIONS_PER_HOST)), HTTP_MAX_CONNECTIONS_PER_HOST
+)
+# renders slower than this shrink the limit
+SCREENSHOT_LIMIT_LATENCY_TARGET: t.Final = float(os.getenv("SCREENSHOT_LIMIT_LATENCY_TARGET", default=30))
+# consecutive provider failures (429, 5xx, timeouts) before failing fast
+SCREENSHOT_BREAKER_FAILURES: t.Final = int(os.getenv("SCREENSHOT_BREAKER_FAILURES", default=5))
+SCREENSHOT_BREAKER_COOLDOWN: t.Final = float(os.getenv("SCREENSHOT_BREAKER_COOLDOWN", default=30))
+SCREENSHOT_BREAKER_MAX_COOLDOWN: t.Final = float(os.getenv("SCREENSHOT_BREAKER_MAX_COOLDOWN", default=60 * 10))
+
+# --- screenshot cache ---
+SCREENSHOT_CACHE_SIZE: t.Final = int(os.getenv("SCREENSHOT_CACHE_SIZE", default=2048))
+# "lru" or "fifo"
+SCREENSHOT_CACHE_EVICTION: t.Final = os.getenv("SCREENSHOT_CACHE_EVICTION", default="lru").lower()
+# how long an image link is kept in-process / in redis
+SCREENSHOT_CACHE_MEMORY_TTL: t.Final = int(os.getenv("SCREENSHOT_CACHE_MEMORY_TTL", default=60 * 60))
+SCREENSHOT_CACHE_REDIS_TTL: t.Final = int(os.getenv("SCREENSHOT_CACHE_REDIS_TTL", default=60 * 60 * 24 * 7))
+# failed screenshots are only remembered briefly so a flaky render is retried soon
+SCREENSHOT_CACHE_NEGATIVE_TTL: t.Final = int(os.getenv("SCREENSHOT_CACHE_NEGATIVE_TTL", default=60))
 
 # --- redis ---
 REDIS_HOST: t.Final = os.getenv("REDIS_HOST", default="localhost")
@@ -63,7 +204,18 @@ REDIS_PORT: t.Final = int(os.getenv("REDIS_PORT", default=6379))
 REDIS_DATABASE: t.Final = int(os.getenv("REDIS_DATABASE", default=0))
 # approx. one month (in seconds)
 REDIS_EX: t.Final = 60 * 60 * 24 * 30
+# "hash" stores each tweet's state under its own key
+# "compact" packs states into one small hash per TWEET_STATE_BUCKET_SECONDS (run `python -m csinspect.migrate` first)
+TWEET_STATE_ENCODING: t.Final = os.getenv("TWEET_STATE_ENCODING", default="hash").lower()
+# aim for well under 128 tweets (redis' hash-max-listpack-entries) per bucket
+TWEET_STATE_BUCKET_SECONDS: t.Final = int(os.getenv("TWEET_STATE_BUCKET_SECONDS", default=60))
 
 # --- sentry ---
 SENTRY_DSN: t.Final = os.getenv("SENTRY_DSN")
 SENTRY_TRACES_SAMPLE_RATE: t.Final = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", default=0.0))
+
+# --- metrics ---
+# serves stage latencies, queue depths and cache stats on http://METRICS_HOST:METRICS_PORT/metrics
+ENABLE_METRICS: t.Final = os.getenv("ENABLE_METRICS", default="false").lower() == "true"
+METRICS_HOST: t.Final = os.getenv("METRICS_HOST", default="127.0.0.1")
+METRICS_PORT: t.Final = int(os.getenv("METRICS_PORT", default=9100))
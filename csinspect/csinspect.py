@@ -1,80 +1,504 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import signal
+import time
 import typing as t
 
-import tweepy
-import tweepy.errors
+import httpx
 from loguru import logger
+from redis.exceptions import RedisError
 
-from csinspect import redis_, screenshot, twitter
+from csinspect import bloom, extract, http_, images, metrics, monitor, redis_, scheduler, screenshot, twitter
 from csinspect.config import (
+    CSINSPECT_INSTANCE,
+    CSINSPECT_ROLE,
     DEV_ID,
     DEV_MODE,
+    ENABLE_METRICS,
     ENABLE_TWITTER_LIVE,
     ENABLE_TWITTER_SEARCH,
+    LEADER_LEASE_TTL,
+    LOOP_MONITOR,
+    RETRY_POLL_INTERVAL,
+    SHUTDOWN_DRAIN_TIMEOUT,
     SILENT_MODE,
+    STREAM_BLOCK,
+    STREAM_CLAIM_IDLE,
     TWEET_EXPANSIONS,
     TWEET_MAX_FAILED_ATTEMPTS,
-    TWEET_MAX_IMAGES,
+    TWEET_MAX_MEDIA,
     TWEET_SEARCH_DELAY,
+    TWEET_SEARCH_MAX_PAGES,
+    TWEET_SEARCH_PAGE_SIZE,
     TWEET_TWEET_FIELDS,
     TWEET_USER_FIELDS,
     TWITTER_INSPECT_LINK_QUERY,
-    TWITTER_INSPECT_URL_REGEX,
-    TWITTER_INSPECT_URL_TEMPLATE,
     TWITTER_LIVE_RULES,
 )
 from csinspect.item import Item
+from csinspect.providers import ScreenshotUnavailableError
 from csinspect.tweet import TweetWithInspectLink
+from csinspect.typings import MediaUpload, SearchCheckpoint
 
 if t.TYPE_CHECKING:
-    import re
+    import tweepy
+
+    from csinspect.typings import StreamedTweet, TweetResponseState
+
+
+ROLES: t.Final = ("all", "ingest", "worker")
 
 
 class CSInspect:
-    def __init__(self: CSInspect) -> None:
-        self.screenshot = screenshot.Screenshot()
-        self.twitter = twitter.Twitter(on_tweet=self.on_tweet)
+    def __init__(self: CSInspect, role: str = CSINSPECT_ROLE) -> None:
+        if role not in ROLES:
+            msg = f"Unknown role {role!r} (expected one of {', '.join(ROLES)})"
+            raise ValueError(msg)
+
+        self.role = role
+        self.http = http_.HTTPTransport()
+        self.images = images.ImageProcessor() if images.available() else None
+        self.screenshot = screenshot.Screenshot(http=self.http)
+        self.twitter = twitter.Twitter(on_tweet=self.on_tweet, http=self.http, images=self.images)
         self.lock = asyncio.Semaphore(value=3)
+        self.work_queue = scheduler.WorkQueue(handler=self.handle_job, on_drop=self.defer_dropped)
+        self.claims = scheduler.TweetClaims()
+        self.answered_tweets = bloom.RotatingBloomFilter()
+        self.filter_stats = bloom.FilterStats()
+        self.loop_monitor = monitor.LoopMonitor() if LOOP_MONITOR else None
+        self.replies: set[asyncio.Task[None]] = set()
+        self.stopping = asyncio.Event()
+        self.register_metrics()
+
+    def register_metrics(self: CSInspect) -> None:
+        """Gauges that read this instance's stats whenever the metrics are scraped."""
+        queue_stats = self.work_queue.stats
+        cache_stats = self.screenshot.cache.stats
+        media_cache_stats = self.twitter.media_cache_stats
+        engine = self.screenshot.engine
+
+        def http_pool() -> dict[tuple[str, ...], float]:
+            stats = self.http.stats()
+            return {
+                ("requests",): stats.requests,
+                ("connections_opened",): stats.connections_opened,
+                ("in_flight",): stats.in_flight,
+                ("waiting",): stats.waiting,
+            }
+
+        gauges = [
+            metrics.Gauge(
+                "csinspect_work_queue_depth", "Jobs waiting for a worker.", function=lambda: self.work_queue.depth
+            ),
+            metrics.Gauge(
+                "csinspect_work_queue_busy_workers", "Workers handling a job.", function=lambda: queue_stats.busy_workers
+            ),
+            metrics.Gauge(
+                "csinspect_work_queue_idle",
+                "1 while no job is waiting and at least one worker is free.",
+                function=lambda: self.work_queue.idle,
+            ),
+            metrics.Gauge(
+                "csinspect_work_queue_wait_seconds",
+                "Time jobs waited for a worker, on average and at most.",
+                ("stat",),
+                function=lambda: {("average",): queue_stats.average_wait, ("max",): queue_stats.max_wait},
+            ),
+            metrics.Gauge(
+                "csinspect_work_queue_jobs",
+                "Jobs seen by the work queue, by what happened to them.",
+                ("outcome",),
+                function=lambda: {
+                    ("submitted",): queue_stats.submitted,
+                    ("processed",): queue_stats.processed,
+                    ("failed",): queue_stats.failed,
+                    ("dropped",): queue_stats.dropped,
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_tweet_claims",
+                "Tweets claimed for processing, and copies skipped as already claimed.",
+                ("outcome",),
+                function=lambda: {("claimed",): self.claims.stats.claimed, ("duplicate",): self.claims.stats.duplicates},
+            ),
+            metrics.Gauge(
+                "csinspect_tweet_filter_lookups",
+                "Tweet state lookups by what the answered tweet filter made of them.",
+                ("outcome",),
+                function=lambda: {
+                    ("skipped",): self.filter_stats.skipped,
+                    ("confirmed",): self.filter_stats.confirmed,
+                    ("false_positive",): self.filter_stats.false_positives,
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_tweet_filter_bytes",
+                "Memory used by the answered tweet filter.",
+                function=lambda: self.answered_tweets.nbytes,
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_cache_lookups",
+                "Screenshot cache lookups, by where they were answered.",
+                ("result",),
+                function=lambda: {
+                    ("memory_hit",): cache_stats.memory_hits,
+                    ("redis_hit",): cache_stats.redis_hits,
+                    ("negative_hit",): cache_stats.negative_hits,
+                    ("miss",): cache_stats.misses,
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_renders_in_flight",
+                "Screenshots being rendered right now.",
+                function=lambda: len(self.screenshot.in_flight),
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_requests",
+                "Screenshot requests that joined a render already running, or were hedged to another provider.",
+                ("kind",),
+                function=lambda: {("coalesced",): self.screenshot.coalesced, ("hedged",): engine.hedged},
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_provider_limit",
+                "Concurrency limit of each screenshot provider.",
+                ("provider",),
+                function=lambda: {(profile.name,): profile.limiter.limit for profile in engine.profiles},
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_provider_in_flight",
+                "Screenshots each provider is rendering right now.",
+                ("provider",),
+                function=lambda: {(profile.name,): profile.limiter.in_flight for profile in engine.profiles},
+            ),
+            metrics.Gauge(
+                "csinspect_screenshot_provider_circuit_open",
+                "Whether each provider's circuit breaker is open (1), half open (0.5) or closed (0).",
+                ("provider",),
+                function=lambda: {
+                    (profile.name,): {"open": 1.0, "half_open": 0.5}.get(profile.breaker.state, 0.0)
+                    for profile in engine.profiles
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_media_cache_lookups",
+                "Media id cache lookups, and cached ids Twitter rejected.",
+                ("result",),
+                function=lambda: {
+                    ("hit",): media_cache_stats.hits,
+                    ("miss",): media_cache_stats.misses,
+                    ("invalidated",): media_cache_stats.invalidations,
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_twitter_rate_limit_remaining",
+                "Calls left in the current rate limit window of each Twitter endpoint.",
+                ("endpoint",),
+                function=lambda: {
+                    (endpoint,): bucket.available
+                    for endpoint, bucket in self.twitter.rate_limits.buckets.items()
+                    if bucket.available is not None
+                },
+            ),
+            metrics.Gauge(
+                "csinspect_twitter_rate_limited_calls",
+                "Twitter calls held until their window reset, or deferred.",
+                ("outcome",),
+                function=lambda: {
+                    ("held",): self.twitter.rate_limits.held,
+                    ("deferred",): self.twitter.rate_limits.deferred,
+                },
+            ),
+            metrics.Gauge("csinspect_http_pool", "Shared HTTP transport counters.", ("stat",), function=http_pool),
+        ]
+
+        if self.images is not None:
+            image_stats = self.images.stats
+            gauges.append(
+                metrics.Gauge(
+                    "csinspect_image_bytes",
+                    "Screenshot bytes before and after processing.",
+                    ("direction",),
+                    function=lambda: {("in",): image_stats.bytes_in, ("out",): image_stats.bytes_out},
+                )
+            )
+            gauges.append(
+                metrics.Gauge(
+                    "csinspect_image_jobs_in_flight",
+                    "Images being processed, or waiting for a process of the pool.",
+                    function=lambda: image_stats.in_flight,
+                )
+            )
+
+        for gauge in gauges:
+            metrics.REGISTRY.register(gauge)
 
     async def on_tweet(self: CSInspect, tweet: tweepy.Tweet) -> None:
         tweet_with_items = await self.parse_tweet(tweet)
         if not tweet_with_items:
             return
-        task_set: set[asyncio.Task[None]] = set()
-        coro = self.process_tweet(tweet_with_items)
-        task = asyncio.create_task(coro)
-        task_set.add(task)
-        task.add_done_callback(task_set.discard)
-
-    async def find_tweets(self: CSInspect) -> list[TweetWithInspectLink]:
-        search_results: tweepy.Response = await self.twitter.v2.search_recent_tweets(
-            query=TWITTER_INSPECT_LINK_QUERY,
-            expansions=TWEET_EXPANSIONS,
-            tweet_fields=TWEET_TWEET_FIELDS,
-            user_fields=TWEET_USER_FIELDS,
-            max_results=50,
-        )  # type: ignore
+        # blocks the stream while the queue is full (with the "block" policy)
+        await self.process_tweets((tweet_with_items,))
+
+    async def search_tweets(self: CSInspect) -> tuple[list[tweepy.Tweet], SearchCheckpoint]:
+        """
+        Pages through every tweet newer than the stored checkpoint (within the page budget).
+        Returns the checkpoint to store once the tweets are queued: when the budget runs out,
+        it points at the unread pages, so the next poll reads them before anything newer.
+        """
+        import tweepy.errors
+
+        checkpoint = await redis_.search_checkpoint()
+        since_id = checkpoint.since_id
+        newest_id = checkpoint.newest_id
+        next_token = checkpoint.next_token
+        tweets: list[tweepy.Tweet] = []
+
+        for page in range(1, TWEET_SEARCH_MAX_PAGES + 1):
+            try:
+                search_results: tweepy.Response = await self.twitter.v2.search_recent_tweets(
+                    query=TWITTER_INSPECT_LINK_QUERY,
+                    expansions=TWEET_EXPANSIONS,
+                    tweet_fields=TWEET_TWEET_FIELDS,
+                    user_fields=TWEET_USER_FIELDS,
+                    max_results=TWEET_SEARCH_PAGE_SIZE,
+                    since_id=since_id,
+                    next_token=next_token,
+                )  # type: ignore
+            except tweepy.errors.BadRequest:
+                # only the stored checkpoint can be stale, pages after the first use tokens Twitter just returned
+                if page > 1 or (since_id is None and next_token is None):
+                    raise
+                if next_token is not None:
+                    logger.warning("DISCARDING SEARCH PAGINATION TOKEN (Rejected By Twitter)")
+                    await redis_.update_search_checkpoint(SearchCheckpoint(since_id))
+                else:
+                    # since_id must be within the search window (the bot was down for too long)
+                    logger.warning(f"DISCARDING SEARCH CHECKPOINT (Rejected By Twitter): {since_id}")
+                    await redis_.update_search_checkpoint(SearchCheckpoint())
+                return await self.search_tweets()
+
+            tweets.extend(search_results.data or [])
+            meta: dict[str, t.Any] = search_results.meta or {}
+
+            if newest_id is None and meta.get("newest_id"):
+                newest_id = int(meta["newest_id"])
+
+            next_token = meta.get("next_token")
+            if not next_token:
+                return tweets, SearchCheckpoint(newest_id or since_id)
+
+            logger.debug(f"SEARCH PAGE {page} OF {TWEET_SEARCH_MAX_PAGES}: {len(tweets)} TWEETS SO FAR")
+        else:
+            logger.warning(
+                f"SEARCH PAGE BUDGET EXHAUSTED ({TWEET_SEARCH_MAX_PAGES} Pages): older tweets are read next time"
+            )
 
-        tweets: list[tweepy.Tweet] = search_results.data or []
-        tasks: list[asyncio.Task[TweetWithInspectLink | None]] = []
+        return tweets, SearchCheckpoint(since_id, newest_id, next_token)
 
-        for tweet in tweets:
-            coro = self.parse_tweet(tweet)
-            task = asyncio.create_task(coro)
-            tasks.append(task)
+    async def find_tweets(self: CSInspect) -> tuple[list[TweetWithInspectLink], SearchCheckpoint]:
+        tweets, checkpoint = await self.search_tweets()
+        inspect_link_tweets = [
+            tweet_with_items for tweet_with_items in map(self.extract_tweet, tweets) if tweet_with_items is not None
+        ]
 
-        inspect_link_tweets = await asyncio.gather(*tasks)
-        filtered_inspect_link_tweets = [t for t in inspect_link_tweets if t is not None]
+        # one round trip for every result instead of one lookup per tweet
+        tweet_states = await self.tweet_states(inspect_link_tweets)
+        filtered_inspect_link_tweets = [
+            tweet
+            for tweet, tweet_state in zip(inspect_link_tweets, tweet_states, strict=True)
+            if self.should_process(tweet, tweet_state)
+        ]
 
-        return filtered_inspect_link_tweets
+        return filtered_inspect_link_tweets, checkpoint
 
     async def run(self: CSInspect) -> None:
-        running_search_task = await self.search_task()
-        running_live_task = await self.live_task()
-        tasks = filter(None, (running_search_task, running_live_task))
-        await asyncio.gather(*tasks)
+        logger.info(f"RUNNING AS {self.role.upper()}: {CSINSPECT_INSTANCE}")
+        tasks: list[asyncio.Task[None]] = []
+        metrics_server = await metrics.serve() if ENABLE_METRICS else None
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        self.handle_signals()
+
+        try:
+            if self.role != "ingest":
+                self.work_queue.start()
+                # ahead of anything new
+                await self.resume_checkpointed_tweets()
+                tasks.append(self.retry_task())
+            if self.role == "worker":
+                tasks.append(self.stream_task())
+            else:
+                tasks.append(self.ingest_task())
+
+            # until a task fails or a signal asks us to stop
+            stopping = asyncio.create_task(self.stopping.wait())
+            done, _ = await asyncio.wait([*tasks, stopping], return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            for task in done:
+                task.result()
+        finally:
+            # no new tweets while the running ones are drained
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.role != "ingest":
+                await self.drain()
+            if metrics_server is not None:
+                metrics_server.close()
+            if self.loop_monitor is not None:
+                await self.loop_monitor.stop()
+            await self.close()
+
+    def handle_signals(self: CSInspect) -> None:
+        loop = asyncio.get_running_loop()
+
+        def stop(signal_number: signal.Signals) -> None:
+            logger.info(f"STOPPING ({signal_number.name} Received)")
+            self.stopping.set()
+
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            # not supported on Windows, where the process is just killed
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(signal_number, stop, signal_number)
+
+    async def drain(self: CSInspect) -> None:
+        """
+        Lets the running jobs finish (up to SHUTDOWN_DRAIN_TIMEOUT), then checkpoints the rest to redis,
+        with the screenshots and media they already have, to be resumed on startup.
+        Jobs claimed from the stream are left unacknowledged instead, so the remaining workers reclaim them.
+        """
+        unhandled = await self.work_queue.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        # recorded before checkpointing, so a resumed tweet sees it was answered
+        await asyncio.gather(*self.replies, return_exceptions=True)
+
+        streamed = sum(job.stream_id is not None for job in unhandled)
+        if streamed:
+            logger.info(f"LEAVING {streamed} STREAMED TWEETS PENDING (Reclaimed By Other Workers)")
+
+        tweets = [job.tweet for job in unhandled if job.stream_id is None]
+        if not tweets:
+            return
+
+        try:
+            await redis_.checkpoint_tweets(tweets)
+        except RedisError:
+            # found again by search
+            logger.exception(f"Error Checkpointing {len(tweets)} Tweets")
+            return
+
+        logger.info(f"CHECKPOINTED {len(tweets)} TWEETS (Resumed On Startup)")
+
+    async def resume_checkpointed_tweets(self: CSInspect) -> None:
+        try:
+            tweets = await redis_.take_checkpointed_tweets()
+        except RedisError:
+            logger.exception("Error Resuming Checkpointed Tweets")
+            return
+
+        if not tweets:
+            return
+
+        logger.info(f"RESUMING {len(tweets)} CHECKPOINTED TWEETS")
+        # checkpointed again, so they survive another crash
+        await self.process_tweets(tweets, checkpoint=True)
+
+    async def close(self: CSInspect) -> None:
+        await self.work_queue.stop()
+        await self.http.aclose()
+        if self.images is not None:
+            self.images.close()
+
+    def ingest_task(self: CSInspect) -> asyncio.Task[None]:
+        """Runs search and the live stream, but only while this replica holds the ingest lease."""
+
+        async def lead() -> None:
+            ingest_tasks: list[asyncio.Task[None]] = []
+            renewed_at = 0.0
+
+            try:
+                while True:
+                    try:
+                        leader = await redis_.acquire_lease("ingest", CSINSPECT_INSTANCE, ttl=LEADER_LEASE_TTL)
+                        renewed_at = time.monotonic()
+                    except RedisError:
+                        logger.exception("Error Renewing Ingest Lease")
+                        # still ours until it would expire before the next renewal
+                        leader = bool(ingest_tasks) and time.monotonic() - renewed_at < LEADER_LEASE_TTL * 2 / 3
+
+                    if leader and not ingest_tasks:
+                        logger.info(f"INGEST LEADER: {CSINSPECT_INSTANCE}")
+                        await self.rebuild_answered_tweets()
+                        ingest_tasks = [task for task in (await self.search_task(), await self.live_task()) if task]
+                    elif not leader and ingest_tasks:
+                        logger.warning(f"LOST INGEST LEADERSHIP: {CSINSPECT_INSTANCE}")
+                        await self.stop_ingesting(ingest_tasks)
+                        ingest_tasks = []
+
+                    for task in ingest_tasks:
+                        if task.done():
+                            task.result()
+
+                    await asyncio.sleep(LEADER_LEASE_TTL / 3)
+            finally:
+                await self.stop_ingesting(ingest_tasks)
+                with contextlib.suppress(RedisError):
+                    await redis_.release_lease("ingest", CSINSPECT_INSTANCE)
+
+        coro = lead()
+        task = asyncio.create_task(coro)
+        return task
+
+    async def stop_ingesting(self: CSInspect, tasks: list[asyncio.Task[None]]) -> None:
+        self.twitter.disconnect_live()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stream_task(self: CSInspect) -> asyncio.Task[None]:
+        """Claims published tweets from the redis stream, only as many as there are idle workers."""
+
+        async def read_tweets(count: int, *, reclaim: bool) -> list[StreamedTweet]:
+            if reclaim:
+                streamed_tweets = await redis_.reclaim_tweet_stream(
+                    CSINSPECT_INSTANCE, min_idle=STREAM_CLAIM_IDLE, count=count
+                )
+                if streamed_tweets:
+                    logger.warning(f"RECLAIMED {len(streamed_tweets)} TWEETS (Unacknowledged For {STREAM_CLAIM_IDLE}s)")
+                    return streamed_tweets
+
+            return await redis_.read_tweet_stream(CSINSPECT_INSTANCE, count=count, block=STREAM_BLOCK)
+
+        async def consume_tweets() -> None:
+            logger.debug("STARTING: TWEET STREAM")
+            await redis_.create_tweet_stream_group()
+            reclaim_at = 0.0
+
+            while True:
+                idle_workers = await self.work_queue.wait_for_idle_workers()
+                reclaim = time.monotonic() >= reclaim_at
+
+                try:
+                    streamed_tweets = await read_tweets(idle_workers, reclaim=reclaim)
+                except RedisError:
+                    logger.exception("Error Reading Tweet Stream")
+                    await asyncio.sleep(STREAM_BLOCK)
+                    continue
+
+                # keep reclaiming while there's a backlog of abandoned tweets
+                if reclaim and len(streamed_tweets) < idle_workers:
+                    reclaim_at = time.monotonic() + STREAM_CLAIM_IDLE / 2
+
+                for stream_id, tweet in streamed_tweets:
+                    if tweet is None:
+                        await redis_.acknowledge_tweet_stream(stream_id)
+                        continue
+                    await self.work_queue.submit(scheduler.Job(tweet, stream_id=stream_id))
+
+        coro = consume_tweets()
+        task = asyncio.create_task(coro)
+        return task
 
     async def search_task(self: CSInspect) -> asyncio.Task[None] | None:
         if not ENABLE_TWITTER_SEARCH:
@@ -85,13 +509,23 @@ class CSInspect:
             logger.info(f"FINDING TWEETS (Past {TWEET_SEARCH_DELAY} Seconds)")
 
             try:
-                items_tweets = await self.find_tweets()
-                await self.process_tweets(items_tweets)
-            except Exception:
+                items_tweets, checkpoint = await self.find_tweets()
+                await self.process_tweets(items_tweets, checkpoint=True)
+                # only once they're handed off durably, so a crash before this searches them again
+                await redis_.update_search_checkpoint(checkpoint)
+            except Exception as exc:
+                # rejected by Twitter, or held back before it could be
+                if twitter.is_rate_limited(exc):
+                    logger.warning(f"SKIPPING SEARCH (Rate Limited: {exc})")
+                    return
                 logger.exception("Error Finding or Processing Tweets")
                 return
 
             logger.info(f"DONE FINDING TWEETS ({len(items_tweets)} TWEETS FOUND)")
+            logger.debug(
+                f"TWEET FILTER: {self.filter_stats.skip_rate:.0%} OF LOOKUPS SKIPPED, "
+                f"{self.filter_stats.false_positives} FALSE POSITIVES, {self.answered_tweets.nbytes / 1024:.0f} KiB"
+            )
 
         async def incrementally_find_and_process_tweets() -> None:
             logger.debug("STARTING: SEARCH TWEETS")
@@ -103,29 +537,119 @@ class CSInspect:
         task = asyncio.create_task(coro)
         return task
 
+    def retry_task(self: CSInspect) -> asyncio.Task[None]:
+        async def process_due_retries() -> None:
+            # retries only fill capacity fresh tweets aren't using
+            idle_workers = self.work_queue.idle_workers
+            if not idle_workers:
+                return
+
+            tweets = await redis_.claim_due_retries(idle_workers, now=time.time())
+            if not tweets:
+                return
+
+            logger.info(f"RETRYING {len(tweets)} TWEETS")
+
+            # they may have been answered through search or the stream in the meantime
+            tweet_states = await redis_.tweet_states(tweets)
+            for tweet, tweet_state in zip(tweets, tweet_states, strict=True):
+                if self.should_process(tweet, tweet_state):
+                    await self.work_queue.submit(scheduler.Job(tweet))
+
+        async def incrementally_process_due_retries() -> None:
+            logger.debug("STARTING: RETRY TWEETS")
+            while True:
+                try:
+                    await process_due_retries()
+                except Exception:
+                    logger.exception("Error Processing Retries")
+                await asyncio.sleep(RETRY_POLL_INTERVAL)
+
+        coro = incrementally_process_due_retries()
+        task = asyncio.create_task(coro)
+        return task
+
     async def live_task(self: CSInspect) -> asyncio.Task[None] | None:
         if not ENABLE_TWITTER_LIVE or self.twitter.live is None:
             logger.debug("NOT STARTING: LIVE TWEETS")
             return None
 
         logger.debug("STARTING: LIVE TWEETS")
-        await self.twitter.live.add_rules(TWITTER_LIVE_RULES)
+        from tweepy import StreamRule
+
+        await self.twitter.live.add_rules([StreamRule(value, tag=tag) for value, tag in TWITTER_LIVE_RULES])
         task: asyncio.Task[None] = await self.twitter.live.filter(
             expansions=TWEET_EXPANSIONS, tweet_fields=TWEET_TWEET_FIELDS, user_fields=TWEET_USER_FIELDS
         )  # type: ignore
         return task
 
+    def media_groups(self: CSInspect, items: t.Sequence[Item]) -> list[tuple[Item, ...]]:
+        """The items that share each of the reply's media (as a grid), at most TWEET_MAX_MEDIA of them."""
+        if self.images is None:
+            if len(items) > TWEET_MAX_MEDIA:
+                logger.warning(
+                    f"ONLY REPLYING WITH {TWEET_MAX_MEDIA} OF {len(items)} SCREENSHOTS (Image Processing Disabled)"
+                )
+            return [(item,) for item in items[:TWEET_MAX_MEDIA]]
+
+        return images.media_groups(items, TWEET_MAX_MEDIA)
+
+    async def process_items(self: CSInspect, items: t.Sequence[Item]) -> MediaUpload | None:
+        """
+        Takes one media's items from screenshot to uploaded media on their own,
+        so they never wait on the rest of the tweet's items.
+        """
+        # items resumed from a checkpoint (or retried) keep what they already rendered and uploaded
+        rendered = await asyncio.gather(
+            *(self.screenshot.screenshot_item(item) for item in items if not item.image_link), return_exceptions=True
+        )
+        if not any(item.image_link for item in items):
+            # no provider answered, which defers the tweet instead of failing it
+            for result in rendered:
+                if isinstance(result, BaseException):
+                    raise result
+            return None
+
+        if SILENT_MODE:
+            return None
+
+        media_ids = {item.media_id for item in items}
+        if len(media_ids) == 1 and None not in media_ids:
+            image_links = tuple(item.image_link for item in items if item.image_link)
+            # uploaded before a restart, refreshed by `reply` if Twitter rejects it
+            return MediaUpload(image_links=image_links, media_id=media_ids.pop(), cached=True)  # type: ignore[arg-type]
+
+        upload = await self.twitter.upload_items(items)
+        for item in items:
+            item.media_id = upload.media_id
+        return upload
+
+    @metrics.timed("process_tweet")
     async def process_tweet(self: CSInspect, tweet: TweetWithInspectLink) -> None:
         logger.info(f"PROCESSING TWEET: {tweet.url}")
 
-        screenshot_responses = await self.screenshot.screenshot_items(tweet.items)
+        # exceptions are collected (not raised) so no item's pipeline is left running unsupervised
+        results = await asyncio.gather(
+            *(self.process_items(items) for items in self.media_groups(tweet.items)), return_exceptions=True
+        )
+
+        logger.debug(f"ITEM RESULTS: {results}")
 
-        logger.debug(f"SCREENSHOT RESPONSES: {screenshot_responses}")
+        unavailable = [result for result in results if isinstance(result, ScreenshotUnavailableError)]
+        results = [None if isinstance(result, ScreenshotUnavailableError) else result for result in results]
 
-        if not any(screenshot_responses):
+        if not any(item.image_link for item in tweet.items) and unavailable:
+            # not the tweet's fault, so it doesn't count towards TWEET_MAX_FAILED_ATTEMPTS
+            logger.warning(f"DEFERRING TWEET (No Screenshot Provider Answered): {tweet.url} - {unavailable[0]}")
+            metrics.TWEETS.inc(outcome="deferred")
+            await self.schedule_retry(tweet, delay=scheduler.backoff_delay(0))
+            return
+
+        if not any(item.image_link for item in tweet.items):
             logger.info(f"SKIPPING TWEET (Failed To Generate Screenshots): {tweet.url}")
 
-            await redis_.update_tweet_state(tweet, successful=False)
+            metrics.TWEETS.inc(outcome="screenshot_failed")
+            await self.record_failure(tweet)
             return
 
         logger.info(f"REPLYING TO TWEET: {tweet.url}")
@@ -133,41 +657,118 @@ class CSInspect:
 
         if SILENT_MODE:
             logger.success("SKIPPING TWEET (SILENT_MODE IS ENABLED)")
+            metrics.TWEETS.inc(outcome="silent")
             return
 
+        # runs to the end even if this worker is cut off at shutdown, so a sent reply is always recorded
+        reply = asyncio.create_task(self.reply(tweet, results))
+        self.replies.add(reply)
+        reply.add_done_callback(self.replies.discard)
+        await asyncio.shield(reply)
+
+    async def reply(
+        self: CSInspect, tweet: TweetWithInspectLink, results: list[MediaUpload | BaseException | None]
+    ) -> None:
+        import tweepy.errors
+
         try:
-            await self.twitter.reply(tweet)
-        except tweepy.errors.HTTPException as exc:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            uploads = [result for result in results if isinstance(result, MediaUpload)]
+            await self.twitter.reply(tweet, uploads)
+        except (tweepy.errors.HTTPException, httpx.HTTPError, twitter.RateLimitedError) as exc:
+            if twitter.is_rate_limited(exc):
+                # not the tweet's fault, so it doesn't count towards TWEET_MAX_FAILED_ATTEMPTS
+                logger.warning(f"DEFERRING TWEET (Rate Limited): {tweet.url} - {exc}")
+                metrics.TWEETS.inc(outcome="deferred")
+                retry_after = exc.retry_after if isinstance(exc, twitter.RateLimitedError) else None
+                await self.schedule_retry(tweet, delay=retry_after or scheduler.backoff_delay(0))
+                return
+
             logger.warning(f"ERROR REPLYING: {tweet.url} - {exc}")
-            await redis_.update_tweet_state(tweet, successful=False)
+            metrics.TWEETS.inc(outcome="failed")
+            await self.record_failure(tweet)
         else:
             logger.success(f"REPLIED TO TWEET: {tweet.url}")
+            metrics.TWEETS.inc(outcome="replied")
             await redis_.update_tweet_state(tweet, successful=True)
+            self.answered_tweets.add(tweet.id)
 
-    async def process_tweets(self: CSInspect, tweets: t.Iterable[TweetWithInspectLink]) -> None:
-        task_set: set[asyncio.Task[None]] = set()
-        for tweet in tweets:
-            coro = self.process_tweet(tweet)
-            task = asyncio.create_task(coro)
-            task_set.add(task)
-            task.add_done_callback(task_set.discard)
-
-    def parse_match(self: CSInspect, match: re.Match) -> str:
-        group_dict = match.groupdict()
+    async def record_failure(self: CSInspect, tweet: TweetWithInspectLink) -> None:
+        tweet_state = await redis_.update_tweet_state(tweet, successful=False)
 
-        s = group_dict.get("S")
-        m = group_dict.get("M")
-        a = group_dict.get("A")
-        d = group_dict.get("D")
+        if tweet_state.failed_attempts > TWEET_MAX_FAILED_ATTEMPTS:
+            logger.info(f"NOT RETRYING TWEET (Too Many Failed Attempts): {tweet.url}")
+            return
 
-        inspect_link = TWITTER_INSPECT_URL_TEMPLATE.format(s or m, a, d)
-        return inspect_link
+        await self.schedule_retry(tweet, delay=scheduler.backoff_delay(tweet_state.failed_attempts))
+
+    async def schedule_retry(self: CSInspect, tweet: TweetWithInspectLink, *, delay: float) -> None:
+        logger.info(f"RETRYING TWEET IN {delay:.0f}s: {tweet.url}")
+        await redis_.schedule_retry(tweet, at=time.time() + delay)
+
+    async def process_tweets(
+        self: CSInspect, tweets: t.Sequence[TweetWithInspectLink], *, checkpoint: bool = False
+    ) -> None:
+        """
+        With `checkpoint`, returns once no tweet can be lost anymore: published to the stream,
+        or, when they're processed here, kept in the checkpoint hash until a worker has handled them.
+        """
+        if self.role == "ingest":
+            await redis_.publish_tweets(tweets)
+            return
 
-    async def parse_tweet(self: CSInspect, tweet: tweepy.Tweet) -> TweetWithInspectLink | None:
-        matches: list[re.Match] = list(TWITTER_INSPECT_URL_REGEX.finditer(tweet.text))
-        matches = matches[:TWEET_MAX_IMAGES]
+        if checkpoint:
+            await redis_.checkpoint_tweets(tweets)
+        for tweet in tweets:
+            await self.work_queue.submit(scheduler.Job(tweet, checkpointed=checkpoint))
+
+    async def handle_job(self: CSInspect, job: scheduler.Job) -> None:
+        if not await self.claims.claim(job.tweet):
+            # a duplicate: the claim holder owns the tweet (its own entry is reclaimed if it dies,
+            # and its failures go to the retry queue), so reprocessing this copy later would only
+            # answer or count a failure twice
+            await self.acknowledge(job)
+            return
 
-        if not matches:
+        try:
+            # another copy may have been answered while this one was waiting in the queue
+            tweet_state = await redis_.tweet_state(job.tweet)
+            if self.should_process(job.tweet, tweet_state):
+                await self.process_tweet(job.tweet)
+        except Exception:
+            # handed to the retry queue rather than redelivered by the stream over and over
+            await self.record_failure(job.tweet)
+            await self.acknowledge(job)
+            raise
+        finally:
+            await self.claims.release(job.tweet)
+
+        await self.acknowledge(job)
+
+    async def defer_dropped(self: CSInspect, job: scheduler.Job) -> None:
+        """A job the full work queue dropped is handed to the retry queue, so it's still answered later."""
+        try:
+            # not the tweet's fault, so it doesn't count towards TWEET_MAX_FAILED_ATTEMPTS
+            await self.schedule_retry(job.tweet, delay=scheduler.backoff_delay(0))
+            await self.acknowledge(job)
+        except RedisError:
+            # still pending in the stream, or in the checkpoint hash to be resumed on startup
+            logger.exception(f"Error Deferring Dropped Tweet: {job.tweet.url}")
+
+    async def acknowledge(self: CSInspect, job: scheduler.Job) -> None:
+        # a job that is never acknowledged (the worker died) is reclaimed by another worker,
+        # or resumed from the checkpoint hash on startup
+        if job.stream_id is not None:
+            await redis_.acknowledge_tweet_stream(job.stream_id)
+        if job.checkpointed:
+            await redis_.forget_checkpointed_tweets((job.tweet,))
+
+    def extract_tweet(self: CSInspect, tweet: tweepy.Tweet) -> TweetWithInspectLink | None:
+        item_keys = extract.item_keys(tweet.text)
+
+        if not item_keys:
             # sometimes bc the tweet actually contains a demo link
             # sometimes bc the tweet is a retweet and is truncated (the original will be queried)
             logger.info(f"SKIPPING TWEET (No Inspect Links): {tweet.id}")
@@ -180,21 +781,79 @@ class CSInspect:
             logger.info(f"SKIPPING TWEET (DEV_Mode Disabled & Tweet Author is Dev): {tweet.id}, {tweet.author_id} ")
             return None
 
-        async with self.lock:
-            items = tuple(Item(inspect_link=self.parse_match(match)) for match in matches)
+        items = tuple(Item(inspect_link=extract.inspect_link(key)) for key in item_keys)
+        return TweetWithInspectLink(items, tweet)
+
+    @metrics.timed("tweet_state_lookup")
+    async def tweet_states(self: CSInspect, tweets: t.Sequence[TweetWithInspectLink]) -> list[TweetResponseState | None]:
+        """
+        Only asks redis about tweets the filter has seen answered.
+        A tweet the filter hasn't seen is treated as new (it is checked again before it's processed),
+        while a filter hit is always confirmed, so a false positive never suppresses a new tweet.
+        Only used where this process answers the tweets it finds: in the ingest role the workers
+        answer them, and a filter that never hears about it would treat every answered tweet as new.
+        """
+        if self.role == "ingest":
+            return await redis_.tweet_states(tweets)
+
+        maybe_answered = [tweet for tweet in tweets if tweet.id in self.answered_tweets]
+        self.filter_stats.skipped += len(tweets) - len(maybe_answered)
+
+        states = dict(
+            zip((tweet.id for tweet in maybe_answered), await redis_.tweet_states(maybe_answered), strict=True)
+        )
+        for tweet_state in states.values():
+            if tweet_state and tweet_state.successful:
+                self.filter_stats.confirmed += 1
+            else:
+                self.filter_stats.false_positives += 1
+
+        return [states.get(tweet.id) for tweet in tweets]
+
+    async def rebuild_answered_tweets(self: CSInspect) -> None:
+        """On taking over ingest, catches up on the tweets answered while another replica was leading."""
+        if self.role == "ingest":
+            return
 
-            tweet_with_items = TweetWithInspectLink(items, tweet)
-            tweet_state = await redis_.tweet_state(tweet_with_items)
+        started_at = time.monotonic()
+        try:
+            async for tweet_ids in redis_.answered_tweet_ids():
+                for tweet_id in tweet_ids:
+                    self.answered_tweets.add(tweet_id)
+        except RedisError:
+            # tweets it missed are taken as new, and still checked once they're claimed
+            logger.exception("Error Rebuilding Tweet Filter")
+            return
 
-            if not tweet_state:
-                return tweet_with_items
+        logger.info(
+            f"TWEET FILTER REBUILT ({time.monotonic() - started_at:.1f}s): "
+            f"{len(self.answered_tweets)} ANSWERED TWEETS IN {self.answered_tweets.nbytes / 1024:.0f} KiB"
+        )
 
-            if tweet_state.failed_attempts > TWEET_MAX_FAILED_ATTEMPTS:
-                logger.info(f"SKIPPING TWEET (Too Many Failed Attempts): {tweet.id}")
-                return None
+    def should_process(self: CSInspect, tweet: TweetWithInspectLink, tweet_state: TweetResponseState | None) -> bool:
+        if not tweet_state:
+            return True
 
-            if tweet_state.successful:
-                logger.info(f"SKIPPING TWEET (Already Successfully Responded): {tweet.id}")
-                return None
+        if tweet_state.failed_attempts > TWEET_MAX_FAILED_ATTEMPTS:
+            logger.info(f"SKIPPING TWEET (Too Many Failed Attempts): {tweet.id}")
+            return False
+
+        if tweet_state.successful:
+            logger.info(f"SKIPPING TWEET (Already Successfully Responded): {tweet.id}")
+            return False
+
+        return True
+
+    @metrics.timed("parse_tweet")
+    async def parse_tweet(self: CSInspect, tweet: tweepy.Tweet) -> TweetWithInspectLink | None:
+        tweet_with_items = self.extract_tweet(tweet)
+        if not tweet_with_items:
+            return None
+
+        async with self.lock:
+            (tweet_state,) = await self.tweet_states((tweet_with_items,))
+
+        if not self.should_process(tweet_with_items, tweet_state):
+            return None
 
-            return tweet_with_items
+        return tweet_with_items
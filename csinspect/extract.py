@@ -0,0 +1,48 @@
+"""Finds the items linked in tweets, without running a regex over every position of every text"""
+
+from __future__ import annotations
+
+import re
+import typing as t
+
+from csinspect.config import TWEET_MAX_IMAGES, TWITTER_INSPECT_URL_TEMPLATE
+from csinspect.typings import ItemKey
+
+# every inspect link contains it (after "csgo", "cs2" or "cs"), and most texts don't
+MARKER: t.Final = "_econ_action_preview"
+MARKER_PREFIXES: t.Final = ("csgo", "cs2", "cs")
+# what follows the marker, matched only where the marker was found
+# ids are 64-bit, longer runs of digits are rejected
+TAIL_REGEX: t.Final = re.compile(r"(?:%20| )(?:S([0-9]{1,20})|M([0-9]{1,20}))A([0-9]{1,20})D([0-9]{1,20})(?![0-9])")
+
+
+def item_keys(text: str, *, limit: int = TWEET_MAX_IMAGES) -> tuple[ItemKey, ...]:
+    """
+    The distinct items linked in the text, in order of first appearance (at most `limit`).
+    Matches the same links as `TWITTER_INSPECT_URL_REGEX`, with the prefix (`steam://rungame/730/.../+`) optional.
+    """
+    # a dict keeps the order while dropping the same item linked more than once
+    keys: dict[ItemKey, None] = {}
+    position = text.find(MARKER)
+    while position >= 0:
+        end = position + len(MARKER)
+
+        if text.endswith(MARKER_PREFIXES, 0, position):
+            match = TAIL_REGEX.match(text, end)
+            if match is not None:
+                owner_id, listing_id, asset_id, d = match.groups()
+                key = ItemKey(owner_id or listing_id, asset_id, d, market=owner_id is None)
+                keys[key] = None
+                if len(keys) >= limit:
+                    break
+                end = match.end()
+
+        position = text.find(MARKER, end)
+
+    return tuple(keys)
+
+
+def inspect_link(key: ItemKey) -> str:
+    """The one spelling of the item's inspect link that's requested, cached and stored."""
+    owner = f"M{key.owner_id}" if key.market else f"S{key.owner_id}"
+    return TWITTER_INSPECT_URL_TEMPLATE.format(owner, f"A{key.asset_id}", f"D{key.d}")
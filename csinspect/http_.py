@@ -0,0 +1,125 @@
+"""A shared, pooled HTTP transport for outbound requests (Skinport, image downloads)"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import typing as t
+from dataclasses import dataclass, replace
+from sys import version_info
+
+import httpx
+from loguru import logger
+
+from csinspect.config import (
+    HTTP_ENABLE_HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+)
+
+USER_AGENT: t.Final = (
+    f"csinspect/1.0.0 (https://github.com/hexiro/csinspect), Python/{version_info.major}.{version_info.minor}, httpx/{httpx.__version__}"
+)
+
+
+@dataclass(slots=True)
+class PoolStats:
+    """Counted by the transport itself (httpx doesn't expose its pool)."""
+
+    requests: int = 0
+    connections_opened: int = 0
+    # requests sent and not yet answered, and requests queued on a host's limit
+    in_flight: int = 0
+    waiting: int = 0
+
+    @property
+    def connections_reused(self: PoolStats) -> int:
+        # every request that didn't open a new connection was served by a pooled one
+        return max(self.requests - self.connections_opened, 0)
+
+
+class HTTPTransport:
+    """
+    A long-lived `httpx.AsyncClient` shared by everything that talks to the outside world over HTTP.
+    Requests to one origin are limited to `max_connections_per_host` at a time, with long polls
+    (a screenshot render can take minutes) limited separately so they don't hold up short requests to the same host.
+    """
+
+    def __init__(
+        self: HTTPTransport,
+        *,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+        http2: bool = HTTP_ENABLE_HTTP2,
+    ) -> None:
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 DISABLED (`h2` Is Not Installed)")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.client = httpx.AsyncClient(limits=limits, http2=http2, headers={"User-Agent": USER_AGENT})
+        self.max_connections_per_host = max_connections_per_host
+
+        self._host_locks: dict[tuple[str, str, int | None, bool], asyncio.Semaphore] = {}
+        self._stats = PoolStats()
+
+    def _host_lock(self: HTTPTransport, url: httpx.URL, *, long_poll: bool) -> asyncio.Semaphore:
+        key = (url.scheme, url.host, url.port, long_poll)
+        lock = self._host_locks.get(key)
+        if lock is None:
+            lock = self._host_locks[key] = asyncio.Semaphore(self.max_connections_per_host)
+        return lock
+
+    async def _trace(self: HTTPTransport, event_name: str, info: dict[str, t.Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._stats.connections_opened += 1
+
+    def build_request(self: HTTPTransport, method: str, url: httpx.URL | str, **kwargs: t.Any) -> httpx.Request:
+        return self.client.build_request(method, url, **kwargs)
+
+    async def send(
+        self: HTTPTransport, request: httpx.Request, *, long_poll: bool = False, **kwargs: t.Any
+    ) -> httpx.Response:
+        request.extensions["trace"] = self._trace
+        stats = self._stats
+        lock = self._host_lock(request.url, long_poll=long_poll)
+
+        stats.waiting += 1
+        try:
+            await lock.acquire()
+        finally:
+            stats.waiting -= 1
+
+        stats.requests += 1
+        stats.in_flight += 1
+        try:
+            return await self.client.send(request, **kwargs)
+        finally:
+            stats.in_flight -= 1
+            lock.release()
+
+    async def request(self: HTTPTransport, method: str, url: httpx.URL | str, **kwargs: t.Any) -> httpx.Response:
+        send_kwargs = {key: kwargs.pop(key) for key in ("follow_redirects", "auth", "long_poll") if key in kwargs}
+        request = self.build_request(method, url, **kwargs)
+        return await self.send(request, **send_kwargs)
+
+    async def get(self: HTTPTransport, url: httpx.URL | str, **kwargs: t.Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def stats(self: HTTPTransport) -> PoolStats:
+        return replace(self._stats)
+
+    async def aclose(self: HTTPTransport) -> None:
+        stats = self.stats()
+        logger.debug(
+            f"CLOSING HTTP TRANSPORT: {stats.requests=}, {stats.connections_opened=}, {stats.connections_reused=}"
+        )
+        await self.client.aclose()
@@ -0,0 +1,229 @@
+"""Re-encodes screenshots and tiles them into grids before they're uploaded (requires the `Pillow` package)"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import importlib.util
+import io
+import math
+import multiprocessing
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from loguru import logger
+
+from csinspect import metrics
+from csinspect.config import (
+    IMAGE_FORMAT,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_MIN_QUALITY,
+    IMAGE_PROCESSING,
+    IMAGE_QUALITY,
+    IMAGE_WORKERS,
+)
+
+if t.TYPE_CHECKING:
+    from PIL import Image
+
+T = t.TypeVar("T")
+
+
+def available(*, enabled: bool = IMAGE_PROCESSING) -> bool:
+    if not enabled:
+        return False
+    if importlib.util.find_spec("PIL") is None:
+        logger.warning("IMAGE PROCESSING DISABLED (`Pillow` Is Not Installed)")
+        return False
+    return True
+
+
+def media_groups(items: t.Sequence[T], max_media: int) -> list[tuple[T, ...]]:
+    """Splits items into at most `max_media` consecutive groups whose sizes differ by at most one."""
+    if not items:
+        return []
+
+    size, extra = divmod(len(items), min(len(items), max_media))
+    groups = []
+    start = 0
+    for index in range(min(len(items), max_media)):
+        end = start + size + (index < extra)
+        groups.append(tuple(items[start:end]))
+        start = end
+    return groups
+
+
+@dataclass(frozen=True, slots=True)
+class ImageSettings:
+    image_format: str = IMAGE_FORMAT
+    quality: int = IMAGE_QUALITY
+    min_quality: int = IMAGE_MIN_QUALITY
+    max_dimension: int = IMAGE_MAX_DIMENSION
+    max_bytes: int = IMAGE_MAX_BYTES
+
+
+class ProcessedImage(t.NamedTuple):
+    content: bytes
+    media_type: str
+
+
+# --- run in the process pool (module level so they can be pickled) ---
+
+
+def encode(image: Image.Image, settings: ImageSettings) -> ProcessedImage:
+    """Lowers the quality step by step until the image fits in `max_bytes` (or `min_quality` is reached)."""
+    from PIL import Image
+
+    quality = settings.quality
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format=settings.image_format, quality=quality, optimize=True)
+        if buffer.tell() <= settings.max_bytes or quality <= settings.min_quality:
+            return ProcessedImage(buffer.getvalue(), Image.MIME[settings.image_format.upper()])
+        quality = max(quality - 10, settings.min_quality)
+
+
+def reencode(content: bytes, settings: ImageSettings) -> ProcessedImage:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as original:
+        original_format = original.format
+        fits = max(original.size) <= settings.max_dimension and len(content) <= settings.max_bytes
+
+        image = original.convert("RGB")
+        image.thumbnail((settings.max_dimension, settings.max_dimension), Image.Resampling.LANCZOS)
+
+    processed = encode(image, settings)
+
+    # already small enough, and re-encoding didn't make it smaller
+    if fits and original_format and len(processed.content) >= len(content):
+        return ProcessedImage(content, Image.MIME[original_format])
+    return processed
+
+
+def grid_layout(count: int, aspect_ratio: float, max_dimension: int) -> tuple[int, int, int, int]:
+    """The (columns, rows, cell width, cell height) that fit `count` cells in the largest cells possible."""
+    layouts = []
+    for columns in range(1, count + 1):
+        rows = math.ceil(count / columns)
+        cell_width = min(max_dimension // columns, int(max_dimension * aspect_ratio) // rows)
+        cell_height = max(1, round(cell_width / aspect_ratio))
+        layouts.append((columns, rows, cell_width, cell_height))
+    return max(layouts, key=lambda layout: layout[2] * layout[3])
+
+
+def compose_grid(contents: t.Sequence[bytes], settings: ImageSettings) -> ProcessedImage:
+    """Tiles the images into one, row by row, each scaled to fit its cell (cells take the first image's shape)."""
+    from PIL import Image
+
+    images = []
+    for content in contents:
+        with Image.open(io.BytesIO(content)) as opened:
+            images.append(opened.convert("RGB"))
+
+    first_width, first_height = images[0].size
+    columns, _, cell_width, cell_height = grid_layout(len(images), first_width / first_height, settings.max_dimension)
+    rows = math.ceil(len(images) / columns)
+
+    grid = Image.new("RGB", (cell_width * columns, cell_height * rows))
+    for index, image in enumerate(images):
+        image.thumbnail((cell_width, cell_height), Image.Resampling.LANCZOS)
+        row, column = divmod(index, columns)
+        x = column * cell_width + (cell_width - image.width) // 2
+        y = row * cell_height + (cell_height - image.height) // 2
+        grid.paste(image, (x, y))
+
+    return encode(grid, settings)
+
+
+# ---
+
+
+@dataclass(slots=True)
+class ImageStats:
+    images: int = 0
+    grids: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    # more than IMAGE_WORKERS means jobs are queueing for a process
+    in_flight: int = 0
+
+    @property
+    def ratio(self: ImageStats) -> float:
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+
+class ImageProcessor:
+    """Runs the CPU heavy decoding and encoding in a process pool, so the event loop never waits on it."""
+
+    def __init__(self: ImageProcessor, *, workers: int = IMAGE_WORKERS, settings: ImageSettings | None = None) -> None:
+        self.workers = workers
+        self.settings = settings or ImageSettings()
+        self.stats = ImageStats()
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self: ImageProcessor) -> ProcessPoolExecutor:
+        # started on first use, so processes that never upload never start it.
+        # forking a process that runs an event loop (and its threads) copies them mid-flight,
+        # so workers are started from a clean server process instead
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return self._executor
+
+    @metrics.timed("image_processing")
+    async def process(self: ImageProcessor, contents: t.Sequence[bytes]) -> ProcessedImage:
+        """Re-encodes a single image, or composes several into one grid image."""
+        if len(contents) == 1:
+            job = functools.partial(reencode, contents[0], self.settings)
+        else:
+            job = functools.partial(compose_grid, contents, self.settings)
+
+        loop = asyncio.get_running_loop()
+        self.stats.in_flight += 1
+        try:
+            processed = await loop.run_in_executor(self.executor, job)
+        finally:
+            self.stats.in_flight -= 1
+
+        bytes_in = sum(map(len, contents))
+        self.stats.images += len(contents)
+        self.stats.grids += len(contents) > 1
+        self.stats.bytes_in += bytes_in
+        self.stats.bytes_out += len(processed.content)
+        logger.debug(
+            f"IMAGE PROCESSED ({len(contents)} Image(s)): {bytes_in / 1024:.0f} KiB -> {len(processed.content) / 1024:.0f} KiB"
+        )
+        return processed
+
+    def close(self: ImageProcessor) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+if __name__ == "__main__":  # pragma: no cover
+    import pathlib
+    import sys
+
+    async def main() -> None:
+        """Processes local sample images the way a reply would: python -m csinspect.images a.png [b.png ...]"""
+        paths = [pathlib.Path(arg) for arg in sys.argv[1:]]
+        contents = [path.read_bytes() for path in paths]
+        processor = ImageProcessor()
+
+        for index, group in enumerate(media_groups(contents, 4)):
+            processed = await processor.process(group)
+            extension = processed.media_type.removeprefix("image/")
+            output = pathlib.Path(f"processed-{index}.{extension}")
+            output.write_bytes(processed.content)
+            logger.success(f"WROTE {output} ({len(group)} Image(s), {len(processed.content) / 1024:.0f} KiB)")
+
+        logger.info(f"{processor.stats.bytes_in / 1024:.0f} KiB IN, {processor.stats.bytes_out / 1024:.0f} KiB OUT")
+        processor.close()
+
+    asyncio.run(main())
@@ -10,6 +10,8 @@ class Item:
 
     inspect_link: str = field(hash=True)
     image_link: str | None = field(compare=False, init=False, hash=False, default=None)
+    # the uploaded media showing this item's screenshot (shared by the items of a grid)
+    media_id: int | None = field(compare=False, init=False, hash=False, default=None)
 
     @property
     def unquoted_inspect_link(self: Item) -> str:
@@ -0,0 +1,163 @@
+"""Adaptive concurrency limiting and circuit breaking for upstream services"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+import typing as t
+
+from loguru import logger
+
+from csinspect.config import (
+    SCREENSHOT_BREAKER_COOLDOWN,
+    SCREENSHOT_BREAKER_FAILURES,
+    SCREENSHOT_BREAKER_MAX_COOLDOWN,
+    SCREENSHOT_LIMIT_INITIAL,
+    SCREENSHOT_LIMIT_LATENCY_TARGET,
+    SCREENSHOT_LIMIT_MAX,
+    SCREENSHOT_LIMIT_MIN,
+)
+
+
+class AIMDLimiter:
+    """
+    Additive-increase/multiplicative-decrease concurrency limit.
+    Every fast, healthy response grows the limit by roughly one per round trip;
+    an overload signal (429, 5xx, timeout) halves it and a slow response trims it.
+    """
+
+    def __init__(
+        self: AIMDLimiter,
+        *,
+        initial: int = SCREENSHOT_LIMIT_INITIAL,
+        minimum: int = SCREENSHOT_LIMIT_MIN,
+        maximum: int = SCREENSHOT_LIMIT_MAX,
+        latency_target: float = SCREENSHOT_LIMIT_LATENCY_TARGET,
+        backoff: float = 0.5,
+        slow_backoff: float = 0.9,
+    ) -> None:
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.slow_backoff = slow_backoff
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self: AIMDLimiter) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self: AIMDLimiter, latency: float, *, overloaded: bool) -> None:
+        if overloaded:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+        elif latency > self.latency_target:
+            self.limit = max(self.minimum, self.limit * self.slow_backoff)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def slot(self: AIMDLimiter) -> t.AsyncIterator[LimiterSlot]:
+        await self.acquire()
+        slot = LimiterSlot()
+        try:
+            yield slot
+        finally:
+            await self.release(time.monotonic() - slot.started_at, overloaded=slot.overloaded)
+
+
+class LimiterSlot:
+    __slots__ = ("overloaded", "started_at")
+
+    def __init__(self: LimiterSlot) -> None:
+        self.started_at = time.monotonic()
+        self.overloaded = False
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+    def __init__(self: CircuitOpenError, name: str, retry_after: float) -> None:
+        super().__init__(f"{name} circuit is open (retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures and fails fast until `cooldown` has passed.
+    Then a single probe is let through: success closes the circuit, failure re-opens it for twice as long.
+    """
+
+    def __init__(
+        self: CircuitBreaker,
+        name: str,
+        *,
+        failures: int = SCREENSHOT_BREAKER_FAILURES,
+        cooldown: float = SCREENSHOT_BREAKER_COOLDOWN,
+        max_cooldown: float = SCREENSHOT_BREAKER_MAX_COOLDOWN,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.state: t.Literal["closed", "open", "half_open"] = "closed"
+        self.consecutive_failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+
+    @property
+    def retry_after(self: CircuitBreaker) -> float:
+        if self.state == "closed":
+            return 0.0
+        return max(self.opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    @property
+    def available(self: CircuitBreaker) -> bool:
+        return self.retry_after == 0
+
+    def allow(self: CircuitBreaker) -> None:
+        """Raises `CircuitOpenError` unless a call may go through now."""
+        if self.state == "closed":
+            return
+
+        retry_after = self.retry_after
+        if retry_after > 0:
+            raise CircuitOpenError(self.name, retry_after)
+
+        # one probe per cooldown (a probe that never reports back doesn't wedge the circuit)
+        logger.info(f"CIRCUIT HALF-OPEN (Probing): {self.name}")
+        self.state = "half_open"
+        self.opened_at = time.monotonic()
+
+    def record_success(self: CircuitBreaker) -> None:
+        if self.state != "closed":
+            logger.info(f"CIRCUIT CLOSED: {self.name}")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.cooldown = self.base_cooldown
+
+    def record_failure(self: CircuitBreaker) -> None:
+        self.consecutive_failures += 1
+
+        if self.state == "open":
+            # calls that were already in flight when the circuit opened
+            return
+        if self.state == "half_open":
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        elif self.consecutive_failures < self.failure_threshold:
+            return
+
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        logger.warning(
+            f"CIRCUIT OPEN ({self.consecutive_failures} Failures, Retry In {self.cooldown:.0f}s): {self.name}"
+        )
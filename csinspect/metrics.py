@@ -0,0 +1,260 @@
+"""In-process counters, gauges and latency histograms, served in the Prometheus text format"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import bisect
+import contextlib
+import functools
+import math
+import time
+import typing as t
+
+from loguru import logger
+
+from csinspect.config import METRICS_HOST, METRICS_PORT
+
+P = t.ParamSpec("P")
+R = t.TypeVar("R")
+M = t.TypeVar("M", bound="Metric")
+
+Labels = tuple[str, ...]
+Sample = tuple[str, dict[str, str], float]
+
+# seconds, from a redis round trip to a slow Skinport render
+DEFAULT_BUCKETS: t.Final = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)  # fmt: skip
+
+
+class Metric(abc.ABC):
+    """A named family of samples, one per combination of label values."""
+
+    kind: t.ClassVar[str]
+
+    def __init__(self: Metric, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def label_values(self: Metric, labels: dict[str, str]) -> Labels:
+        return tuple(labels[name] for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self: Metric) -> t.Iterable[Sample]:
+        """Every sample of the family, as (name, labels, value)."""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self: Counter, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self: Counter, amount: float = 1, **labels: str) -> None:
+        key = self.label_values(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self: Counter) -> t.Iterable[Sample]:
+        for key, value in self.values.items():
+            yield f"{self.name}_total", dict(zip(self.labelnames, key, strict=True)), value
+
+
+class Gauge(Metric):
+    """A value that is set directly, or read from `function` whenever the metrics are collected."""
+
+    kind = "gauge"
+
+    def __init__(
+        self: Gauge,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        *,
+        function: t.Callable[[], t.Mapping[Labels, float] | float] | None = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[Labels, float] = {}
+        self.function = function
+
+    def set(self: Gauge, value: float, **labels: str) -> None:
+        self.values[self.label_values(labels)] = value
+
+    def samples(self: Gauge) -> t.Iterable[Sample]:
+        values: t.Mapping[Labels, float] = self.values
+        if self.function is not None:
+            collected = self.function()
+            values = collected if isinstance(collected, t.Mapping) else {(): collected}
+
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key, strict=True)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self: Histogram,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        *,
+        buckets: t.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # per label set: a count per bucket (plus +Inf), the sum and the count
+        self.counts: dict[Labels, list[int]] = {}
+        self.sums: dict[Labels, float] = {}
+
+    def observe(self: Histogram, value: float, **labels: str) -> None:
+        key = self.label_values(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def quantile(self: Histogram, quantile: float, **labels: str) -> float | None:
+        """Estimated like Prometheus' `histogram_quantile`: interpolated linearly within the bucket it falls in."""
+        counts = self.counts.get(self.label_values(labels))
+        if not counts or not sum(counts):
+            return None
+
+        rank = quantile * sum(counts)
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self: Histogram) -> t.Iterable[Sample]:
+        for key, counts in self.counts.items():
+            labels = dict(zip(self.labelnames, key, strict=True))
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": format_value(upper_bound)}, cumulative
+            yield f"{self.name}_sum", labels, self.sums[key]
+            yield f"{self.name}_count", labels, cumulative
+
+    @contextlib.contextmanager
+    def timer(self: Histogram, **labels: str) -> t.Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+
+class Registry:
+    def __init__(self: Registry) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self: Registry, metric: M) -> M:
+        # modules register their metrics on import, objects (re)register their gauges when they're created
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self: Registry) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logger.exception(f"Error Collecting Metric: {metric.name}")
+                continue
+            for name, labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = {
+        name: value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for name, value in labels.items()
+    }
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+REGISTRY: t.Final = Registry()
+
+STAGE_SECONDS: t.Final = REGISTRY.register(
+    Histogram("csinspect_stage_seconds", "Time spent in each stage of handling a tweet.", ("stage",))
+)
+TWEETS: t.Final = REGISTRY.register(Counter("csinspect_tweets", "Tweets handled, by outcome.", ("outcome",)))
+SCREENSHOT_PROVIDER_SECONDS: t.Final = REGISTRY.register(
+    Histogram(
+        "csinspect_screenshot_provider_seconds",
+        "Time each screenshot provider took to answer, by whether it rendered the item.",
+        ("provider", "outcome"),
+    )
+)
+
+
+def timed(stage: str) -> t.Callable[[t.Callable[P, t.Awaitable[R]]], t.Callable[P, t.Coroutine[t.Any, t.Any, R]]]:
+    """Records how long every call of the decorated coroutine function takes as `stage`."""
+
+    def decorator(function: t.Callable[P, t.Awaitable[R]]) -> t.Callable[P, t.Coroutine[t.Any, t.Any, R]]:
+        @functools.wraps(function)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            started_at = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started_at, stage=stage)
+
+        return wrapper
+
+    return decorator
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        # headers are irrelevant, but have to be read before responding
+        while (await reader.readline()).strip():
+            pass
+
+        method, path, *_ = request_line.decode("latin-1").split()
+        if method == "GET" and path.split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ValueError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(*, host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.Server:
+    server = await asyncio.start_server(handle_request, host, port)
+    logger.info(f"SERVING METRICS: http://{host}:{port}/metrics")
+    return server
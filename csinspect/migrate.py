@@ -0,0 +1,98 @@
+"""
+Copies every per-key tweet state (hash or legacy JSON) into the compact bucketed encoding.
+
+Run it before switching TWEET_STATE_ENCODING to "compact". States already written in the compact encoding win,
+so it's safe to run again (or while the bot is already writing compact states).
+
+    python -m csinspect.migrate [--delete]
+
+`--delete` removes the per-key states once they've been copied.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import typing as t
+from datetime import datetime
+
+from loguru import logger
+from redis.exceptions import ResponseError
+
+from csinspect import redis_
+from csinspect.config import REDIS_EX
+
+if t.TYPE_CHECKING:
+    from csinspect.typings import TweetResponseState
+
+BATCH_SIZE: t.Final = 1000
+
+
+def parse_epoch(value: str | None) -> int:
+    try:
+        return int(datetime.fromisoformat(value).timestamp()) if value else 0
+    except ValueError:
+        return 0
+
+
+async def migrate_batch(keys: list[str], *, delete: bool) -> int:
+    redis = redis_.get_redis()
+
+    async with redis.pipeline(transaction=False) as pipeline:
+        for key in keys:
+            pipeline.hmget(key, (*redis_.TWEET_STATE_FIELDS, "time"))
+        results: list[list[str | None] | ResponseError] = await pipeline.execute(raise_on_error=False)
+
+    states: dict[str, tuple[TweetResponseState, int]] = {}
+    for key, result in zip(keys, results, strict=True):
+        if isinstance(result, ResponseError):
+            # WRONGTYPE: still JSON encoded
+            value = await redis.get(key)
+            state = redis_.parse_legacy_tweet_state(value)
+            epoch = parse_epoch(json.loads(value).get("time")) if value else 0
+        else:
+            *fields, time = result
+            state = redis_.parse_tweet_state(fields)
+            epoch = parse_epoch(time)
+
+        if state is not None:
+            states[key] = (state, epoch)
+
+    async with redis.pipeline(transaction=False) as pipeline:
+        for key, (state, epoch) in states.items():
+            bucket_key, field = redis_.tweet_state_bucket(int(key.removeprefix("tweet:")))
+            pipeline.hsetnx(bucket_key, str(field), redis_.pack_tweet_state(state, epoch=epoch))
+            pipeline.expire(bucket_key, REDIS_EX)
+        if delete:
+            pipeline.delete(*states)
+        await pipeline.execute()
+
+    return len(states)
+
+
+async def main() -> None:
+    delete = "--delete" in sys.argv[1:]
+    redis = redis_.get_redis()
+    migrated = 0
+    keys: list[str] = []
+
+    async for key in redis.scan_iter(match="tweet:*", count=BATCH_SIZE):
+        if not key.removeprefix("tweet:").isdigit():
+            continue
+
+        keys.append(key)
+        if len(keys) >= BATCH_SIZE:
+            migrated += await migrate_batch(keys, delete=delete)
+            keys = []
+            logger.info(f"MIGRATED {migrated} TWEET STATES")
+
+    if keys:
+        migrated += await migrate_batch(keys, delete=delete)
+
+    logger.success(f"MIGRATED {migrated} TWEET STATES TO THE COMPACT ENCODING{' (DELETED ORIGINALS)' if delete else ''}")
+    await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
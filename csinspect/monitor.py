@@ -0,0 +1,186 @@
+"""Watches the event loop: how late it wakes up, what blocks it, and how backed up its default executor is"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import sys
+import threading
+import time
+import traceback
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from loguru import logger
+
+from csinspect import metrics
+from csinspect.config import LOOP_BLOCKED_THRESHOLD, LOOP_LAG_THRESHOLD, LOOP_MONITOR_INTERVAL, USE_UVLOOP
+
+P = t.ParamSpec("P")
+R = t.TypeVar("R")
+
+LOOP_LAG_SECONDS: t.Final = metrics.REGISTRY.register(
+    metrics.Histogram(
+        "csinspect_event_loop_lag_seconds",
+        "How much later than scheduled the event loop woke the monitor up.",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    )
+)
+LOOP_BLOCKED: t.Final = metrics.REGISTRY.register(
+    metrics.Counter("csinspect_event_loop_blocked", "Times a single callback held the event loop too long.")
+)
+
+
+def loop_factory(*, use_uvloop: bool = USE_UVLOOP) -> t.Callable[[], asyncio.AbstractEventLoop] | None:
+    """uvloop's loop if it's enabled and installed, otherwise `None` (asyncio's default loop)."""
+    if not use_uvloop:
+        return None
+    if importlib.util.find_spec("uvloop") is None:
+        logger.warning("USING THE DEFAULT EVENT LOOP (`uvloop` Is Not Installed)")
+        return None
+
+    import uvloop
+
+    new_event_loop: t.Callable[[], asyncio.AbstractEventLoop] = uvloop.new_event_loop
+    return new_event_loop
+
+
+class MonitoredExecutor(ThreadPoolExecutor):
+    """The loop's default executor (DNS lookups, `to_thread`), counting the calls waiting for a thread."""
+
+    def __init__(self: MonitoredExecutor, max_workers: int | None = None) -> None:
+        super().__init__(max_workers=max_workers, thread_name_prefix="csinspect-executor")
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def submit(self: MonitoredExecutor, fn: t.Callable[P, R], /, *args: P.args, **kwargs: P.kwargs) -> Future[R]:
+        def run() -> R:
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        with self._lock:
+            self.queued += 1
+        try:
+            return super().submit(run)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+
+@dataclass(slots=True)
+class LoopStats:
+    lag: float = 0.0
+    max_lag: float = 0.0
+    # wake ups later than LOOP_LAG_THRESHOLD
+    lagging: int = 0
+    # callbacks that ran longer than LOOP_BLOCKED_THRESHOLD
+    blocked: int = 0
+
+
+class LoopMonitor:
+    """
+    A task on the loop wakes up every `interval` and records how late it was (the loop's lag).
+    A watchdog thread checks on that task: when it hasn't run for `blocked_threshold`,
+    whatever is running on the loop is blocking it, and the loop thread's stack shows what it is.
+    """
+
+    def __init__(
+        self: LoopMonitor,
+        *,
+        interval: float = LOOP_MONITOR_INTERVAL,
+        lag_threshold: float = LOOP_LAG_THRESHOLD,
+        blocked_threshold: float = LOOP_BLOCKED_THRESHOLD,
+    ) -> None:
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.blocked_threshold = blocked_threshold
+        self.stats = LoopStats()
+        self.executor = MonitoredExecutor()
+        self.heartbeat = time.monotonic()
+        self.task: asyncio.Task[None] | None = None
+        self.watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+        metrics.REGISTRY.register(
+            metrics.Gauge(
+                "csinspect_default_executor_calls",
+                "Calls waiting for, or running on, a thread of the event loop's default executor.",
+                ("state",),
+                function=lambda: {("queued",): self.executor.queued, ("running",): self.executor.running},
+            )
+        )
+
+    def start(self: LoopMonitor) -> None:
+        if self.task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+
+        self.heartbeat = time.monotonic()
+        self._stopped.clear()
+        self.task = asyncio.create_task(self.measure_lag(), name="csinspect-loop-monitor")
+        self.watchdog = threading.Thread(
+            target=self.watch, args=(threading.get_ident(),), name="csinspect-loop-watchdog", daemon=True
+        )
+        self.watchdog.start()
+
+    async def stop(self: LoopMonitor) -> None:
+        self._stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+
+    async def measure_lag(self: LoopMonitor) -> None:
+        saturated = False
+
+        while True:
+            scheduled_at = time.monotonic()
+            self.heartbeat = scheduled_at
+            await asyncio.sleep(self.interval)
+
+            lag = max(time.monotonic() - scheduled_at - self.interval, 0.0)
+            self.stats.lag = lag
+            self.stats.max_lag = max(self.stats.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+            if lag > self.lag_threshold:
+                self.stats.lagging += 1
+                logger.warning(f"EVENT LOOP LAGGING ({lag * 1000:.0f}ms Late)")
+
+            # logged when calls start queueing for a thread, not on every tick they still are
+            if self.executor.queued and not saturated:
+                logger.warning(f"DEFAULT EXECUTOR SATURATED ({self.executor.queued} Calls Waiting For A Thread)")
+            saturated = bool(self.executor.queued)
+
+    def watch(self: LoopMonitor, loop_thread_id: int) -> None:
+        """Runs on its own thread, so it still runs while the loop is blocked."""
+        reported_heartbeat = 0.0
+
+        while not self._stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            # one report per stall
+            if blocked_for < self.blocked_threshold or heartbeat == reported_heartbeat:
+                continue
+
+            reported_heartbeat = heartbeat
+            self.stats.blocked += 1
+            LOOP_BLOCKED.inc()
+
+            frame = sys._current_frames().get(loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(unavailable)\n"
+            logger.warning(f"EVENT LOOP BLOCKED (At Least {blocked_for:.1f}s) IN:\n{stack.rstrip()}")
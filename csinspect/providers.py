@@ -0,0 +1,264 @@
+"""Screenshot providers and the engine that routes (and hedges) requests between them"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import contextlib
+import statistics
+import time
+import typing as t
+from collections import deque
+from dataclasses import dataclass, field
+
+import httpx
+from loguru import logger
+
+from csinspect import metrics
+from csinspect.config import (
+    SCREENSHOT_HEDGE_DELAY,
+    SCREENSHOT_HEDGE_PERCENTILE,
+    SCREENSHOT_MIN_SUCCESS_RATE,
+    SCREENSHOT_PROFILE_WINDOW,
+    SCREENSHOT_TIMEOUT,
+)
+from csinspect.http_ import USER_AGENT
+from csinspect.limiter import AIMDLimiter, CircuitBreaker, CircuitOpenError
+
+if t.TYPE_CHECKING:
+    from csinspect.http_ import HTTPTransport
+    from csinspect.item import Item
+
+
+class ProviderOverloadedError(Exception):
+    """The provider is rate limiting us or failing server-side (429 / 5xx)."""
+
+    def __init__(self: ProviderOverloadedError, name: str, status_code: int) -> None:
+        super().__init__(f"{name} responded with {status_code}")
+        self.status_code = status_code
+
+
+class ScreenshotUnavailableError(Exception):
+    """
+    No provider answered for the item (each was overloaded, timed out or failing fast).
+    Nothing is known about the item itself, so it isn't cached as a failure and is worth retrying later.
+    """
+
+
+class ScreenshotProvider(abc.ABC):
+    """A service that renders an inspect link into a hosted image."""
+
+    name: t.ClassVar[str]
+
+    @abc.abstractmethod
+    async def screenshot(self: ScreenshotProvider, item: Item) -> str | None:
+        """
+        Returns the image link, or `None` if the provider couldn't render the item.
+        Raises `ProviderOverloadedError` (or a transport error) when the provider itself is unhealthy.
+        """
+
+
+class SkinportProvider(ScreenshotProvider):
+    name = "skinport"
+    URL: t.ClassVar = "https://screenshot.skinport.com/direct"
+    HEADERS: t.ClassVar = {
+        "Upgrade-Insecure-Requests": "1",
+        "User-Agent": USER_AGENT,
+    }
+
+    def __init__(
+        self: SkinportProvider, http: HTTPTransport, *, url: str = URL, timeout: float = SCREENSHOT_TIMEOUT
+    ) -> None:
+        self.http = http
+        self.url = url
+        self.timeout = timeout
+
+    async def screenshot(self: SkinportProvider, item: Item) -> str | None:
+        """
+        Unlike swap.gg, Skinport does not use a WebSocket connection to get the screenshot.
+        """
+        params = {"link": item.unquoted_inspect_link}
+        response = await self.http.get(
+            self.url,
+            params=params,
+            headers=self.HEADERS,
+            timeout=self.timeout,
+            follow_redirects=False,
+            long_poll=True,
+        )
+
+        # redirects and format inspect link
+        if response.status_code == 308 and response.next_request:
+            logger.debug(f"SKINPORT SCREENSHOT REDIRECT: {response.next_request.url}")
+            response = await self.http.send(response.next_request, follow_redirects=False, long_poll=True)
+
+        # redirects to the image link
+        # (no need to follow request at this point in time)
+        if response.next_request:
+            return str(response.next_request.url)
+
+        if response.status_code == httpx.codes.TOO_MANY_REQUESTS or response.is_server_error:
+            raise ProviderOverloadedError(self.name, response.status_code)
+
+        logger.debug(f"SKINPORT SCREENSHOT FAILED: {response.status_code=}, {response.next_request=}")
+        return None
+
+
+@dataclass(slots=True)
+class ProviderProfile:
+    """Rolling latency and success record of one provider, with its concurrency limit and circuit breaker."""
+
+    provider: ScreenshotProvider
+    window: int = SCREENSHOT_PROFILE_WINDOW
+    latencies: deque[float] = field(init=False)
+    outcomes: deque[bool] = field(init=False)
+    limiter: AIMDLimiter = field(init=False)
+    breaker: CircuitBreaker = field(init=False)
+
+    def __post_init__(self: ProviderProfile) -> None:
+        self.latencies = deque(maxlen=self.window)
+        self.outcomes = deque(maxlen=self.window)
+        self.limiter = AIMDLimiter()
+        self.breaker = CircuitBreaker(self.provider.name)
+
+    @property
+    def name(self: ProviderProfile) -> str:
+        return self.provider.name
+
+    @property
+    def success_rate(self: ProviderProfile) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    @property
+    def healthy(self: ProviderProfile) -> bool:
+        return self.breaker.state == "closed" and self.success_rate >= SCREENSHOT_MIN_SUCCESS_RATE
+
+    def percentile(self: ProviderProfile, percentile: float) -> float | None:
+        if len(self.latencies) < 2:
+            return None
+        cut_points = statistics.quantiles(self.latencies, n=100, method="inclusive")
+        return cut_points[min(max(round(percentile * 100) - 1, 0), 98)]
+
+    def record(self: ProviderProfile, latency: float, *, success: bool) -> None:
+        self.outcomes.append(success)
+        if success:
+            self.latencies.append(latency)
+
+
+class ScreenshotEngine:
+    """
+    Sends each screenshot to the fastest healthy provider.
+    If it hasn't answered by that provider's `hedge_percentile` latency, the next provider is asked as well
+    and whichever renders the item first wins.
+    """
+
+    def __init__(
+        self: ScreenshotEngine,
+        providers: t.Sequence[ScreenshotProvider],
+        *,
+        hedge_percentile: float = SCREENSHOT_HEDGE_PERCENTILE,
+        hedge_delay: float = SCREENSHOT_HEDGE_DELAY,
+    ) -> None:
+        if not providers:
+            msg = "At least one screenshot provider is required"
+            raise ValueError(msg)
+
+        self.profiles = [ProviderProfile(provider) for provider in providers]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedged = 0
+
+    def ranked(self: ScreenshotEngine) -> list[ProviderProfile]:
+        # healthy before unhealthy, then by median latency (unmeasured providers first so they get sampled)
+        return sorted(self.profiles, key=lambda profile: (not profile.healthy, profile.percentile(0.5) or 0.0))
+
+    async def attempt(self: ScreenshotEngine, profile: ProviderProfile, item: Item) -> str | None:
+        """Raises `ScreenshotUnavailableError` unless the provider answered (with a render, or that it can't)."""
+        try:
+            profile.breaker.allow()
+        except CircuitOpenError as exc:
+            raise ScreenshotUnavailableError(str(exc)) from exc
+
+        error: Exception | None = None
+        async with profile.limiter.slot() as slot:
+            try:
+                image_link = await profile.provider.screenshot(item)
+            except asyncio.CancelledError:
+                raise
+            except (ProviderOverloadedError, httpx.TimeoutException, httpx.TransportError) as exc:
+                logger.warning(f"{profile.name.upper()} SCREENSHOT FAILED ({exc!r}): {item.inspect_link}")
+                slot.overloaded = True
+                image_link, error = None, exc
+            except Exception as exc:
+                logger.exception(f"{profile.name.upper()} SCREENSHOT ERROR: {item.inspect_link}")
+                slot.overloaded = True
+                image_link, error = None, exc
+
+        # an item the provider can't render is not the provider being unhealthy
+        if slot.overloaded:
+            profile.breaker.record_failure()
+        else:
+            profile.breaker.record_success()
+
+        latency = time.monotonic() - slot.started_at
+        profile.record(latency, success=image_link is not None)
+        outcome = "overloaded" if slot.overloaded else "rendered" if image_link is not None else "failed"
+        metrics.SCREENSHOT_PROVIDER_SECONDS.observe(latency, provider=profile.name, outcome=outcome)
+
+        if error is not None:
+            msg = f"{profile.name} couldn't answer ({error!r})"
+            raise ScreenshotUnavailableError(msg) from error
+        return image_link
+
+    async def screenshot(self: ScreenshotEngine, item: Item) -> str | None:
+        """
+        Returns the image link, or `None` if a provider answered that it can't render the item.
+        Raises `ScreenshotUnavailableError` if no provider answered at all, so the caller can retry later.
+        """
+        ranked = [profile for profile in self.ranked() if profile.breaker.available]
+        if not ranked:
+            soonest = min(self.profiles, key=lambda profile: profile.breaker.retry_after)
+            msg = f"every provider is failing fast ({soonest.name} retries in {soonest.breaker.retry_after:.0f}s)"
+            raise ScreenshotUnavailableError(msg)
+
+        pending: set[asyncio.Task[str | None]] = set()
+        unavailable: ScreenshotUnavailableError | None = None
+        answered = False
+
+        try:
+            for index, profile in enumerate(ranked):
+                pending.add(asyncio.create_task(self.attempt(profile, item)))
+
+                is_last = index == len(ranked) - 1
+                deadline = None if is_last else (profile.percentile(self.hedge_percentile) or self.hedge_delay)
+
+                # wait for a render, or for this provider to run past its deadline (then hedge with the next one)
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        self.hedged += 1
+                        logger.debug(f"SCREENSHOT HEDGED ({profile.name} Exceeded {deadline:.1f}s): {item.inspect_link}")
+                        break
+
+                    for task in done:
+                        try:
+                            image_link = task.result()
+                        except ScreenshotUnavailableError as exc:
+                            unavailable = exc
+                            continue
+                        if image_link is not None:
+                            return image_link
+                        answered = True
+
+                    # everything in flight failed, move on to the next provider right away
+                    if not pending:
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if answered or unavailable is None:
+            return None
+        raise unavailable
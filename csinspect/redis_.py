@@ -3,18 +3,32 @@
 from __future__ import annotations
 
 import json
+import time
 import typing as t
 from datetime import datetime
 from functools import lru_cache
 
 from loguru import logger
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError
 
-from csinspect.config import REDIS_DATABASE, REDIS_EX, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
-from csinspect.typings import TweetResponseState
+from csinspect.config import (
+    REDIS_DATABASE,
+    REDIS_EX,
+    REDIS_HOST,
+    REDIS_PASSWORD,
+    REDIS_PORT,
+    STREAM_MAX_LENGTH,
+    TWEET_STATE_BUCKET_SECONDS,
+    TWEET_STATE_ENCODING,
+    TWITTER_MEDIA_ID_EX,
+)
+from csinspect.tweet import TweetWithInspectLink
+from csinspect.typings import SearchCheckpoint, StreamedTweet, TweetResponseState
 
 if t.TYPE_CHECKING:
-    from csinspect.tweet import TweetWithInspectLink
+    from redis.commands.core import AsyncScript
+
     from csinspect.typings import TweetResponseRawData
 
 
@@ -23,12 +37,31 @@ def get_redis() -> Redis[str]:
     return Redis(host=REDIS_HOST, password=REDIS_PASSWORD, port=REDIS_PORT, db=REDIS_DATABASE, decode_responses=True)
 
 
-async def tweet_state(tweet: TweetWithInspectLink) -> TweetResponseState | None:
-    redis_ = get_redis()
+# tweet state is stored as a hash (successful, failed_attempts, time) so it can be updated server-side in one call.
+# values written before that were JSON strings; the script migrates them in place on their next update.
+UPDATE_TWEET_STATE_SCRIPT: t.Final = """
+local key = KEYS[1]
+local successful = ARGV[1]
+local has_state = redis.call('EXISTS', key) == 1
+
+if has_state and redis.call('TYPE', key).ok == 'string' then
+    local data = cjson.decode(redis.call('GET', key))
+    redis.call('DEL', key)
+    redis.call('HSET', key, 'successful', data['successful'] and '1' or '0', 'failed_attempts', data['failed_attempts'] or 0)
+end
+
+if successful == '0' and has_state then
+    redis.call('HINCRBY', key, 'failed_attempts', 1)
+end
 
-    key = f"tweet:{tweet.id}"
-    tweet_value = await redis_.get(key)
+redis.call('HSET', key, 'successful', successful, 'time', ARGV[2])
+redis.call('EXPIRE', key, ARGV[3])
+return tonumber(redis.call('HGET', key, 'failed_attempts') or '0')
+"""
+TWEET_STATE_FIELDS: t.Final = ("successful", "failed_attempts")
 
+
+def parse_legacy_tweet_state(tweet_value: str | None) -> TweetResponseState | None:
     if not tweet_value:
         return None
 
@@ -36,16 +69,448 @@ async def tweet_state(tweet: TweetWithInspectLink) -> TweetResponseState | None:
     return TweetResponseState(successful=data["successful"], failed_attempts=data.get("failed_attempts", 0))
 
 
-async def update_tweet_state(tweet: TweetWithInspectLink, *, successful: bool) -> None:
+def parse_tweet_state(fields: list[str | None]) -> TweetResponseState | None:
+    successful, failed_attempts = fields
+
+    if successful is None:
+        return None
+
+    return TweetResponseState(successful=successful == "1", failed_attempts=int(failed_attempts or 0))
+
+
+async def tweet_state(tweet: TweetWithInspectLink) -> TweetResponseState | None:
+    states = await tweet_states((tweet,))
+    return states[0]
+
+
+async def tweet_states(tweets: t.Sequence[TweetWithInspectLink]) -> list[TweetResponseState | None]:
+    return await tweet_states_by_id([tweet.id for tweet in tweets])
+
+
+async def tweet_states_by_id(tweet_ids: t.Sequence[int]) -> list[TweetResponseState | None]:
+    if TWEET_STATE_ENCODING == "compact":
+        return await compact_tweet_states_by_id(tweet_ids)
+    return await hash_tweet_states_by_id(tweet_ids)
+
+
+async def hash_tweet_states_by_id(tweet_ids: t.Sequence[int]) -> list[TweetResponseState | None]:
+    """Resolves the state of many tweets in a single round trip (plus one more if any are still JSON encoded)."""
+    if not tweet_ids:
+        return []
+
+    redis_ = get_redis()
+    keys = [f"tweet:{tweet_id}" for tweet_id in tweet_ids]
+
+    async with redis_.pipeline(transaction=False) as pipeline:
+        for key in keys:
+            pipeline.hmget(key, TWEET_STATE_FIELDS)
+        results: list[list[str | None] | ResponseError] = await pipeline.execute(raise_on_error=False)
+
+    states: list[TweetResponseState | None] = [None] * len(keys)
+    legacy_indexes: list[int] = []
+
+    for index, result in enumerate(results):
+        if isinstance(result, ResponseError):
+            # WRONGTYPE: written before tweet state was stored as a hash
+            legacy_indexes.append(index)
+            continue
+        states[index] = parse_tweet_state(result)
+
+    if legacy_indexes:
+        legacy_values = await redis_.mget([keys[index] for index in legacy_indexes])
+        for index, legacy_value in zip(legacy_indexes, legacy_values, strict=True):
+            states[index] = parse_legacy_tweet_state(legacy_value)
+
+    return states
+
+
+async def answered_tweet_ids(*, batch_size: int = 1000) -> t.AsyncIterator[list[int]]:
+    """SCANs every stored tweet state, yielding the ids of successfully answered tweets a batch at a time."""
+    redis_ = get_redis()
+
+    async def answered(tweet_ids: list[int]) -> list[int]:
+        states = await tweet_states_by_id(tweet_ids)
+        return [tweet_id for tweet_id, state in zip(tweet_ids, states, strict=True) if state and state.successful]
+
+    if TWEET_STATE_ENCODING == "compact":
+        async for bucket_states in compact_tweet_state_buckets(batch_size=batch_size):
+            yield [tweet_id for tweet_id, state in bucket_states.items() if state.successful]
+        return
+
+    tweet_ids: list[int] = []
+    async for key in redis_.scan_iter(match="tweet:*", count=batch_size):
+        tweet_id = key.removeprefix("tweet:")
+        if not tweet_id.isdigit():
+            continue
+
+        tweet_ids.append(int(tweet_id))
+        if len(tweet_ids) >= batch_size:
+            yield await answered(tweet_ids)
+            tweet_ids = []
+
+    if tweet_ids:
+        yield await answered(tweet_ids)
+
+
+async def update_tweet_state(tweet: TweetWithInspectLink, *, successful: bool) -> TweetResponseState:
+    (state,) = await update_tweet_states((tweet,), successful=successful)
+    return state
+
+
+async def update_tweet_states(tweets: t.Sequence[TweetWithInspectLink], *, successful: bool) -> list[TweetResponseState]:
+    """Atomically stores the state of many tweets in one pipelined round trip, returning their new state."""
+    if not tweets:
+        return []
+
     redis_ = get_redis()
+    compact = TWEET_STATE_ENCODING == "compact"
+    script = update_compact_tweet_state_script() if compact else update_tweet_state_script()
+    # the compact state packs epoch seconds, a key per tweet stores an iso timestamp
+    stored_at = int(time.time())
+    updated_at = datetime.now().isoformat()
 
-    logger.debug(f"STORING TWEET: {tweet.url}")
+    async with redis_.pipeline(transaction=False) as pipeline:
+        for tweet in tweets:
+            logger.debug(f"STORING TWEET: {tweet.url}")
+            if compact:
+                key, field = tweet_state_bucket(tweet.id)
+                await script(keys=[key], args=[field, int(successful), stored_at, REDIS_EX], client=pipeline)
+            else:
+                await script(keys=[f"tweet:{tweet.id}"], args=[int(successful), updated_at, REDIS_EX], client=pipeline)
 
-    data: TweetResponseRawData = {"successful": successful, "time": datetime.now().isoformat()}
+        failed_attempts: list[int] = await pipeline.execute()
+
+    return [TweetResponseState(successful=successful, failed_attempts=attempts) for attempts in failed_attempts]
+
+
+@lru_cache(maxsize=None)
+def update_tweet_state_script() -> AsyncScript:
+    return get_redis().register_script(UPDATE_TWEET_STATE_SCRIPT)
+
+
+# --- compact tweet state ---
+# a key per tweet costs ~100 bytes of overhead before the state itself, so in "compact" mode tweets are grouped into
+# one small hash per TWEET_STATE_BUCKET_SECONDS of tweet time (taken from the snowflake id).
+# small hashes are stored as listpacks, and each field holds a single packed integer:
+#     epoch seconds << 16 | failed attempts << 1 | successful
+# a bucket expires REDIS_EX seconds after its last write.
+TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT: t.Final = 22
+TWEET_STATE_MAX_ATTEMPTS: t.Final = (1 << 15) - 1
+
+# numbers in lua are doubles, so the packing is done with arithmetic (exact below 2^53) rather than bit operations
+UPDATE_COMPACT_TWEET_STATE_SCRIPT: t.Final = """
+local packed = redis.call('HGET', KEYS[1], ARGV[1])
+local failed_attempts = 0
+
+if packed then
+    failed_attempts = math.floor(tonumber(packed) / 2) % 32768
+    if ARGV[2] == '0' then
+        failed_attempts = math.min(failed_attempts + 1, 32767)
+    end
+end
+
+local value = tonumber(ARGV[3]) * 65536 + failed_attempts * 2 + tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], string.format('%.0f', value))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return failed_attempts
+"""
+
+
+def tweet_state_bucket(tweet_id: int, *, bucket_seconds: int = TWEET_STATE_BUCKET_SECONDS) -> tuple[str, int]:
+    """The bucket key a tweet's compact state is stored in, and its (shortened) field within that bucket."""
+    bucket_span = bucket_seconds * 1000 << TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT
+    bucket, field = divmod(tweet_id, bucket_span)
+    return f"tweets:{bucket_seconds}:{bucket}", field
+
+
+def tweet_id_from_bucket(key: str, field: int) -> int:
+    _, bucket_seconds, bucket = key.split(":")
+    bucket_span = int(bucket_seconds) * 1000 << TWITTER_SNOWFLAKE_TIMESTAMP_SHIFT
+    return int(bucket) * bucket_span + field
+
+
+def pack_tweet_state(state: TweetResponseState, *, epoch: int) -> int:
+    return epoch << 16 | min(state.failed_attempts, TWEET_STATE_MAX_ATTEMPTS) << 1 | int(state.successful)
+
+
+def unpack_tweet_state(packed: str | None) -> TweetResponseState | None:
+    if packed is None:
+        return None
+
+    value = int(packed)
+    return TweetResponseState(successful=bool(value & 1), failed_attempts=value >> 1 & TWEET_STATE_MAX_ATTEMPTS)
+
+
+async def compact_tweet_states_by_id(tweet_ids: t.Sequence[int]) -> list[TweetResponseState | None]:
+    """One HGET per tweet (pipelined into a single round trip)."""
+    if not tweet_ids:
+        return []
+
+    redis_ = get_redis()
+
+    async with redis_.pipeline(transaction=False) as pipeline:
+        for tweet_id in tweet_ids:
+            key, field = tweet_state_bucket(tweet_id)
+            pipeline.hget(key, str(field))
+        values: list[str | None] = await pipeline.execute()
+
+    return [unpack_tweet_state(value) for value in values]
+
+
+async def compact_tweet_state_buckets(*, batch_size: int = 100) -> t.AsyncIterator[dict[int, TweetResponseState]]:
+    """SCANs every compact bucket, yielding the state of the tweets in each one."""
+    redis_ = get_redis()
+
+    async for key in redis_.scan_iter(match="tweets:*", count=batch_size):
+        fields: dict[str, str] = await redis_.hgetall(key)
+        yield {
+            tweet_id_from_bucket(key, int(field)): state
+            for field, packed in fields.items()
+            if (state := unpack_tweet_state(packed))
+        }
+
+
+@lru_cache(maxsize=None)
+def update_compact_tweet_state_script() -> AsyncScript:
+    return get_redis().register_script(UPDATE_COMPACT_TWEET_STATE_SCRIPT)
+
+
+# due retries are claimed atomically, so concurrent replicas never pick up the same tweet
+CLAIM_RETRIES_SCRIPT: t.Final = """
+local tweet_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #tweet_ids == 0 then
+    return {}
+end
+
+local payloads = redis.call('HMGET', KEYS[2], unpack(tweet_ids))
+redis.call('ZREM', KEYS[1], unpack(tweet_ids))
+redis.call('HDEL', KEYS[2], unpack(tweet_ids))
+return payloads
+"""
+
+
+async def schedule_retry(tweet: TweetWithInspectLink, *, at: float) -> None:
+    """Persists a tweet to be processed again at `at` (epoch seconds)."""
+    redis_ = get_redis()
 
-    if not successful:
-        state = await tweet_state(tweet)
-        if state:
-            data["failed_attempts"] = state.failed_attempts + 1
+    async with redis_.pipeline(transaction=True) as pipeline:
+        pipeline.hset("retry:payloads", str(tweet.id), json.dumps(tweet.to_dict()))
+        pipeline.zadd("retry:tweets", {str(tweet.id): at})
+        await pipeline.execute()
 
-    await redis_.set(name=f"tweet:{tweet.id}", value=json.dumps(data), ex=REDIS_EX)
+
+async def claim_due_retries(limit: int, *, now: float) -> list[TweetWithInspectLink]:
+    script = claim_retries_script()
+
+    payloads: list[str | None] = await script(keys=["retry:tweets", "retry:payloads"], args=[now, limit])
+    return [TweetWithInspectLink.from_dict(json.loads(payload)) for payload in payloads if payload]
+
+
+async def checkpoint_tweets(tweets: t.Sequence[TweetWithInspectLink]) -> None:
+    """
+    Persists tweets until they're handled: as they're queued,
+    and at shutdown with whatever they had rendered and uploaded.
+    """
+    if not tweets:
+        return
+
+    redis_ = get_redis()
+    async with redis_.pipeline(transaction=True) as pipeline:
+        pipeline.hset("checkpoint:tweets", mapping={str(tweet.id): json.dumps(tweet.to_dict()) for tweet in tweets})
+        pipeline.expire("checkpoint:tweets", REDIS_EX)
+        await pipeline.execute()
+
+
+async def take_checkpointed_tweets() -> list[TweetWithInspectLink]:
+    """Removes and returns every checkpointed tweet, so only one replica resumes them."""
+    redis_ = get_redis()
+    async with redis_.pipeline(transaction=True) as pipeline:
+        pipeline.hvals("checkpoint:tweets")
+        pipeline.delete("checkpoint:tweets")
+        payloads, _ = await pipeline.execute()
+    return [TweetWithInspectLink.from_dict(json.loads(payload)) for payload in payloads]
+
+
+async def forget_checkpointed_tweets(tweets: t.Sequence[TweetWithInspectLink]) -> None:
+    if tweets:
+        await get_redis().hdel("checkpoint:tweets", *(str(tweet.id) for tweet in tweets))
+
+
+@lru_cache(maxsize=None)
+def claim_retries_script() -> AsyncScript:
+    return get_redis().register_script(CLAIM_RETRIES_SCRIPT)
+
+
+# ingesters publish tweets to this stream, workers in the consumer group each claim a share of them
+TWEET_STREAM: t.Final = "stream:tweets"
+TWEET_STREAM_GROUP: t.Final = "workers"
+
+
+def parse_stream_entries(entries: t.Iterable[tuple[str, dict[str, str] | None]]) -> list[StreamedTweet]:
+    streamed_tweets = []
+    for stream_id, fields in entries:
+        # the entry was trimmed from the stream while it was pending
+        if not fields:
+            streamed_tweets.append(StreamedTweet(stream_id, None))
+            continue
+        tweet = TweetWithInspectLink.from_dict(json.loads(fields["tweet"]))
+        streamed_tweets.append(StreamedTweet(stream_id, tweet))
+    return streamed_tweets
+
+
+async def publish_tweets(tweets: t.Sequence[TweetWithInspectLink]) -> None:
+    if not tweets:
+        return
+
+    redis_ = get_redis()
+
+    async with redis_.pipeline(transaction=False) as pipeline:
+        for tweet in tweets:
+            logger.debug(f"PUBLISHING TWEET: {tweet.url}")
+            fields = {"tweet": json.dumps(tweet.to_dict())}
+            pipeline.xadd(TWEET_STREAM, fields, maxlen=STREAM_MAX_LENGTH, approximate=True)
+        await pipeline.execute()
+
+
+async def create_tweet_stream_group() -> None:
+    redis_ = get_redis()
+    try:
+        await redis_.xgroup_create(TWEET_STREAM, TWEET_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as exc:
+        # BUSYGROUP: another worker created it first
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+async def read_tweet_stream(consumer: str, *, count: int, block: float) -> list[StreamedTweet]:
+    """Claims up to `count` tweets no other worker has been given, waiting up to `block` seconds for any."""
+    redis_ = get_redis()
+    response = await redis_.xreadgroup(
+        TWEET_STREAM_GROUP, consumer, {TWEET_STREAM: ">"}, count=count, block=int(block * 1000)
+    )
+    if not response:
+        return []
+
+    ((_, entries),) = response
+    return parse_stream_entries(entries)
+
+
+async def reclaim_tweet_stream(consumer: str, *, min_idle: float, count: int) -> list[StreamedTweet]:
+    """Takes over tweets other workers claimed but never acknowledged (because they died)."""
+    redis_ = get_redis()
+    _, entries, *_ = await redis_.xautoclaim(
+        TWEET_STREAM, TWEET_STREAM_GROUP, consumer, min_idle_time=int(min_idle * 1000), count=count
+    )
+    return parse_stream_entries(entries)
+
+
+async def acknowledge_tweet_stream(*stream_ids: str) -> None:
+    if not stream_ids:
+        return
+
+    redis_ = get_redis()
+    await redis_.xack(TWEET_STREAM, TWEET_STREAM_GROUP, *stream_ids)
+
+
+# leases are only renewed or released by the instance holding them
+ACQUIRE_LEASE_SCRIPT: t.Final = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) and 1 or 0
+"""
+RELEASE_LEASE_SCRIPT: t.Final = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def acquire_lease(name: str, holder: str, *, ttl: float) -> bool:
+    """Takes (or renews) the lease `name` for `ttl` seconds, returning `False` if another holder has it."""
+    script = acquire_lease_script()
+    acquired = await script(keys=[f"lease:{name}"], args=[holder, int(ttl * 1000)])
+    return bool(acquired)
+
+
+async def release_lease(name: str, holder: str) -> None:
+    script = release_lease_script()
+    await script(keys=[f"lease:{name}"], args=[holder])
+
+
+@lru_cache(maxsize=None)
+def acquire_lease_script() -> AsyncScript:
+    return get_redis().register_script(ACQUIRE_LEASE_SCRIPT)
+
+
+@lru_cache(maxsize=None)
+def release_lease_script() -> AsyncScript:
+    return get_redis().register_script(RELEASE_LEASE_SCRIPT)
+
+
+async def search_checkpoint() -> SearchCheckpoint:
+    """The newest tweet id returned by search (so the next poll only requests newer tweets) and any unread pages."""
+    redis_ = get_redis()
+    async with redis_.pipeline(transaction=False) as pipeline:
+        pipeline.get("search:since_id")
+        pipeline.hgetall("search:resume")
+        since_id, resume = await pipeline.execute()
+
+    return SearchCheckpoint(
+        since_id=int(since_id) if since_id else None,
+        newest_id=int(resume["newest_id"]) if resume.get("newest_id") else None,
+        next_token=resume.get("next_token") or None,
+    )
+
+
+async def update_search_checkpoint(checkpoint: SearchCheckpoint) -> None:
+    redis_ = get_redis()
+    async with redis_.pipeline(transaction=True) as pipeline:
+        if checkpoint.since_id is None:
+            pipeline.delete("search:since_id")
+        else:
+            pipeline.set("search:since_id", checkpoint.since_id)
+
+        pipeline.delete("search:resume")
+        if checkpoint.next_token is not None:
+            pipeline.hset(
+                "search:resume",
+                mapping={"newest_id": str(checkpoint.newest_id or ""), "next_token": checkpoint.next_token},
+            )
+
+        await pipeline.execute()
+
+
+async def cached_screenshot(inspect_link: str) -> str | None:
+    """Returns the cached image link, an empty string for a cached failure, or `None` if nothing is cached."""
+    redis_ = get_redis()
+    return await redis_.get(f"screenshot:{inspect_link}")
+
+
+async def cache_screenshot(inspect_link: str, image_link: str | None, *, ex: int) -> None:
+    redis_ = get_redis()
+    await redis_.set(name=f"screenshot:{inspect_link}", value=image_link or "", ex=ex)
+
+
+def media_key(image_links: t.Sequence[str]) -> str:
+    # a grid is cached under all of its screenshots (a single screenshot keeps its original key)
+    return f"media:{' '.join(image_links)}"
+
+
+async def cached_media_id(image_links: t.Sequence[str]) -> int | None:
+    redis_ = get_redis()
+    media_id = await redis_.get(media_key(image_links))
+    return int(media_id) if media_id else None
+
+
+async def cache_media_id(image_links: t.Sequence[str], media_id: int) -> None:
+    redis_ = get_redis()
+    await redis_.set(name=media_key(image_links), value=media_id, ex=TWITTER_MEDIA_ID_EX)
+
+
+async def forget_media_ids(image_link_groups: t.Iterable[t.Sequence[str]]) -> None:
+    redis_ = get_redis()
+    keys = [media_key(image_links) for image_links in image_link_groups]
+    if keys:
+        await redis_.delete(*keys)
@@ -0,0 +1,250 @@
+"""A bounded work queue drained by a fixed pool of workers, and the claims that keep tweets from being handled twice"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import random
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from csinspect import metrics, redis_
+from csinspect.config import (
+    CSINSPECT_INSTANCE,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    TWEET_CLAIM_TTL,
+    WORK_QUEUE_FULL_POLICY,
+    WORK_QUEUE_MAX_SIZE,
+    WORK_QUEUE_WORKERS,
+)
+
+if t.TYPE_CHECKING:
+    from csinspect.tweet import TweetWithInspectLink
+
+
+def backoff_delay(attempts: int, *, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with jitter, so tweets that failed together don't all retry together."""
+    delay = min(cap, base * 2.0**attempts)
+    return delay / 2 + random.uniform(0, delay / 2)  # noqa: S311
+
+
+@dataclass(slots=True)
+class Job:
+    """A tweet waiting to be processed."""
+
+    tweet: TweetWithInspectLink
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # set for jobs claimed from the redis stream, which are acknowledged once handled
+    stream_id: str | None = None
+    # set for jobs also kept in the checkpoint hash until they're handled, so a crash doesn't lose them
+    checkpointed: bool = False
+
+
+@dataclass(slots=True)
+class QueueStats:
+    submitted: int = 0
+    processed: int = 0
+    failed: int = 0
+    dropped: int = 0
+    busy_workers: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def average_wait(self: QueueStats) -> float:
+        started = self.processed + self.failed + self.busy_workers
+        return self.total_wait / started if started else 0.0
+
+
+class WorkQueue:
+    """
+    Jobs are handled by `workers` long-lived tasks, so concurrency is bounded no matter how fast tweets arrive.
+    When `maxsize` jobs are waiting, `policy` decides what happens to new ones:
+        "block"        producers wait for room (backpressure on the stream and search loop)
+        "drop_newest"  the new job is dropped
+        "drop_oldest"  the longest-waiting job is dropped to make room
+    Dropped jobs are handed to `on_drop`, so they can be kept somewhere durable rather than lost.
+    """
+
+    def __init__(
+        self: WorkQueue,
+        handler: t.Callable[[Job], t.Awaitable[None]],
+        *,
+        workers: int = WORK_QUEUE_WORKERS,
+        maxsize: int = WORK_QUEUE_MAX_SIZE,
+        policy: str = WORK_QUEUE_FULL_POLICY,
+        on_drop: t.Callable[[Job], t.Awaitable[None]] | None = None,
+    ) -> None:
+        self.handler = handler
+        self.on_drop = on_drop
+        self.worker_count = workers
+        self.policy = policy
+        self.queue: asyncio.Queue[Job] = asyncio.Queue(maxsize=maxsize)
+        self.workers: list[asyncio.Task[None]] = []
+        # jobs being handled right now, by worker
+        self.in_flight: dict[str, Job] = {}
+        self.stats = QueueStats()
+        self._worker_freed = asyncio.Condition()
+
+    @property
+    def depth(self: WorkQueue) -> int:
+        return self.queue.qsize()
+
+    @property
+    def idle(self: WorkQueue) -> bool:
+        return self.queue.empty() and self.stats.busy_workers < self.worker_count
+
+    @property
+    def idle_workers(self: WorkQueue) -> int:
+        return self.worker_count - self.stats.busy_workers if self.queue.empty() else 0
+
+    async def wait_for_idle_workers(self: WorkQueue) -> int:
+        """Waits until at least one worker has nothing to do, returning how many are idle."""
+        async with self._worker_freed:
+            await self._worker_freed.wait_for(lambda: self.idle_workers > 0)
+        return self.idle_workers
+
+    def start(self: WorkQueue) -> None:
+        if self.workers:
+            return
+
+        logger.debug(f"STARTING: {self.worker_count} WORKERS")
+        for index in range(self.worker_count):
+            name = f"csinspect-worker-{index}"
+            task = asyncio.create_task(self.work(name), name=name)
+            self.workers.append(task)
+
+    async def submit(self: WorkQueue, job: Job) -> bool:
+        """Queues a job, returning `False` if it (or an older job) had to be dropped."""
+        self.stats.submitted += 1
+
+        if not self.queue.full() or self.policy == "block":
+            await self.queue.put(job)
+            return True
+
+        self.stats.dropped += 1
+
+        if self.policy == "drop_oldest":
+            dropped = self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait(job)
+        else:
+            dropped = job
+
+        logger.warning(f"DROPPING TWEET (Work Queue Full, {self.depth} Waiting): {dropped.tweet.url}")
+        if self.on_drop is not None:
+            await self.on_drop(dropped)
+        return False
+
+    async def work(self: WorkQueue, name: str) -> None:
+        while True:
+            job = await self.queue.get()
+            self.in_flight[name] = job
+
+            wait = time.monotonic() - job.enqueued_at
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+            metrics.STAGE_SECONDS.observe(wait, stage="queue_wait")
+            self.stats.busy_workers += 1
+
+            try:
+                await self.handler(job)
+            except Exception:
+                self.stats.failed += 1
+                logger.exception(f"Error Processing Tweet: {job.tweet.url}")
+            else:
+                self.stats.processed += 1
+            finally:
+                self.in_flight.pop(name, None)
+                self.stats.busy_workers -= 1
+                self.queue.task_done()
+
+            async with self._worker_freed:
+                self._worker_freed.notify_all()
+
+    async def join(self: WorkQueue) -> None:
+        await self.queue.join()
+
+    async def drain(self: WorkQueue, timeout: float) -> list[Job]:
+        """
+        Gives the running jobs up to `timeout` seconds to finish, then stops the workers.
+        Returns the jobs that weren't handled: those still waiting, and those that were cut off.
+        """
+        waiting = []
+        while not self.queue.empty():
+            waiting.append(self.queue.get_nowait())
+            self.queue.task_done()
+
+        if self.in_flight:
+            logger.info(f"DRAINING {len(self.in_flight)} RUNNING JOBS (Up To {timeout:.0f}s)")
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(timeout), self._worker_freed:
+                    await self._worker_freed.wait_for(lambda: not self.in_flight)
+
+        cut_off = list(self.in_flight.values())
+        await self.stop()
+        return waiting + cut_off
+
+    async def stop(self: WorkQueue) -> None:
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+
+@dataclass(slots=True)
+class ClaimStats:
+    claimed: int = 0
+    duplicates: int = 0
+
+
+class TweetClaims:
+    """
+    Tweets are usually delivered by the live stream and then found again by search.
+    Claiming a tweet before processing it makes sure only one of those copies is handled:
+    the claim is checked in-process first, then taken as a short-lived redis lease that other replicas see too.
+    """
+
+    def __init__(self: TweetClaims, *, holder: str = CSINSPECT_INSTANCE, ttl: float = TWEET_CLAIM_TTL) -> None:
+        self.holder = holder
+        self.ttl = ttl
+        self.claimed: set[int] = set()
+        self.stats = ClaimStats()
+
+    async def claim(self: TweetClaims, tweet: TweetWithInspectLink) -> bool:
+        """Returns `False` if the tweet is already claimed, here or by another replica."""
+        if tweet.id in self.claimed:
+            return self.duplicate(tweet)
+
+        # taken before awaiting redis, so a concurrent duplicate in this process can't pass too
+        self.claimed.add(tweet.id)
+        try:
+            acquired = await redis_.acquire_lease(f"tweet:{tweet.id}", self.holder, ttl=self.ttl)
+        except BaseException:
+            self.claimed.discard(tweet.id)
+            raise
+
+        if not acquired:
+            self.claimed.discard(tweet.id)
+            return self.duplicate(tweet)
+
+        self.stats.claimed += 1
+        return True
+
+    async def release(self: TweetClaims, tweet: TweetWithInspectLink) -> None:
+        self.claimed.discard(tweet.id)
+        try:
+            await redis_.release_lease(f"tweet:{tweet.id}", self.holder)
+        except RedisError:
+            # it expires on its own
+            logger.exception(f"Error Releasing Tweet Claim: {tweet.url}")
+
+    def duplicate(self: TweetClaims, tweet: TweetWithInspectLink) -> bool:
+        self.stats.duplicates += 1
+        logger.info(f"SKIPPING TWEET (Already Claimed, {self.stats.duplicates} Duplicates Suppressed): {tweet.url}")
+        return False
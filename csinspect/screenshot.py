@@ -1,87 +1,104 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import typing as t
-from sys import version_info
 
-import httpx
 from loguru import logger
 
+from csinspect import metrics
+from csinspect.cache import ScreenshotCache
+from csinspect.providers import ScreenshotEngine, ScreenshotUnavailableError, SkinportProvider
+
 if t.TYPE_CHECKING:
+    from csinspect.http_ import HTTPTransport
     from csinspect.item import Item
 
 
 class Screenshot:
-    USER_AGENT = f"csinspect/1.0.0 (https://github.com/hexiro/csinspect), Python/{version_info.major}.{version_info.minor}, httpx/{httpx.__version__}"
-    HEADERS: t.ClassVar = {
-        "Upgrade-Insecure-Requests": "1",
-        "User-Agent": USER_AGENT,
-    }
-
-    async def skinport_screenshot(self: Screenshot, item: Item) -> bool:
+    def __init__(
+        self: Screenshot,
+        http: HTTPTransport,
+        cache: ScreenshotCache | None = None,
+        engine: ScreenshotEngine | None = None,
+    ) -> None:
+        self.http = http
+        self.cache = cache or ScreenshotCache()
+        self.engine = engine or ScreenshotEngine([SkinportProvider(http)])
+        # renders currently running, keyed by inspect link, so concurrent requests for the same item share one call
+        self.in_flight: dict[str, asyncio.Task[str | None]] = {}
+        self.coalesced = 0
+
+    async def render(self: Screenshot, item: Item) -> str | None:
+        # only answers are cached: `ScreenshotUnavailableError` (no provider answered) skips the cache
+        image_link = await self.engine.screenshot(item)
+
+        await self.cache.set(item.inspect_link, image_link)
+        return image_link
+
+    async def shared_render(self: Screenshot, item: Item) -> str | None:
         """
-        Unlike swap.gg, Skinport does not use a WebSocket connection to get the screenshot.
+        Joins the render already running for this inspect link, or starts one.
+        The render runs in its own task so a cancelled caller doesn't cancel it for everyone else.
         """
-        try:
-            async with httpx.AsyncClient(timeout=300, follow_redirects=False) as session:
-                params = {"link": item.unquoted_inspect_link}
-                response = await session.get("https://screenshot.skinport.com/direct", params=params)
-
-                # redirects and format inspect link
-                if response.status_code == 308 and response.next_request:
-                    logger.debug(f"SKINPORT SCREENSHOT REDIRECT: {response.next_request.url}")
-                    response = await session.send(response.next_request)
-
-            # redirects to the image link
-            # (no need to follow request at this point in time)
-            if response.next_request:
-                item.image_link = str(response.next_request.url)
-                return True
-            else:
-                logger.debug(f"SKINPORT SCREENSHOT FAILED: {response.status_code=}, {response.next_request=}")
-                return False
-        except httpx.HTTPError:
-            logger.exception(f"SKINPORT SCREENSHOT FAILED (HTTP ERROR: {item.inspect_link})")
-            return False
-        except json.JSONDecodeError:
-            logger.exception(f"SKINPORT SCREENSHOT FAILED (JSON DECODE ERROR: {item.inspect_link})")
-            return False
-        except Exception:
-            logger.exception(f"SKINPORT SCREENSHOT ERROR (UNKNOWN ERROR): {item.inspect_link}")
-            return False
+        task = self.in_flight.get(item.inspect_link)
+
+        if task is not None:
+            self.coalesced += 1
+            logger.debug(f"SCREENSHOT COALESCED: {item.inspect_link}")
+        else:
+            task = asyncio.create_task(self.render(item))
+            self.in_flight[item.inspect_link] = task
+
+            def on_done(done_task: asyncio.Task[str | None]) -> None:
+                self.in_flight.pop(item.inspect_link, None)
+                # mark the exception as retrieved in case every caller was cancelled
+                if not done_task.cancelled():
+                    done_task.exception()
 
+            task.add_done_callback(on_done)
+
+        return await asyncio.shield(task)
+
+    @metrics.timed("screenshot")
     async def screenshot_item(self: Screenshot, item: Item) -> bool:
+        """Raises `ScreenshotUnavailableError` if no provider answered, so the tweet is deferred rather than failed."""
+        cached = await self.cache.get(item.inspect_link)
+        if cached is not None:
+            logger.debug(f"SCREENSHOT CACHED: {item.inspect_link} {cached.image_link=}")
+            item.image_link = cached.image_link
+            return cached.image_link is not None
+
         logger.debug(f"SCREENSHOTTING: {item.inspect_link}")
 
-        success = await self.skinport_screenshot(item)
+        try:
+            item.image_link = await self.shared_render(item)
+        except ScreenshotUnavailableError as exc:
+            # not cached, the item is fine and should be retried once the providers recover
+            logger.warning(f"SCREENSHOT DEFERRED ({exc}): {item.inspect_link}")
+            item.image_link = None
+            raise
+        except Exception:
+            logger.exception(f"SCREENSHOT ERROR: {item.inspect_link}")
+            item.image_link = None
 
-        if not success or not item.image_link:
+        if not item.image_link:
             logger.warning(f"SCREENSHOT FAILED: {item.inspect_link}")
             return False
 
-        logger.debug(f"SCREENSHOT COMPLETE: {item.image_link} {success=}")
+        logger.debug(f"SCREENSHOT COMPLETE: {item.image_link}")
         return True
 
-    async def screenshot_items(self: Screenshot, items: t.Iterable[Item]) -> list[bool]:
-        screenshot_tasks: list[asyncio.Task[bool]] = []
-
-        for item in items:
-            screenshot_coro = self.screenshot_item(item)
-            screenshot_task = asyncio.create_task(screenshot_coro)
-            screenshot_tasks.append(screenshot_task)
-
-        screenshot_responses: list[bool] = await asyncio.gather(*screenshot_tasks)
-        return screenshot_responses
-
 
 if __name__ == "__main__":  # pragma: no cover
+    from csinspect.http_ import HTTPTransport
     from csinspect.item import Item
 
     async def main() -> None:
-        screenshot = Screenshot()
+        http = HTTPTransport()
+        screenshot = Screenshot(http)
         item = Item(input("Inspect Link: "))
         await screenshot.screenshot_item(item)
         logger.success("IMAGE LINK: ", item.image_link)
+        await http.aclose()
 
     asyncio.run(main())
@@ -0,0 +1,44 @@
+"""Tweepy's rate limited async client, kept out of `twitter.py` since tweepy.asynchronous loads aiohttp on import"""
+
+from __future__ import annotations
+
+import typing as t
+
+import tweepy.asynchronous
+import tweepy.errors
+
+if t.TYPE_CHECKING:
+    import aiohttp
+
+    from csinspect.twitter import RateLimitScheduler
+
+
+class RateLimitedClient(tweepy.asynchronous.AsyncClient):
+    """`AsyncClient` whose every request goes through a `RateLimitScheduler`."""
+
+    def __init__(self: RateLimitedClient, *args: t.Any, scheduler: RateLimitScheduler, **kwargs: t.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+
+    async def request(
+        self: RateLimitedClient,
+        method: str,
+        route: str,
+        params: dict[str, t.Any] | None = None,
+        json: dict[str, t.Any] | None = None,
+        user_auth: bool = False,
+    ) -> aiohttp.ClientResponse:
+        endpoint = f"{method} {route}"
+        await self.scheduler.acquire(endpoint)
+
+        try:
+            response = await super().request(method, route, params=params, json=json, user_auth=user_auth)
+        except tweepy.errors.HTTPException as exc:
+            self.scheduler.update(endpoint, exc.response.headers)
+            raise
+        except BaseException:
+            self.scheduler.update(endpoint, None)
+            raise
+
+        self.scheduler.update(endpoint, response.headers)
+        return response  # type: ignore[no-any-return]
@@ -3,10 +3,12 @@ from __future__ import annotations
 import typing as t
 from dataclasses import dataclass
 
+from csinspect.item import Item
+
 if t.TYPE_CHECKING:
     import tweepy
 
-    from csinspect.item import Item
+    from csinspect.typings import TweetWithInspectLinkData
 
 
 @dataclass(slots=True)
@@ -27,3 +29,26 @@ class TweetWithInspectLink:
     @property
     def url(self: TweetWithInspectLink) -> str:
         return f"https://twitter.com/i/web/status/{self.id}"
+
+    def to_dict(self: TweetWithInspectLink) -> TweetWithInspectLinkData:
+        """A JSON serializable form, for jobs that have to outlive the process."""
+        return {
+            "tweet": self.tweet.data,
+            "items": [
+                {"inspect_link": item.inspect_link, "image_link": item.image_link, "media_id": item.media_id}
+                for item in self.items
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls: type[TweetWithInspectLink], data: TweetWithInspectLinkData) -> TweetWithInspectLink:
+        import tweepy
+
+        items = []
+        for item_data in data["items"]:
+            item = Item(inspect_link=item_data["inspect_link"])
+            item.image_link = item_data.get("image_link")
+            item.media_id = item_data.get("media_id")
+            items.append(item)
+
+        return cls(items=tuple(items), tweet=tweepy.Tweet(data["tweet"]))
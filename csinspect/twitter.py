@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 import asyncio
-import io
+import functools
+import time
 import typing as t
+from dataclasses import dataclass
 
 import httpx
-import tweepy
-import tweepy.asynchronous
-import tweepy.errors
 from loguru import logger
+from oauthlib.oauth1 import Client as OAuthClient
+from redis.exceptions import RedisError
 
+from csinspect import metrics, redis_
 from csinspect.config import (
     ENABLE_TWITTER_LIVE,
     TWITTER_ACCESS_TOKEN,
@@ -17,101 +19,366 @@ from csinspect.config import (
     TWITTER_API_KEY,
     TWITTER_API_KEY_SECRET,
     TWITTER_BEARER_TOKEN,
+    TWITTER_MEDIA_CHUNK_SIZE,
+    TWITTER_MEDIA_UPLOAD_URL,
+    TWITTER_RATE_LIMIT_MAX_WAIT,
 )
+from csinspect.typings import MediaUpload
 
 if t.TYPE_CHECKING:
-    from tweepy.models import Media
+    import tweepy
+    from multidict import CIMultiDictProxy
+    from tweepy.asynchronous import AsyncStreamingClient
 
+    from csinspect.http_ import HTTPTransport
+    from csinspect.images import ImageProcessor
     from csinspect.item import Item
+    from csinspect.tweepy_ import RateLimitedClient
     from csinspect.tweet import TweetWithInspectLink
 
 
+class RateLimitedError(Exception):
+    """Raised instead of making a call that Twitter would reject with a 429."""
+
+    def __init__(self: RateLimitedError, endpoint: str, retry_after: float) -> None:
+        super().__init__(f"{endpoint} is rate limited (resets in {retry_after:.0f}s)")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+@dataclass(slots=True)
+class RateLimitBucket:
+    """What Twitter last told us about one endpoint's window (`x-rate-limit-*` headers)."""
+
+    limit: int | None = None
+    remaining: int | None = None
+    reset: float = 0.0
+    # calls admitted that haven't reported back yet (each `acquire` is matched by one `update`)
+    reserved: int = 0
+
+    @property
+    def available(self: RateLimitBucket) -> int | None:
+        if self.remaining is None:
+            return None
+        return self.remaining - self.reserved
+
+
+class RateLimitScheduler:
+    """
+    Token bucket per endpoint, refilled from Twitter's rate limit headers.
+    Calls are held until their window resets (if that's soon) or rejected locally, so none are wasted on a 429.
+    """
+
+    def __init__(self: RateLimitScheduler, *, max_wait: float = TWITTER_RATE_LIMIT_MAX_WAIT) -> None:
+        self.max_wait = max_wait
+        self.buckets: dict[str, RateLimitBucket] = {}
+        self.held = 0
+        self.deferred = 0
+
+    async def acquire(self: RateLimitScheduler, endpoint: str) -> None:
+        bucket = self.buckets.setdefault(endpoint, RateLimitBucket())
+
+        while True:
+            now = time.time()
+            if bucket.reset <= now:
+                # new window, nothing known about it until the next response
+                bucket.remaining = None
+
+            available = bucket.available
+            if available is None or available > 0:
+                bucket.reserved += 1
+                return
+
+            wait = bucket.reset - now
+            if wait > self.max_wait:
+                self.deferred += 1
+                raise RateLimitedError(endpoint, wait)
+
+            self.held += 1
+            logger.info(f"HOLDING CALL (Rate Limited, Resets In {wait:.0f}s): {endpoint}")
+            await asyncio.sleep(wait + 1)
+
+    def update(self: RateLimitScheduler, endpoint: str, headers: httpx.Headers | CIMultiDictProxy[str] | None) -> None:
+        """
+        Reports back one call admitted by `acquire`. The other calls still in flight stay reserved:
+        some may not have reached Twitter when these headers were sent, so they're counted against `remaining`
+        (possibly twice, which only errs on the side of holding a call).
+        """
+        bucket = self.buckets.setdefault(endpoint, RateLimitBucket())
+        bucket.reserved -= 1
+
+        if not headers or "x-rate-limit-remaining" not in headers:
+            return
+
+        bucket.limit = int(headers["x-rate-limit-limit"])
+        bucket.remaining = int(headers["x-rate-limit-remaining"])
+        bucket.reset = float(headers["x-rate-limit-reset"])
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Whether a failed call was (or would have been) rejected for rate limiting, rather than failing on its own."""
+    import tweepy.errors
+
+    if isinstance(exc, RateLimitedError | tweepy.errors.TooManyRequests):
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == httpx.codes.TOO_MANY_REQUESTS
+
+
+def required_credential(name: str, value: str | None) -> str:
+    if not value:
+        msg = f"{name} is required"
+        raise RuntimeError(msg)
+    return value
+
+
+@dataclass(slots=True)
+class MediaCacheStats:
+    hits: int = 0
+    misses: int = 0
+    # cached ids Twitter refused, which were uploaded again
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self: MediaCacheStats) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
 class Twitter:
-    """Merged wrapper of Twitter's v1, v2, and Steaming API provided by Tweepy."""
-
-    def __init__(self: Twitter, on_tweet: t.Callable[[tweepy.Tweet], t.Coroutine[t.Any, t.Any, None]]) -> None:
-        self.v2 = tweepy.asynchronous.AsyncClient(
-            bearer_token=TWITTER_BEARER_TOKEN,
-            consumer_key=TWITTER_API_KEY,
-            consumer_secret=TWITTER_API_KEY_SECRET,
-            access_token=TWITTER_ACCESS_TOKEN,
-            access_token_secret=TWITTER_ACCESS_TOKEN_SECRET,
+    """Merged wrapper of Twitter's v2 and Steaming API provided by Tweepy, and the v1 media upload API."""
+
+    def __init__(
+        self: Twitter,
+        on_tweet: t.Callable[[tweepy.Tweet], t.Coroutine[t.Any, t.Any, None]],
+        http: HTTPTransport,
+        images: ImageProcessor | None = None,
+    ) -> None:
+        self.http = http
+        self.images = images
+        self.media_cache_stats = MediaCacheStats()
+        self.rate_limits = RateLimitScheduler()
+        self.on_tweet = on_tweet
+
+    # the clients are built on first use: roles and feature flags that never use one don't import or configure it
+
+    @functools.cached_property
+    def v2(self: Twitter) -> RateLimitedClient:
+        from csinspect.tweepy_ import RateLimitedClient
+
+        return RateLimitedClient(
+            scheduler=self.rate_limits,
+            bearer_token=required_credential("TWITTER_BEARER_TOKEN", TWITTER_BEARER_TOKEN),
+            consumer_key=required_credential("TWITTER_API_KEY", TWITTER_API_KEY),
+            consumer_secret=required_credential("TWITTER_API_KEY_SECRET", TWITTER_API_KEY_SECRET),
+            access_token=required_credential("TWITTER_ACCESS_TOKEN", TWITTER_ACCESS_TOKEN),
+            access_token_secret=required_credential("TWITTER_ACCESS_TOKEN_SECRET", TWITTER_ACCESS_TOKEN_SECRET),
         )
-        self.v1 = tweepy.API(
-            tweepy.OAuthHandler(
-                consumer_key=TWITTER_API_KEY,
-                consumer_secret=TWITTER_API_KEY_SECRET,
-                access_token=TWITTER_ACCESS_TOKEN,
-                access_token_secret=TWITTER_ACCESS_TOKEN_SECRET,
-            )
+
+    @functools.cached_property
+    def oauth(self: Twitter) -> OAuthClient:
+        # tweepy has no async v1 client, so media uploads are signed here and sent over the shared transport
+        return OAuthClient(
+            required_credential("TWITTER_API_KEY", TWITTER_API_KEY),
+            client_secret=required_credential("TWITTER_API_KEY_SECRET", TWITTER_API_KEY_SECRET),
+            resource_owner_key=required_credential("TWITTER_ACCESS_TOKEN", TWITTER_ACCESS_TOKEN),
+            resource_owner_secret=required_credential("TWITTER_ACCESS_TOKEN_SECRET", TWITTER_ACCESS_TOKEN_SECRET),
         )
 
-        self.live: tweepy.asynchronous.AsyncStreamingClient | None = None
-        if ENABLE_TWITTER_LIVE:
-            self.live = tweepy.asynchronous.AsyncStreamingClient(TWITTER_BEARER_TOKEN)
+    @functools.cached_property
+    def live(self: Twitter) -> AsyncStreamingClient | None:
+        if not ENABLE_TWITTER_LIVE:
+            return None
+
+        from tweepy.asynchronous import AsyncStreamingClient
+
+        live = AsyncStreamingClient(required_credential("TWITTER_BEARER_TOKEN", TWITTER_BEARER_TOKEN))
+
+        async def on_connect() -> None:
+            logger.debug("CONNECTED: Twitter Streaming API")
+
+        async def on_disconnect() -> None:
+            logger.debug("DISCONNECTED: Twitter Streaming API")
+
+        live.on_connect = on_connect
+        live.on_disconnect = on_disconnect
+        live.on_tweet = self.on_tweet  # type: ignore
+        return live
+
+    def disconnect_live(self: Twitter) -> None:
+        # looked up without building the client, there's nothing to disconnect if it was never used
+        live = self.__dict__.get("live")
+        if live is not None:
+            live.disconnect()
+
+    @metrics.timed("create_tweet")
+    async def reply(self: Twitter, tweet: TweetWithInspectLink, uploads: t.Sequence[MediaUpload]) -> None:
+        import tweepy.errors
 
-            async def on_connect() -> None:
-                logger.debug("CONNECTED: Twitter Streaming API")
+        try:
+            await self.v2.create_tweet(in_reply_to_tweet_id=tweet.id, media_ids=[upload.media_id for upload in uploads])
+        except tweepy.errors.BadRequest:
+            stale_uploads = [upload.image_links for upload in uploads if upload.cached]
+            if not stale_uploads:
+                raise
 
-            async def on_disconnect() -> None:
-                logger.debug("CONNECTED: Twitter Streaming API")
+            # a cached media id expired or was rejected, upload those screenshots again and retry once
+            logger.info(f"RETRYING REPLY (Cached Media Rejected): {tweet.url}")
+            self.media_cache_stats.invalidations += len(stale_uploads)
+            await redis_.forget_media_ids(stale_uploads)
 
-            self.live.on_connect = on_connect
-            self.live.on_disconnect = on_disconnect
-            self.live.on_tweet = on_tweet  # type: ignore
+            async def refresh(upload: MediaUpload) -> MediaUpload:
+                if not upload.cached:
+                    return upload
+                return await self.upload_images(upload.image_links, use_cache=False)
 
-    async def reply(self: Twitter, tweet: TweetWithInspectLink) -> None:
-        media_uploads = await self.upload_items(tweet.items)
-        media_ids: list[int] = [media.media_id for media in media_uploads]  # type: ignore
+            fresh_uploads = await asyncio.gather(*(refresh(upload) for upload in uploads))
+            await self.v2.create_tweet(
+                in_reply_to_tweet_id=tweet.id, media_ids=[upload.media_id for upload in fresh_uploads]
+            )
+
+    async def upload_items(self: Twitter, items: t.Sequence[Item]) -> MediaUpload:
+        """Uploads the items' screenshots as one media (a grid if there's more than one)."""
+        image_links = tuple(item.image_link for item in items if item.image_link)
+        if not image_links:
+            msg = f"Items have no screenshots: {', '.join(item.inspect_link for item in items)}"
+            raise ValueError(msg)
+
+        return await self.upload_images(image_links)
+
+    async def upload_images(self: Twitter, image_links: t.Sequence[str], *, use_cache: bool = True) -> MediaUpload:
+        """Reuses a still-valid media id for these screenshots, or uploads them (processed unless IMAGE_PROCESSING is off)."""
+        image_links = tuple(image_links)
 
-        await self.v2.create_tweet(in_reply_to_tweet_id=tweet.id, media_ids=media_ids)
+        if use_cache:
+            try:
+                media_id = await redis_.cached_media_id(image_links)
+            except RedisError:
+                logger.exception(f"MEDIA ID CACHE LOOKUP FAILED: {image_links}")
+                media_id = None
 
-    async def upload_items(self: Twitter, items: t.Iterable[Item]) -> list[Media]:
-        async def fetch_screenshot(session: httpx.AsyncClient, image_link: str) -> tuple[str, io.BytesIO]:
-            screenshot = await session.get(image_link)
-            return (image_link, io.BytesIO(screenshot.content))
+            if media_id is not None:
+                self.media_cache_stats.hits += 1
+                return MediaUpload(image_links=image_links, media_id=media_id, cached=True)
 
-        async with httpx.AsyncClient() as session:
-            screenshot_tasks: list[asyncio.Task[tuple[str, io.BytesIO]]] = []
+            self.media_cache_stats.misses += 1
 
-            for item in items:
-                if not item.image_link:
-                    continue
+        if self.images is not None:
+            media_id = await self.processed_upload(image_links)
+        elif len(image_links) == 1:
+            media_id = await self.direct_upload(image_links[0])
+        else:
+            msg = "Composing a grid of screenshots requires IMAGE_PROCESSING"
+            raise RuntimeError(msg)
 
-                screenshot_coro = fetch_screenshot(session, item.image_link)
-                screenshot_task = asyncio.create_task(screenshot_coro)  # type: ignore
+        try:
+            await redis_.cache_media_id(image_links, media_id)
+        except RedisError:
+            logger.exception(f"MEDIA ID CACHE STORE FAILED: {image_links}")
 
-                screenshot_tasks.append(screenshot_task)
+        return MediaUpload(image_links=image_links, media_id=media_id)
 
-            screenshots: list[tuple[str, io.BytesIO]] = await asyncio.gather(*screenshot_tasks)
+    async def processed_upload(self: Twitter, image_links: t.Sequence[str]) -> int:
+        """Downloads the screenshots, re-encodes them (into a grid if there are several) and uploads the result."""
+        if self.images is None:
+            msg = "Image processing is disabled"
+            raise RuntimeError(msg)
 
-        media_tasks: list[asyncio.Task[Media]] = []
-        for image_link, screenshot in screenshots:
-            media_coro = self.media_upload(filename=image_link, file=screenshot)
-            media_task = asyncio.create_task(media_coro)
-            media_tasks.append(media_task)
+        responses = await asyncio.gather(*(self.download(image_link) for image_link in image_links))
+        processed = await self.images.process([response.content for response in responses])
+        return await self.content_upload(processed.content, media_type=processed.media_type)
 
-        media_uploads: list[Media] = await asyncio.gather(*media_tasks)
-        return media_uploads
+    async def direct_upload(self: Twitter, image_link: str) -> int:
+        """
+        Uploads the screenshot as it was downloaded, buffered: a screenshot is at most a few MiB,
+        and one larger than TWITTER_MEDIA_CHUNK_SIZE is still uploaded in chunks.
+        """
+        response = await self.download(image_link)
+        return await self.content_upload(response.content, media_type=response.headers.get("Content-Type", "image/png"))
+
+    @metrics.timed("download")
+    async def download(self: Twitter, image_link: str) -> httpx.Response:
+        response = await self.http.get(image_link)
+        response.raise_for_status()
+        return response
+
+    async def content_upload(self: Twitter, content: bytes, *, media_type: str) -> int:
+        if len(content) <= TWITTER_MEDIA_CHUNK_SIZE:
+            return await self.media_upload(content, media_type=media_type)
+
+        return await self.chunked_media_upload(
+            chunks=(content[i : i + TWITTER_MEDIA_CHUNK_SIZE] for i in range(0, len(content), TWITTER_MEDIA_CHUNK_SIZE)),
+            total_bytes=len(content),
+            media_type=media_type,
+        )
 
-    async def media_upload(
+    @metrics.timed("media_upload")
+    async def media_upload(self: Twitter, content: bytes, *, media_type: str) -> int:
+        response = await self.upload_request(files={"media": ("media", content, media_type)})
+        return int(response.json()["media_id"])
+
+    @metrics.timed("media_upload")
+    async def chunked_media_upload(
         self: Twitter,
-        filename: str | None,
+        chunks: t.Iterable[bytes],
         *,
-        file: io.BytesIO | None = None,
-        chunked: bool = False,
-        # https://developer.twitter.com/en/docs/twitter-api/v1/media/upload-media/api-reference/post-media-upload
-        media_category: t.Literal["amplify_video", "tweet_gif", "tweet_image", "tweet_video"] | None = None,
-        additional_owners: str | None = None,
-        **kwargs: t.Any,
-    ) -> Media:
-        # Uses Twitter v1 API (no async support with tweepy) so we need to run in executor
-        return await asyncio.to_thread(
-            self.v1.media_upload,  # type: ignore
-            filename=filename,
-            file=file,
-            chunked=chunked,
-            media_category=media_category,
-            additional_owners=additional_owners,
-            **kwargs,
-        )  # type: ignore
+        total_bytes: int,
+        media_type: str,
+        media_category: t.Literal["tweet_image", "tweet_gif", "tweet_video"] = "tweet_image",
+    ) -> int:
+        response = await self.upload_request(
+            params={
+                "command": "INIT",
+                "total_bytes": total_bytes,
+                "media_type": media_type,
+                "media_category": media_category,
+            }
+        )
+        media_id = response.json()["media_id_string"]
+
+        for segment_index, chunk in enumerate(chunks):
+            await self.upload_request(
+                params={"command": "APPEND", "media_id": media_id, "segment_index": segment_index},
+                files={"media": ("media", chunk, "application/octet-stream")},
+            )
+
+        response = await self.upload_request(params={"command": "FINALIZE", "media_id": media_id})
+        processing_info: dict[str, t.Any] | None = response.json().get("processing_info")
+
+        while processing_info and processing_info.get("state") in ("pending", "in_progress"):
+            await asyncio.sleep(processing_info.get("check_after_secs", 1))
+            response = await self.upload_request("GET", params={"command": "STATUS", "media_id": media_id})
+            processing_info = response.json().get("processing_info")
+
+        if processing_info and processing_info.get("state") == "failed":
+            msg = f"Media processing failed: {processing_info}"
+            raise RuntimeError(msg)
+
+        return int(media_id)
+
+    async def upload_request(
+        self: Twitter,
+        method: str = "POST",
+        *,
+        params: dict[str, t.Any] | None = None,
+        files: dict[str, t.Any] | None = None,
+    ) -> httpx.Response:
+        # multipart bodies aren't part of the OAuth 1.0a signature, only the url (and its query) is
+        request = self.http.build_request(method, TWITTER_MEDIA_UPLOAD_URL, params=params, files=files)
+
+        _, headers, _ = self.oauth.sign(str(request.url), http_method=method)
+        request.headers["Authorization"] = headers["Authorization"]
+
+        endpoint = f"{method} {request.url.path}"
+        # nothing may raise between acquiring and sending, or the call would stay reserved
+        await self.rate_limits.acquire(endpoint)
+
+        try:
+            response = await self.http.send(request)
+        except BaseException:
+            self.rate_limits.update(endpoint, None)
+            raise
+
+        self.rate_limits.update(endpoint, response.headers)
+        response.raise_for_status()
+        return response
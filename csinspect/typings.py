@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from typing import NamedTuple, TypedDict
+from typing import TYPE_CHECKING, Any, NamedTuple, TypedDict
+
+if TYPE_CHECKING:
+    from csinspect.tweet import TweetWithInspectLink
 
 
 class _BaseTweetResponseRawData(TypedDict):
@@ -15,3 +18,57 @@ class TweetResponseRawData(_BaseTweetResponseRawData, total=False):
 class TweetResponseState(NamedTuple):
     successful: bool
     failed_attempts: int = 0
+
+
+class CachedScreenshot(NamedTuple):
+    # `None` is a cached failure
+    image_link: str | None
+
+
+class MediaUpload(NamedTuple):
+    # more than one for a grid of screenshots
+    image_links: tuple[str, ...]
+    media_id: int
+    # reused from the media id cache rather than uploaded for this reply
+    cached: bool = False
+
+
+class ItemKey(NamedTuple):
+    """The numbers identifying an item, whichever prefix its inspect link was posted with."""
+
+    # digits as posted (leading zeros included), so the link requested is the one that was tweeted
+    # the inventory owner's steam id (S), or the market listing id (M)
+    owner_id: str
+    asset_id: str
+    d: str
+    market: bool = False
+
+
+class _BaseItemData(TypedDict):
+    inspect_link: str
+
+
+class ItemData(_BaseItemData, total=False):
+    image_link: str | None
+    media_id: int | None
+
+
+class TweetWithInspectLinkData(TypedDict):
+    # the raw v2 tweet object, as returned by Twitter
+    tweet: dict[str, Any]
+    items: list[ItemData]
+
+
+class SearchCheckpoint(NamedTuple):
+    """Where the next search starts: after `since_id`, or partway through a search that ran out of pages."""
+
+    since_id: int | None = None
+    # set while pages of a search are still unread, `newest_id` becomes `since_id` once they're read
+    newest_id: int | None = None
+    next_token: str | None = None
+
+
+class StreamedTweet(NamedTuple):
+    stream_id: str
+    # `None` if the entry was trimmed from the stream before it was processed
+    tweet: TweetWithInspectLink | None
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-import asyncio
+from csinspect.__main__ import run
 
-from csinspect.__main__ import main
-
-asyncio.run(main())
+# the image processing pool's server process imports this module too
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import typing as t
+
+from csinspect.providers import ProviderOverloadedError, ScreenshotProvider
+
+if t.TYPE_CHECKING:
+    from csinspect.item import Item
+
+
+class FakeProvider(ScreenshotProvider):
+    """
+    A local stand-in for a screenshot service: answers after `latency` seconds,
+    failing as overloaded at `failure_rate` and answering it can't render the item when `renders` is off.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self: FakeProvider,
+        label: str,
+        *,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        renders: bool = True,
+        seed: int = 0,
+    ) -> None:
+        self.label = label
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.renders = renders
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def screenshot(self: FakeProvider, item: Item) -> str | None:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+        if self.random.random() < self.failure_rate:
+            raise ProviderOverloadedError(self.label, 503)
+        if not self.renders:
+            return None
+        return f"https://{self.label}.test/{item.inspect_link}"
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from csinspect import extract
+from csinspect.typings import ItemKey
+
+LINK = "steam://rungame/730/76561202255233023/+csgo_econ_action_preview%20S76561198000000000A0012D0034"
+
+
+def test_inspect_link_keeps_leading_zeros() -> None:
+    (key,) = extract.item_keys(f"check this {LINK}")
+    assert key == ItemKey("76561198000000000", "0012", "0034")
+    assert extract.inspect_link(key).endswith("S76561198000000000A0012D0034")
+
+
+def test_item_keys_dedupes_in_order() -> None:
+    market = LINK.replace("S76561198000000000", "M123")
+    keys = extract.item_keys(f"{market} {LINK} {market}")
+    assert keys == (ItemKey("123", "0012", "0034", market=True), ItemKey("76561198000000000", "0012", "0034"))
+
+
+def test_item_keys_without_marker() -> None:
+    assert extract.item_keys("no inspect links here") == ()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import typing as t
+
+import httpx
+
+from csinspect.http_ import HTTPTransport
+
+
+def transport_with(handler: t.Callable[[httpx.Request], t.Coroutine[None, None, httpx.Response]]) -> HTTPTransport:
+    transport = HTTPTransport(max_connections_per_host=1)
+    transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return transport
+
+
+def test_long_poll_does_not_hold_up_the_host() -> None:
+    render = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/direct":
+            await render.wait()
+        return httpx.Response(200)
+
+    async def run() -> None:
+        transport = transport_with(handler)
+        long_poll = asyncio.create_task(transport.get("https://screenshot.test/direct", long_poll=True))
+        await asyncio.sleep(0)
+
+        # the only connection allowed to the host is busy rendering, a download still goes through
+        response = await asyncio.wait_for(transport.get("https://screenshot.test/image.png"), timeout=1)
+        assert response.status_code == 200
+        assert transport.stats().in_flight == 1
+
+        render.set()
+        await long_poll
+        stats = transport.stats()
+        assert (stats.requests, stats.in_flight, stats.waiting) == (2, 0, 0)
+        await transport.aclose()
+
+    asyncio.run(run())
+
+
+def test_requests_to_a_host_wait_for_its_limit() -> None:
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow.test":
+            await release.wait()
+        return httpx.Response(200)
+
+    async def run() -> None:
+        transport = transport_with(handler)
+        first = asyncio.create_task(transport.get("https://slow.test/"))
+        second = asyncio.create_task(transport.get("https://slow.test/"))
+        await asyncio.sleep(0)
+
+        # another host isn't held up by the one at its limit
+        await asyncio.wait_for(transport.get("https://fast.test/"), timeout=1)
+        assert (transport.stats().in_flight, transport.stats().waiting) == (1, 1)
+
+        release.set()
+        await asyncio.gather(first, second)
+        await transport.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from csinspect import images
+
+SETTINGS = images.ImageSettings(image_format="JPEG", quality=90, min_quality=30, max_dimension=1000, max_bytes=1 << 20)
+
+
+def sample_image(width: int, height: int, *, noise: bool = False, image_format: str = "PNG") -> bytes:
+    """A solid image, or random noise (which compresses badly) with `noise`."""
+    image = Image.new("RGB", (width, height), "steelblue")
+    if noise:
+        generator = random.Random(width * height)
+        image.frombytes(generator.randbytes(width * height * 3))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def opened(content: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(content))
+
+
+@pytest.mark.parametrize(
+    ("count", "sizes"),
+    [(0, []), (1, [1]), (3, [1, 1, 1]), (5, [2, 1, 1, 1]), (8, [2, 2, 2, 2]), (9, [3, 2, 2, 2])],
+)
+def test_media_groups_split_into_at_most_four_even_groups(count: int, sizes: list[int]) -> None:
+    items = list(range(count))
+    groups = images.media_groups(items, 4)
+
+    assert [len(group) for group in groups] == sizes
+    # consecutive, in order, nothing lost
+    assert [item for group in groups for item in group] == items
+
+
+@pytest.mark.parametrize("count", range(1, 9))
+@pytest.mark.parametrize("aspect_ratio", [0.5, 1.0, 16 / 9])
+def test_grid_layout_fits_every_cell_in_max_dimension(count: int, aspect_ratio: float) -> None:
+    columns, rows, cell_width, cell_height = images.grid_layout(count, aspect_ratio, 1000)
+
+    assert columns * rows >= count
+    assert cell_width * columns <= 1000
+    assert cell_height * rows <= 1000
+    # no row left empty
+    assert (rows - 1) * columns < count
+
+
+def test_grid_layout_prefers_two_by_two_for_four_square_images() -> None:
+    assert images.grid_layout(4, 1.0, 1000) == (2, 2, 500, 500)
+
+
+def test_compose_grid_tiles_images_into_cells() -> None:
+    contents = [sample_image(600, 400) for _ in range(4)]
+    columns, rows, cell_width, cell_height = images.grid_layout(4, 600 / 400, SETTINGS.max_dimension)
+
+    processed = images.compose_grid(contents, SETTINGS)
+
+    assert processed.media_type == "image/jpeg"
+    with opened(processed.content) as grid:
+        assert grid.format == "JPEG"
+        assert grid.size == (cell_width * columns, cell_height * rows)
+        assert max(grid.size) <= SETTINGS.max_dimension
+
+
+def test_encode_keeps_quality_when_the_image_fits() -> None:
+    with opened(sample_image(400, 300, noise=True)) as image:
+        rgb = image.convert("RGB")
+        processed = images.encode(rgb, SETTINGS)
+
+        assert processed == images.encode(rgb, dataclasses.replace(SETTINGS, min_quality=SETTINGS.quality))
+    assert len(processed.content) <= SETTINGS.max_bytes
+
+
+def test_encode_steps_quality_down_until_min_quality() -> None:
+    tiny = dataclasses.replace(SETTINGS, max_bytes=1)
+    at_min_quality = dataclasses.replace(SETTINGS, quality=SETTINGS.min_quality)
+
+    with opened(sample_image(400, 300, noise=True)) as image:
+        rgb = image.convert("RGB")
+        processed = images.encode(rgb, tiny)
+        full_quality = images.encode(rgb, SETTINGS)
+
+        # can never fit in 1 byte, so it gives up at min_quality
+        assert processed == images.encode(rgb, at_min_quality)
+    assert len(processed.content) < len(full_quality.content)
+
+
+def test_encode_stops_at_the_first_quality_that_fits() -> None:
+    with opened(sample_image(400, 300, noise=True)) as image:
+        rgb = image.convert("RGB")
+        sizes = {
+            quality: len(images.encode(rgb, dataclasses.replace(SETTINGS, quality=quality, min_quality=quality)).content)
+            for quality in (90, 80, 70)
+        }
+        # room for quality 80 but not 90
+        processed = images.encode(rgb, dataclasses.replace(SETTINGS, max_bytes=sizes[80]))
+
+    assert len(processed.content) == sizes[80]
+
+
+def test_reencode_shrinks_large_images() -> None:
+    content = sample_image(3000, 2000, noise=True)
+
+    processed = images.reencode(content, SETTINGS)
+
+    assert processed.media_type == "image/jpeg"
+    assert len(processed.content) < len(content)
+    with opened(processed.content) as image:
+        assert image.size == (1000, 667)
+
+
+def test_reencode_keeps_small_images_that_would_grow() -> None:
+    content = sample_image(200, 100)
+
+    processed = images.reencode(content, SETTINGS)
+
+    assert processed == images.ProcessedImage(content, "image/png")
+
+
+def test_processor_runs_jobs_in_the_process_pool() -> None:
+    processor = images.ImageProcessor(workers=1, settings=SETTINGS)
+    contents = [sample_image(600, 400) for _ in range(2)]
+
+    async def process() -> tuple[images.ProcessedImage, images.ProcessedImage]:
+        return await processor.process(contents[:1]), await processor.process(contents)
+
+    try:
+        single, grid = asyncio.run(process())
+    finally:
+        processor.close()
+
+    assert single.content == contents[0]
+    assert grid.media_type == "image/jpeg"
+    assert (processor.stats.images, processor.stats.grids) == (3, 1)
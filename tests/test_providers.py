@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from csinspect.item import Item
+from csinspect.providers import ProviderProfile, ScreenshotEngine, ScreenshotUnavailableError
+from tests.fakes import FakeProvider
+
+ITEM = Item("steam://rungame/730/76561202255233023/+csgo_econ_action_preview%20S76561198000000000A1D2")
+
+
+def measured(engine: ScreenshotEngine, label: str, *latencies: float) -> ProviderProfile:
+    """The provider's profile, as if it had already rendered in each of `latencies`."""
+    (profile,) = (profile for profile in engine.profiles if label_of(profile) == label)
+    for latency in latencies:
+        profile.record(latency, success=True)
+    return profile
+
+
+def label_of(profile: ProviderProfile) -> str:
+    assert isinstance(profile.provider, FakeProvider)
+    return profile.provider.label
+
+
+def open_breaker(profile: ProviderProfile) -> None:
+    for _ in range(profile.breaker.failure_threshold):
+        profile.breaker.record_failure()
+    assert profile.breaker.state == "open"
+
+
+def test_routes_to_the_fastest_healthy_provider() -> None:
+    slow, fast = FakeProvider("slow", latency=0.01), FakeProvider("fast", latency=0.01)
+    engine = ScreenshotEngine([slow, fast])
+    measured(engine, "slow", 2.0, 2.0)
+    measured(engine, "fast", 0.5, 0.5)
+
+    assert [label_of(profile) for profile in engine.ranked()] == ["fast", "slow"]
+    assert asyncio.run(engine.screenshot(ITEM)) == f"https://fast.test/{ITEM.inspect_link}"
+    assert (fast.calls, slow.calls, engine.hedged) == (1, 0, 0)
+
+
+def test_ranks_unhealthy_providers_last() -> None:
+    failing, healthy = FakeProvider("failing", latency=0.01), FakeProvider("healthy", latency=0.01)
+    engine = ScreenshotEngine([failing, healthy])
+    profile = measured(engine, "failing", 0.1, 0.1)
+    measured(engine, "healthy", 1.0, 1.0)
+    # faster, but below SCREENSHOT_MIN_SUCCESS_RATE
+    for _ in range(4):
+        profile.record(0.1, success=False)
+
+    assert [label_of(profile) for profile in engine.ranked()] == ["healthy", "failing"]
+    assert asyncio.run(engine.screenshot(ITEM)) == f"https://healthy.test/{ITEM.inspect_link}"
+    assert failing.calls == 0
+
+
+def test_hedges_with_the_next_provider_past_the_percentile_deadline() -> None:
+    stuck, backup = FakeProvider("stuck", latency=5.0), FakeProvider("backup", latency=0.01)
+    engine = ScreenshotEngine([stuck, backup], hedge_percentile=0.95)
+    # usually answers within 50ms, so it's hedged after that
+    measured(engine, "stuck", 0.05, 0.05, 0.05)
+    measured(engine, "backup", 0.1, 0.1, 0.1)
+
+    started_at = time.monotonic()
+    image_link = asyncio.run(engine.screenshot(ITEM))
+
+    assert image_link == f"https://backup.test/{ITEM.inspect_link}"
+    assert time.monotonic() - started_at < 1.0
+    assert engine.hedged == 1
+    # the losing request is cancelled rather than left running
+    assert (stuck.calls, stuck.cancelled, backup.calls) == (1, 1, 1)
+
+
+def test_hedges_unmeasured_providers_after_hedge_delay() -> None:
+    stuck, backup = FakeProvider("stuck", latency=5.0), FakeProvider("backup", latency=0.01)
+    engine = ScreenshotEngine([stuck, backup], hedge_delay=0.05)
+
+    assert asyncio.run(engine.screenshot(ITEM)) == f"https://backup.test/{ITEM.inspect_link}"
+    assert engine.hedged == 1
+
+
+def test_skips_a_provider_whose_breaker_is_open() -> None:
+    broken, working = FakeProvider("broken", latency=0.01), FakeProvider("working", latency=0.01)
+    engine = ScreenshotEngine([broken, working])
+    open_breaker(measured(engine, "broken", 0.01, 0.01))
+    measured(engine, "working", 1.0, 1.0)
+
+    assert asyncio.run(engine.screenshot(ITEM)) == f"https://working.test/{ITEM.inspect_link}"
+    assert broken.calls == 0
+
+
+def test_is_unavailable_while_every_breaker_is_open() -> None:
+    provider = FakeProvider("broken")
+    engine = ScreenshotEngine([provider])
+    open_breaker(engine.profiles[0])
+
+    with pytest.raises(ScreenshotUnavailableError):
+        asyncio.run(engine.screenshot(ITEM))
+    assert provider.calls == 0
+
+
+def test_moves_on_right_away_when_a_provider_fails() -> None:
+    overloaded, backup = FakeProvider("overloaded", failure_rate=1.0), FakeProvider("backup", latency=0.01)
+    engine = ScreenshotEngine([overloaded, backup], hedge_delay=5.0)
+
+    started_at = time.monotonic()
+    assert asyncio.run(engine.screenshot(ITEM)) == f"https://backup.test/{ITEM.inspect_link}"
+    assert time.monotonic() - started_at < 1.0
+    assert engine.hedged == 0
+
+
+def test_opens_the_breaker_of_a_failing_provider() -> None:
+    overloaded = FakeProvider("overloaded", failure_rate=1.0)
+    engine = ScreenshotEngine([overloaded])
+    threshold = engine.profiles[0].breaker.failure_threshold
+
+    for _ in range(threshold + 3):
+        with pytest.raises(ScreenshotUnavailableError):
+            asyncio.run(engine.screenshot(ITEM))
+
+    # failing fast once it's open
+    assert overloaded.calls == threshold
+    assert engine.profiles[0].breaker.state == "open"
+
+
+def test_is_unavailable_when_no_provider_answers() -> None:
+    engine = ScreenshotEngine([FakeProvider("first", failure_rate=1.0), FakeProvider("second", failure_rate=1.0)])
+
+    with pytest.raises(ScreenshotUnavailableError):
+        asyncio.run(engine.screenshot(ITEM))
+
+
+def test_returns_none_when_a_provider_answers_it_cant_render() -> None:
+    engine = ScreenshotEngine([FakeProvider("first", failure_rate=1.0), FakeProvider("second", renders=False)])
+
+    assert asyncio.run(engine.screenshot(ITEM)) is None
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from csinspect.twitter import RateLimitedError, RateLimitScheduler
+
+ENDPOINT = "POST /2/tweets"
+
+
+def headers(remaining: int, *, limit: int = 100, reset_in: float = 600) -> httpx.Headers:
+    return httpx.Headers(
+        {
+            "x-rate-limit-limit": str(limit),
+            "x-rate-limit-remaining": str(remaining),
+            "x-rate-limit-reset": str(time.time() + reset_in),
+        }
+    )
+
+
+def test_calls_in_flight_stay_reserved_after_a_response() -> None:
+    scheduler = RateLimitScheduler(max_wait=0)
+
+    async def run() -> None:
+        await scheduler.acquire(ENDPOINT)
+        scheduler.update(ENDPOINT, headers(3))
+
+        # three calls admitted, the first reports back before the others reached Twitter
+        for _ in range(3):
+            await scheduler.acquire(ENDPOINT)
+        scheduler.update(ENDPOINT, headers(2))
+
+        # 2 remaining, 2 still in flight
+        with pytest.raises(RateLimitedError):
+            await scheduler.acquire(ENDPOINT)
+
+        scheduler.update(ENDPOINT, headers(1))
+        scheduler.update(ENDPOINT, headers(0))
+        with pytest.raises(RateLimitedError):
+            await scheduler.acquire(ENDPOINT)
+
+    asyncio.run(run())
+    assert scheduler.buckets[ENDPOINT].reserved == 0
+    assert scheduler.deferred == 2
+
+
+def test_failed_calls_are_released() -> None:
+    scheduler = RateLimitScheduler(max_wait=0)
+
+    async def run() -> None:
+        await scheduler.acquire(ENDPOINT)
+        scheduler.update(ENDPOINT, headers(1))
+        await scheduler.acquire(ENDPOINT)
+        # a transport error, no headers
+        scheduler.update(ENDPOINT, None)
+        await scheduler.acquire(ENDPOINT)
+
+    asyncio.run(run())
+    assert scheduler.buckets[ENDPOINT].reserved == 1
+
+
+def test_new_window_admits_calls_again() -> None:
+    scheduler = RateLimitScheduler(max_wait=0)
+
+    async def run() -> None:
+        await scheduler.acquire(ENDPOINT)
+        scheduler.update(ENDPOINT, headers(0, reset_in=-1))
+        await scheduler.acquire(ENDPOINT)
+
+    asyncio.run(run())
+    assert scheduler.deferred == 0